@@ -55,7 +55,7 @@ a = Analysis(
     datas=added_datas + encodings_datas,  
     hiddenimports=[
     'execution_sql', 'reaction_sql', 'memory_main', 'pageboost_main',
-    'sql_query', 'atracetosystrace', 'backup_query',
+    'sql_query', 'atracetosystrace', 'backup_query', 'trace_cache', 'trace_loader', 'trace_processor_pool', 'batch_engine', 'memory_scheduler', 'trace_worker', 'startup_stdlib', 'slice_index', 'slice_tables', 'sched_cpu', 'thread_state_timeline', 'reaction_analysis',
     # MemoryStatus modules
     'MemoryStatus', 'MemoryStatus.memory_main', 'MemoryStatus.abnormal_memory',
     'MemoryStatus.app_start_kill_analyzer', 'MemoryStatus.analyze_pss',
@@ -1,105 +1,747 @@
-
+import gzip
 import logging
+import mmap
 import os
-import sys
+import zipfile
 import zlib
 import re
 import io
-def convert_trace(input_file):
-    result = None
+from collections import defaultdict
+from contextlib import contextmanager
 
-    with open(input_file, 'rb') as f:
-        result = f.read()
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
-    if not len(result) or not (b'\nTRACE:' in result):
-        logging.warning(
-            '\nNo atrace data was captured. Output file was not written.')
-        raise Exception("invalid input file")
+TRACE_MARKER = b'\nTRACE:'
+# Input nén đọc từng block từ mmap, output giải nén bị chặn theo block
+# để không bao giờ giữ hai bản full-size của trace cùng lúc.
+READ_CHUNK_SIZE = 1 << 20
+DECOMPRESS_CHUNK_SIZE = 4 << 20
+LLVM_SUFFIX_RE = re.compile(rb'tracing_mark_write\.llvm\.\d+:')
+LEADING_NEWLINES_RE = re.compile(rb'\n*')
+# Input nén/đóng gói được đọc stream trực tiếp vào conversion (không giải nén ra file tạm).
+# Chỉ nhận '.log.zip' (zip chứa .log) để không lẫn với Bugreport .zip cùng folder.
+COMPRESSED_TRACE_SUFFIXES = ('.log.gz', '.log.zst', '.log.zip')
+TRACE_FILE_SUFFIXES = ('.log',) + COMPRESSED_TRACE_SUFFIXES
+# Viewer assets (prefix/suffix đã encode), cache theo process - xem load_html_assets
+_HTML_ASSETS = None
+
+# Launch window cropping: [deliverInputEvent đầu tiên - before, end anchor cuối cùng + after]
+LAUNCH_START_ANCHOR = b'deliverInputEvent'
+LAUNCH_END_ANCHORS = (b'activityIdle', b'animating', b'StartPreviewRequest', b'launching:')
+DEFAULT_CROP_MARGINS_NS = (500_000_000, 1_000_000_000)
+TIMESTAMP_RE = re.compile(rb' (\d+)\.(\d+): ')
+# Event filter: chỉ giữ các ftrace event mà sql_query thực sự dùng
+# (slice từ tracing_mark_write, sched_slice, thread_state, thread/process metadata)
+DEFAULT_EVENT_ALLOWLIST = (
+    'tracing_mark_write', 'print',
+    'sched_switch', 'sched_wakeup', 'sched_wakeup_new', 'sched_waking',
+    'sched_blocked_reason', 'sched_process_exit', 'sched_process_free',
+    'task_newtask', 'task_rename',
+)
+FILTER_BLOCK_SIZE = 4 << 20
+TRACING_MARK_RE = re.compile(rb'-(\d+) +(?:\([ \d-]+\) +)?\[\d+\][^\n]*?tracing_mark_write: ([BESF])([^\n]*)')
+# Pre-scan: lý do loại trace khi file không đọc/giải nén được
+PRESCAN_INVALID_FORMAT = 'invalid_format'
+PRESCAN_CORRUPT_PAYLOAD = 'corrupt_payload'
+PRESCAN_EMPTY_TRACE = 'empty_trace'
+# Lỗi giải nén (zlib payload hoặc lớp nén ngoài gz/zst/zip) -> corrupt_payload
+CORRUPT_PAYLOAD_ERRORS = (zlib.error, EOFError, gzip.BadGzipFile, zipfile.BadZipFile) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
 
-    parts = result.split(b'\nTRACE:', 1)
 
-    data = parts[1]
-    size = 4096
-    trace_data = []
-    for chunk in (data[i:i + size] for i in range(0, len(data), size)):
-        trace_data.append(chunk.decode('latin-1'))
-        
+def load_trace_data(input_file, crop_window=None, event_allowlist=None, stats=None):
+    """
+    Đọc atrace .log qua mmap và trả về ftrace text (bytearray) đã giải nén,
+    bỏ CR, chuẩn hoá '.llvm.N' và fix circular buffer.
 
-    trace_data = ''.join(trace_data)
+    crop_window: None (giữ nguyên) hoặc (margin_before_ns, margin_after_ns)
+                 để chỉ giữ lại launch window (xem crop_launch_window).
+    event_allowlist: None (giữ nguyên) hoặc danh sách tên event được giữ lại
+                     (xem filter_ftrace_events).
+    stats: dict tuỳ chọn để nhận thống kê của các bước conversion.
+    """
+    with open_trace_source(input_file) as raw_chunks:
+        if raw_chunks is None:
+            logging.warning(
+                '\nNo atrace data was captured. Output file was not written.')
+            raise Exception("invalid input file")
 
-    if trace_data:
-        trace_data = strip_and_decompress_trace(trace_data)
+        trace_data = bytearray()
+        for chunk in _iter_payload(raw_chunks):
+            trace_data += chunk
+
+    # Bỏ các dòng trống ở đầu: chỉ quét phần '\n' đầu buffer rồi xoá in-place
+    leading = LEADING_NEWLINES_RE.match(trace_data).end()
+    if leading:
+        del trace_data[:leading]
 
     trace_data = fix_circular_traces(trace_data)
-    # print(type(trace_data))
+    if crop_window is not None:
+        trace_data = crop_launch_window(trace_data, *crop_window, stats=stats)
+    if event_allowlist is not None:
+        trace_data = filter_ftrace_events(trace_data, event_allowlist, stats=stats)
     if not trace_data:
         logging.warning(
             '\nNo atrace data was captured. Output file was not written.')
         raise Exception("invalid input file")
+    return trace_data
+
+
+def is_trace_file(name):
+    """True nếu tên file là atrace log (.log hoặc dạng nén, xem TRACE_FILE_SUFFIXES)."""
+    return str(name).lower().endswith(TRACE_FILE_SUFFIXES)
+
+
+def trace_stem(path):
+    """
+    Tên file bỏ phần đuôi trace ('a_camera.log.gz' -> 'a_camera'), dùng thay
+    Path.stem để grouping app/occurrence không đổi khi input bị nén.
+    """
+    name = os.path.basename(str(path))
+    lower = name.lower()
+    for suffix in TRACE_FILE_SUFFIXES:
+        if lower.endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+
+@contextmanager
+def open_trace_source(input_file):
+    """
+    Mở atrace input và yield iterator các block raw ngay sau 'TRACE:'
+    (None nếu file rỗng / không có marker).
+    - .log: mmap, không copy
+    - .log.gz / .log.zst / .log.zip: giải nén stream theo block
+    """
+    lower = str(input_file).lower()
+    if not lower.endswith(COMPRESSED_TRACE_SUFFIXES):
+        with open(input_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield None
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                marker = mm.find(TRACE_MARKER)
+                yield None if marker == -1 else _iter_mmap_chunks(mm, marker + len(TRACE_MARKER))
+        return
+
+    with _open_compressed_stream(input_file) as stream:
+        yield _iter_after_marker(_iter_stream_chunks(stream))
+
+
+@contextmanager
+def _open_compressed_stream(input_file):
+    lower = str(input_file).lower()
+    if lower.endswith('.log.gz'):
+        with gzip.open(input_file, 'rb') as stream:
+            yield stream
+    elif lower.endswith('.log.zst'):
+        if zstandard is None:
+            raise ImportError("Cần package 'zstandard' để đọc trace .log.zst (pip install zstandard)")
+        with open(input_file, 'rb') as f:
+            with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                yield stream
+    else:
+        with zipfile.ZipFile(input_file) as zf:
+            members = [m for m in zf.namelist() if m.lower().endswith('.log')] or zf.namelist()
+            if not members:
+                raise Exception("invalid input file")
+            with zf.open(members[0]) as stream:
+                yield stream
+
+
+def _iter_stream_chunks(stream):
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _iter_after_marker(chunks):
+    """Bỏ qua mọi thứ tới hết TRACE_MARKER trên stream (marker có thể vắt qua 2 block)."""
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk
+        marker = data.find(TRACE_MARKER)
+        if marker != -1:
+            rest = data[marker + len(TRACE_MARKER):]
+            if rest:
+                yield rest
+            yield from chunks
+            return
+        carry = data[-(len(TRACE_MARKER) - 1):]
+    raise ValueError(PRESCAN_INVALID_FORMAT)
+
+
+def _iter_payload(raw_chunks):
+    """
+    ftrace text theo từng block từ iterator block raw sau 'TRACE:' (mmap hoặc
+    stream giải nén). Tương đương strip_and_decompress_trace cũ nhưng streaming.
+    """
+    first = b''
+    for chunk in raw_chunks:
+        first += chunk
+        if len(first) >= 3:
+            break
+    head = first[:3]
+    if head.startswith(b'\r\n'):
+        newline_token = b'\r\n'
+    elif head.startswith(b'\r\r\n'):
+        newline_token = b'\r\r\n'
+    else:
+        newline_token = None
+
+    raw_chunks = _iter_prepend(first, raw_chunks)
+    if newline_token:
+        raw_chunks = _iter_newline_fixed(raw_chunks, newline_token)
+    raw_chunks = _iter_skip_bytes(raw_chunks, 1)
+
+    first = next(raw_chunks, b'')
+    if first.startswith(b'# tracer'):
+        text_chunks = _iter_prepend(first, raw_chunks)
     else:
-        # sys.stdout.write("\nConverting to systrace...")
-        sys.stdout.flush()
+        text_chunks = _iter_decompressed(_iter_prepend(first, raw_chunks))
+
+    return _iter_normalized(text_chunks)
+
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    html_prefix = read_asset(script_dir, 'prefix.html')
-    html_suffix = read_asset(script_dir, 'suffix.html')
-    trace_viewer_html = read_asset(script_dir, 'systrace_trace_viewer.html')
-	
+def _iter_mmap_chunks(mm, offset):
+    size = len(mm)
+    while offset < size:
+        yield mm[offset:offset + READ_CHUNK_SIZE]
+        offset += READ_CHUNK_SIZE
 
+
+def _iter_prepend(first, chunks):
+    if first:
+        yield first
+    yield from chunks
+
+
+def _iter_skip_bytes(chunks, count):
+    for chunk in chunks:
+        if count:
+            skipped = min(count, len(chunk))
+            chunk = chunk[skipped:]
+            count -= skipped
+        if chunk:
+            yield chunk
+
+
+def _iter_newline_fixed(chunks, token):
+    """Thay token ('\\r\\n' / '\\r\\r\\n') bằng '\\n', kể cả khi token nằm vắt qua 2 block."""
+    carry = b''
+    for chunk in chunks:
+        chunk = carry + chunk
+        # Giữ lại phần cuối có thể là đầu của token chưa đủ
+        keep = 0
+        for n in range(len(token) - 1, 0, -1):
+            if chunk.endswith(token[:n]):
+                keep = n
+                break
+        if keep:
+            chunk, carry = chunk[:-keep], chunk[-keep:]
+        else:
+            carry = b''
+        yield chunk.replace(token, b'\n')
+    if carry:
+        yield carry
+
+
+def _iter_decompressed(chunks):
+    decompressor = zlib.decompressobj()
+    for chunk in chunks:
+        data = chunk
+        while data:
+            out = decompressor.decompress(data, DECOMPRESS_CHUNK_SIZE)
+            if out:
+                yield out
+            data = decompressor.unconsumed_tail
+        if decompressor.eof:
+            break
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+    # Hết input mà chưa tới cuối stream zlib: capture bị cắt, không decode thành trace cụt
+    if not decompressor.eof:
+        raise zlib.error('Error -5 while decompressing data: incomplete or truncated stream')
+
+
+def _iter_normalized(chunks):
+    """Bỏ '\\r' và chuẩn hoá 'tracing_mark_write.llvm.N:' theo từng dòng hoàn chỉnh."""
+    carry = b''
+    for chunk in chunks:
+        chunk = carry + chunk.replace(b'\r', b'')
+        cut = chunk.rfind(b'\n') + 1
+        chunk, carry = chunk[:cut], chunk[cut:]
+        if chunk:
+            yield _normalize_lines(chunk)
+    if carry:
+        yield _normalize_lines(carry)
+
+
+def _normalize_lines(chunk):
+    if b'tracing_mark_write.llvm' in chunk:
+        chunk = LLVM_SUFFIX_RE.sub(b'tracing_mark_write:', chunk)
+    return chunk
+
+
+class TraceBufferReader(io.RawIOBase):
+    """File-like read-only trên buffer ftrace, mỗi read() chỉ copy một block."""
+
+    def __init__(self, buffer):
+        super().__init__()
+        self._view = memoryview(buffer)
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._view)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._view) - self._pos
+        data = bytes(self._view[self._pos:self._pos + size])
+        self._pos += len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def convert_trace_raw(input_file, crop_window=None, event_allowlist=None, stats=None):
+    """
+    Ingestion path cho trace_processor: chỉ trả về ftrace text (đã giải nén
+    và fix circular), không dựng HTML systrace.
+    """
+    trace_data = load_trace_data(input_file, crop_window=crop_window,
+                                 event_allowlist=event_allowlist, stats=stats)
+    return TraceBufferReader(trace_data)
+
+
+def convert_trace(input_file):
+    """Dựng systrace HTML (viewer) trong BytesIO. Chỉ dùng cho export."""
     html_bytesio = io.BytesIO()
-    html_prefix = html_prefix.replace('{{SYSTRACE_TRACE_VIEWER_HTML}}', trace_viewer_html)
-    html_bytesio.write(html_prefix.encode('latin-1'))
-
-    html_bytesio.write(b'<!-- BEGIN TRACE -->\n')
-    html_bytesio.write(b'  <script class="')
-    html_bytesio.write(b'trace-data')
-    html_bytesio.write(b'" type="application/text">\n')
-    html_bytesio.write(trace_data.encode('utf-8'))
-    html_bytesio.write(b'  </script>\n')
-    html_bytesio.write(b'<!-- END TRACE -->\n')
-
-    html_bytesio.write(html_suffix.encode('utf-8'))
+    write_trace_html(load_trace_data(input_file), html_bytesio)
     html_bytesio.seek(0)
-    # print(" done")
-
     return html_bytesio
 
 
+def export_html(input_file, output_file):
+    """
+    Export opt-in: ghi systrace HTML của một trace ra file.
+    Stream thẳng xuống đĩa (file tạm + os.replace), không dựng HTML trong bộ nhớ.
+    """
+    trace_data = load_trace_data(input_file)
+    tmp_file = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            write_trace_html(trace_data, f)
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return output_file
+
+
+def write_trace_html(trace_data, out):
+    """Ghi prefix viewer + trace_data + suffix vào stream out (file hoặc BytesIO)."""
+    html_prefix, html_suffix = load_html_assets()
+    out.write(html_prefix)
+    out.write(b'<!-- BEGIN TRACE -->\n')
+    out.write(b'  <script class="')
+    out.write(b'trace-data')
+    out.write(b'" type="application/text">\n')
+    _write_latin1_as_utf8(trace_data, out)
+    out.write(b'  </script>\n')
+    out.write(b'<!-- END TRACE -->\n')
+    out.write(html_suffix)
+
+
+def _write_latin1_as_utf8(trace_data, out):
+    """
+    Ghi trace_data như convert_trace cũ (decode latin-1 rồi encode utf-8) nên byte
+    không phải ASCII giữ đúng HTML cũ. Trace ASCII ghi thẳng, còn lại theo block.
+    """
+    if trace_data.isascii():
+        out.write(trace_data)
+        return
+    view = memoryview(trace_data)
+    for pos in range(0, len(view), READ_CHUNK_SIZE):
+        out.write(bytes(view[pos:pos + READ_CHUNK_SIZE]).decode('latin-1').encode('utf-8'))
+    view.release()
+
+
+def load_html_assets():
+    """
+    (prefix, suffix) đã encode của systrace viewer. Đọc một lần mỗi process
+    (trace_viewer ~ vài MB), các lần export sau dùng lại.
+    """
+    global _HTML_ASSETS
+    if _HTML_ASSETS is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        html_prefix = read_asset(script_dir, 'prefix.html')
+        html_suffix = read_asset(script_dir, 'suffix.html')
+        trace_viewer_html = read_asset(script_dir, 'systrace_trace_viewer.html')
+        html_prefix = html_prefix.replace('{{SYSTRACE_TRACE_VIEWER_HTML}}', trace_viewer_html)
+        _HTML_ASSETS = (html_prefix.encode('latin-1'), html_suffix.encode('utf-8'))
+    return _HTML_ASSETS
+
+
 def read_asset(src_dir, filename):
-    return open(os.path.join(src_dir, filename), encoding = "latin-1").read()
+    with open(os.path.join(src_dir, filename), encoding="latin-1") as f:
+        return f.read()
 
-def strip_and_decompress_trace(trace_data):
 
-    if trace_data.startswith('\r\n'):
-        trace_data = trace_data.replace('\r\n', '\n')
-    elif trace_data.startswith('\r\r\n'):
-        trace_data = trace_data.replace('\r\r\n', '\n')
+def _export_html_worker(args):
+    input_file, output_file = args
+    try:
+        export_html(input_file, output_file)
+        return input_file, output_file, None
+    except Exception as e:
+        return input_file, None, str(e)
 
-    trace_data = trace_data[1:]
 
-    if not trace_data.startswith('# tracer'):
-        trace_data = zlib.decompress(trace_data.encode('latin-1'))
+def export_html_folder(folder, output_dir=None, num_workers=None):
+    """
+    Export HTML cho toàn bộ trace trong folder bằng process pool.
+    Mỗi worker load viewer assets một lần (initializer), mỗi HTML stream thẳng ra đĩa.
+    Trả về list các file HTML đã tạo.
+    """
+    from multiprocessing import Pool, cpu_count
+
+    output_dir = output_dir or folder
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(os.path.join(folder, name), os.path.join(output_dir, trace_stem(name) + '.html'))
+             for name in sorted(os.listdir(folder))
+             if is_trace_file(name) and os.path.isfile(os.path.join(folder, name))]
+    num_workers = max(1, min(num_workers or cpu_count(), len(tasks) or 1))
+
+    print(f"[HTML] Exporting {len(tasks)} traces with {num_workers} workers -> {output_dir}")
+    created = []
+    with Pool(processes=num_workers, initializer=load_html_assets) as pool:
+        for i, (input_file, output_file, error) in enumerate(pool.imap_unordered(_export_html_worker, tasks)):
+            name = os.path.basename(input_file)
+            if error:
+                print(f"  - [{i+1}/{len(tasks)}] [ERROR] {name}: {error}")
+            else:
+                created.append(output_file)
+                print(f"  - [{i+1}/{len(tasks)}] {name}")
+    return created
+
+BUFFER_STARTED_RE = re.compile(rb'#+ CPU \d+ buffer started')
 
-    trace_data = trace_data.decode('latin-1').replace('\r', '')
-    if 'tracing_mark_write.llvm' in trace_data:
-        trace_data = re.sub(r'tracing_mark_write\.llvm\.\d+:', 'tracing_mark_write:', trace_data)
-    
-    while trace_data and trace_data[0] == '\n':
-        trace_data = trace_data[1:]
-    return trace_data
 
 def fix_circular_traces(out):
-    buffer_start_re = re.compile(r'^#+ CPU \d+ buffer started', re.MULTILINE)
-    start_of_full_trace = 0
+    """
+    Bỏ phần trace trước marker '# CPU N buffer started' cuối cùng (circular buffer).
+    - Tìm marker cuối bằng một lần quét ngược (rfind), không search lặp từ đầu.
+    - bytearray: cắt in-place (memmove), không tạo thêm bản copy full-size.
+    """
+    start_of_full_trace = find_last_buffer_start(out)
+
+    if start_of_full_trace > 0:
+        end_of_header = find_end_of_header(out)
+        if isinstance(out, bytearray) and end_of_header <= start_of_full_trace:
+            del out[end_of_header:start_of_full_trace]
+        else:
+            out = out[:end_of_header] + out[start_of_full_trace:]
+    return out
+
+
+def find_last_buffer_start(out):
+    """Vị trí đầu dòng của marker 'buffer started' cuối cùng (0 nếu không có)."""
+    pos = len(out)
+    while True:
+        hit = out.rfind(b' buffer started', 0, pos)
+        if hit == -1:
+            return 0
+        line_start = out.rfind(b'\n', 0, hit) + 1
+        if BUFFER_STARTED_RE.match(out, line_start):
+            return line_start
+        pos = hit
+
+
+def find_end_of_header(out):
+    """Vị trí dòng đầu tiên không bắt đầu bằng '#'."""
+    pos = 0
+    while out[pos:pos + 1] == b'#':
+        next_line = out.find(b'\n', pos)
+        if next_line == -1:
+            return len(out)
+        pos = next_line + 1
+    return pos
 
+
+def crop_launch_window(trace_data, margin_before_ns, margin_after_ns, stats=None):
+    """
+    Chỉ giữ các event trong launch window trước khi ingest:
+        [deliverInputEvent đầu tiên - margin_before, end anchor cuối cùng + margin_after]
+    End anchor: activityIdle / animating / StartPreviewRequest / launching:.
+
+    Ngoài window vẫn giữ:
+    - Header (các dòng '#').
+    - sched_switch cuối cùng của mỗi CPU trước window (seed thread_state).
+    - tracing_mark_write B / async S còn đang mở tại đầu window (để slice
+      vắt qua biên window vẫn có đầu/cuối).
+
+    Lưu ý: các query 'first in trace' (vd. activityStart đầu tiên) chỉ nhìn thấy
+    dữ liệu trong window, nên đây là option, mặc định tắt.
+    Nếu không tìm thấy anchor, trả về trace nguyên vẹn.
+    """
+    header_end = find_end_of_header(trace_data)
+    start_ts = _find_anchor_ts(trace_data, header_end, LAUNCH_START_ANCHOR, last=False)
+    end_candidates = [_find_anchor_ts(trace_data, header_end, anchor, last=True)
+                      for anchor in LAUNCH_END_ANCHORS]
+    end_candidates = [ts for ts in end_candidates if ts is not None]
+    if start_ts is None or not end_candidates:
+        return trace_data
+
+    window_start = _find_line_at_ts(trace_data, header_end, start_ts - margin_before_ns)
+    window_end = _find_line_at_ts(trace_data, window_start, max(end_candidates) + margin_after_ns)
+
+    original_size = len(trace_data)
+    seed_lines = _collect_seed_lines(trace_data, header_end, window_start)
+
+    # Cắt in-place: bỏ đuôi trước, rồi thay phần trước window bằng seed lines
+    del trace_data[window_end:]
+    trace_data[header_end:window_start] = b''.join(seed_lines)
+
+    if stats is not None:
+        stats['crop_window_ns'] = (start_ts - margin_before_ns, max(end_candidates) + margin_after_ns)
+        stats['crop_bytes_removed'] = original_size - len(trace_data)
+        stats['crop_seed_lines'] = len(seed_lines)
+    return trace_data
+
+
+def _parse_ts_ns(line):
+    match = TIMESTAMP_RE.search(line)
+    if not match:
+        return None
+    sec, frac = match.groups()
+    return int(sec) * 1_000_000_000 + int(frac[:9].ljust(9, b'0'))
+
+
+def _line_bounds(buf, pos):
+    start = buf.rfind(b'\n', 0, pos) + 1
+    end = buf.find(b'\n', pos)
+    return start, (len(buf) if end == -1 else end + 1)
+
+
+def _find_anchor_ts(buf, header_end, anchor, last):
+    """Timestamp của dòng tracing_mark_write đầu tiên/cuối cùng chứa anchor."""
+    pos = len(buf) if last else header_end
     while True:
-        result = buffer_start_re.search(out, start_of_full_trace + 1)
-        if result:
-            start_of_full_trace = result.start()
+        hit = buf.rfind(anchor, header_end, pos) if last else buf.find(anchor, pos)
+        if hit == -1:
+            return None
+        start, end = _line_bounds(buf, hit)
+        line = buf[start:end]
+        if b'tracing_mark_write' in line:
+            ts = _parse_ts_ns(line)
+            if ts is not None:
+                return ts
+        pos = hit if last else end
+
+
+def _find_line_at_ts(buf, lo, target_ns):
+    """
+    Binary search (ftrace text đã sort theo ts) -> offset của dòng đầu tiên có ts >= target.
+    Dòng không có timestamp (marker, dòng trống) được bỏ qua bằng cách nhảy sang dòng kế.
+    """
+    hi = len(buf)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        line_start = buf.rfind(b'\n', lo, mid) + 1 or lo
+        ts, line_end = None, line_start
+        while ts is None and line_end < hi:
+            start, line_end = _line_bounds(buf, line_end)
+            ts = _parse_ts_ns(buf[start:line_end])
+        if ts is None or ts >= target_ns:
+            hi = line_start
         else:
+            lo = line_end
+    return lo
+
+
+def _collect_seed_lines(buf, header_end, window_start):
+    """Các dòng trước window cần giữ lại để seed state, theo thứ tự gốc."""
+    if window_start <= header_end:
+        return []
+
+    seeds = {}
+
+    # 1. sched_switch cuối cùng của mỗi CPU (quét ngược từ đầu window)
+    num_cpus = re.search(rb'#P:(\d+)', buf[:header_end])
+    num_cpus = int(num_cpus.group(1)) if num_cpus else None
+    seen_cpus = set()
+    pos = window_start
+    while num_cpus is None or len(seen_cpus) < num_cpus:
+        hit = buf.rfind(b' sched_switch: ', header_end, pos)
+        if hit == -1:
             break
+        start, end = _line_bounds(buf, hit)
+        cpu_match = re.search(rb'\[(\d+)\]', buf[start:hit])
+        if cpu_match and cpu_match.group(1) not in seen_cpus:
+            seen_cpus.add(cpu_match.group(1))
+            seeds[start] = end
+        pos = start
 
-    if start_of_full_trace > 0:
-        end_of_header = re.search(r'^[^#]', out, re.MULTILINE).start()
-        out = out[:end_of_header] + out[start_of_full_trace:]
-    return out
+    # 2. B (theo tid) và async S (theo tgid|name|cookie) còn mở tại đầu window
+    open_slices = defaultdict(list)
+    open_async = {}
+    for match in TRACING_MARK_RE.finditer(buf, header_end, window_start):
+        tid, phase, payload = match.groups()
+        if phase == b'B':
+            open_slices[tid].append(match.start())
+        elif phase == b'E':
+            if open_slices[tid]:
+                open_slices[tid].pop()
+        elif phase == b'S':
+            open_async[payload.rstrip()] = match.start()
+        elif phase == b'F':
+            open_async.pop(payload.rstrip(), None)
+
+    for pos in [p for stack in open_slices.values() for p in stack] + list(open_async.values()):
+        start, end = _line_bounds(buf, pos)
+        seeds[start] = end
+
+    return [bytes(buf[start:seeds[start]]) for start in sorted(seeds)]
+
+
+_EVENT_FILTER_CACHE = {}
+
+
+def _event_filter_pattern(allowlist):
+    """Regex match cả dòng event KHÔNG nằm trong allow-list (dòng '#' không bị động tới)."""
+    key = tuple(sorted(allowlist))
+    if key not in _EVENT_FILTER_CACHE:
+        names = b'|'.join(re.escape(name.encode('ascii')) for name in key)
+        _EVENT_FILTER_CACHE[key] = re.compile(
+            rb'^[^#\n][^\n]*? \d+\.\d+: (?!(?:' + names + rb'):)[^\s:]+:[^\n]*(?:\n|\Z)',
+            re.MULTILINE)
+    return _EVENT_FILTER_CACHE[key]
+
+
+def filter_ftrace_events(trace_data, allowlist, stats=None):
+    """
+    Bỏ các dòng ftrace event không nằm trong allow-list trước khi ingest.
+    Xử lý theo block (cắt ở biên dòng) và ghi đè in-place vào bytearray,
+    nên bộ nhớ phụ chỉ cỡ FILTER_BLOCK_SIZE.
+    """
+    pattern = _event_filter_pattern(allowlist)
+    size = len(trace_data)
+    read = write = find_end_of_header(trace_data)
+    events_removed = 0
+
+    while read < size:
+        end = trace_data.find(b'\n', min(read + FILTER_BLOCK_SIZE, size) - 1)
+        end = size if end == -1 else end + 1
+        kept, removed = pattern.subn(b'', bytes(trace_data[read:end]))
+        trace_data[write:write + len(kept)] = kept
+        write += len(kept)
+        read = end
+        events_removed += removed
+
+    del trace_data[write:]
+
+    if stats is not None:
+        stats['filter_events_removed'] = events_removed
+        stats['filter_bytes_removed'] = size - write
+    return trace_data
+
+
+def find_missing_markers(data, required):
+    """
+    required: {marker (bytes): reason}. Trả về list reason của các marker
+    không có trong data (bytes/bytearray/mmap), theo thứ tự của required.
+    """
+    return [reason for marker, reason in required.items() if data.find(marker) == -1]
+
+
+def scan_trace_markers(input_file, markers):
+    """
+    Stream payload (giải nén nếu cần) và trả về set các marker tìm thấy.
+    Dừng ngay khi đã thấy đủ marker; giữ lại đuôi mỗi block để không
+    bỏ sót marker nằm vắt qua biên block.
+    """
+    pending = set(markers)
+    found = set()
+    overlap = max((len(m) for m in markers), default=1) - 1
+    tail = b''
+    seen_payload = False
+
+    if os.path.getsize(input_file) == 0:
+        raise ValueError(PRESCAN_EMPTY_TRACE)
+    with open_trace_source(input_file) as raw_chunks:
+        if raw_chunks is None:
+            raise ValueError(PRESCAN_INVALID_FORMAT)
+        for chunk in _iter_payload(raw_chunks):
+            if not chunk:
+                continue
+            seen_payload = True
+            window = tail + chunk
+            for marker in list(pending):
+                if marker in window:
+                    pending.discard(marker)
+                    found.add(marker)
+            if not pending:
+                break
+            tail = window[-overlap:] if overlap else b''
+
+    if not seen_payload:
+        raise ValueError(PRESCAN_EMPTY_TRACE)
+    return found
+
+
+def prescan_trace(input_file, required):
+    """
+    Kiểm tra nhanh ở mức byte trước khi spawn trace_processor.
+    required: {marker: reason}. Trả về reason (str) nếu trace bị loại, None nếu dùng được.
+    """
+    try:
+        found = scan_trace_markers(input_file, required)
+    except CORRUPT_PAYLOAD_ERRORS:
+        return PRESCAN_CORRUPT_PAYLOAD
+    except ValueError as e:
+        return str(e)
+    except OSError:
+        return PRESCAN_INVALID_FORMAT
+    for marker, reason in required.items():
+        if marker not in found:
+            return reason
+    return None
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Export atrace logs to systrace HTML viewer files')
+    parser.add_argument('input', help='Trace file (.log/.log.gz/...) or a folder of traces')
+    parser.add_argument('output', nargs='?', default=None,
+                        help='Output .html (single trace) or output folder (default: next to input)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for folder export')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        created = export_html_folder(args.input, args.output, args.workers)
+        print(f"Created {len(created)} HTML files")
+        return
+
+    output_file = args.output or os.path.join(os.path.dirname(args.input), trace_stem(args.input) + '.html')
+    export_html(args.input, output_file)
+    print(f"Created: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
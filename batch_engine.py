@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+batch_engine.py
+
+Engine phân tích theo lô dựa trên perfetto BatchTraceProcessor: load nhiều
+trace cùng lúc và chạy mỗi query "dùng chung" (SQL giống hệt nhau cho mọi
+trace, vd. launcher pid, animating, background process...) đúng một lần trên
+cả lô bằng query_and_flatten. Frame gộp (cột _path) được tách theo trace và
+phục vụ lại cho analyze_trace qua PrefetchedTraceProcessor, nên metrics dict
+trả về giữ nguyên format mà create_sheet đang dùng. Helper tìm slice được
+SliceIndex trả lời trong bộ nhớ nên chỉ được prefetch khi index tắt.
+
+Query có tham số riêng của từng trace (tid, upid, khoảng thời gian) vẫn chạy
+trên trace_processor của trace đó, song song trên thread pool của batch.
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from perfetto.batch_trace_processor.api import (
+    BatchTraceProcessor, BatchTraceProcessorConfig, FailureHandling,
+)
+from perfetto.trace_processor.api import TraceProcessorConfig
+
+from sql_query import (
+    ensure_slice_with_names_view, find_slice, detect_app_from_launch, find_app_process,
+    get_first_deliver_input, get_end_deliver_input, get_launcher_pid, get_activity_idle_end,
+    get_start_proc_start, get_animating, get_pid_list, get_background_process_states,
+)
+import slice_index
+from slice_tables import prepare_slice_tables
+from trace_processor_pool import TraceTimeout, kill_trace_processor, set_query_timeout, trace_deadline
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+# Số trace tối đa load cùng lúc trong một BatchTraceProcessor (mỗi trace một shell)
+BATCH_MAX_TRACES = 32
+BATCH_LOAD_TIMEOUT_S = 300
+
+# Các hàm sql_query có SQL không phụ thuộc tham số của trace -> chạy một lần cho cả lô.
+# SQL được lấy bằng cách gọi chính hàm đó với _RecordingTraceProcessor, nên luôn
+# khớp từng ký tự với câu query mà analyze_trace sẽ gửi. Helper tìm slice
+# (detect_app_from_launch, find_app_process...) chỉ gửi SQL khi SliceIndex tắt.
+EXECUTION_SHARED_QUERIES = (
+    detect_app_from_launch,
+    lambda tp: find_app_process(tp, ''),
+    get_first_deliver_input,
+    get_animating,
+    lambda tp: get_activity_idle_end(tp, 0),
+    lambda tp: get_start_proc_start(tp, ''),
+    get_launcher_pid,
+    lambda tp: get_end_deliver_input(tp, 0),
+    lambda tp: find_slice(tp, name_exact='activityResume'),
+    get_pid_list,
+    lambda tp: get_background_process_states(tp, 1, 2),
+)
+
+
+class _RecordingTraceProcessor:
+    """
+    Giả TraceProcessor: chỉ ghi lại SQL, mọi query trả về rỗng. Khi SliceIndex
+    bật, recorder mang một index rỗng giống tp mà analyze_trace gắn index, nên
+    helper trả lời từ index không ghi SQL (frame đó sẽ không bao giờ được đọc).
+    """
+
+    def __init__(self):
+        self.sqls = []
+        if slice_index.SLICE_INDEX_ENABLED:
+            self.slice_index = slice_index.SliceIndex(
+                pd.DataFrame(columns=['name', *slice_index.ID_COLUMNS]))
+
+    def query(self, sql):
+        self.sqls.append(sql)
+        return None
+
+
+def shared_query_sqls(query_fns: Iterable[Callable]) -> List[str]:
+    """SQL (không trùng, giữ thứ tự) mà các hàm query_fns gửi đi."""
+    recorder = _RecordingTraceProcessor()
+    for fn in query_fns:
+        try:
+            fn(recorder)
+        except Exception:
+            # vd. get_animating raise khi không có kết quả - SQL đã được ghi lại
+            pass
+    return list(dict.fromkeys(recorder.sqls))
+
+
+class _PrefetchedResult:
+    """Kết quả query đã lấy sẵn từ batch, cùng interface query_df dùng."""
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+
+    def __len__(self):
+        return len(self._df)
+
+    def as_pandas_dataframe(self) -> pd.DataFrame:
+        return self._df.copy()
+
+
+class PrefetchedTraceProcessor:
+    """
+    Bọc TraceProcessor của một trace: SQL đã có trong frames được trả từ
+    kết quả batch, SQL khác chuyển thẳng xuống trace_processor. Attribute khác
+    (slice_index, process_slice_table...) đọc từ tp gốc.
+    """
+
+    def __init__(self, tp, frames: Dict[str, pd.DataFrame]):
+        self.tp = tp
+        self.frames = frames
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        if name == 'tp':
+            raise AttributeError(name)
+        return getattr(self.tp, name)
+
+    def query(self, sql):
+        frame = self.frames.get(sql)
+        if frame is not None:
+            self.hits += 1
+            return _PrefetchedResult(frame)
+        self.misses += 1
+        return self.tp.query(sql)
+
+
+def prefetch_shared_queries(btp: BatchTraceProcessor, paths: List[str],
+                            sqls: List[str]) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """
+    Chạy mỗi SQL một lần trên cả lô (query_and_flatten) và tách frame gộp
+    theo cột _path -> {trace_path: {sql: DataFrame}}. Trace không có dòng nào
+    nhận DataFrame rỗng (query_df coi là "không tìm thấy").
+    """
+    frames = {path: {} for path in paths}
+    for sql in sqls:
+        flat = btp.query_and_flatten(sql)
+        columns = [c for c in flat.columns if c != '_path']
+        groups = dict(tuple(flat.groupby('_path', sort=False))) if '_path' in flat.columns else {}
+        for path in paths:
+            group = groups.get(path)
+            if group is None:
+                frames[path][sql] = pd.DataFrame(columns=columns)
+            else:
+                frames[path][sql] = group[columns].reset_index(drop=True)
+    return frames
+
+
+def analyze_batch(trace_paths: List[str], analyse_fn: Callable[[Any, str], Dict[str, Any]],
+                  bin_path: str, shared_sqls: List[str], slice_tables: str = 'view',
+                  trace_timeout: Optional[float] = None, query_timeout: Optional[float] = None
+                  ) -> List[Tuple[str, Optional[Dict[str, Any]], Optional[str], Dict[str, Any]]]:
+    """
+    Load trace_paths vào một BatchTraceProcessor, prefetch shared_sqls cho cả lô
+    rồi chạy analyse_fn(tp, trace_path) cho từng trace (song song).
+    Trả về list (trace_path, metrics, error, batch_stats); metrics None nếu lỗi.
+    Trace load lỗi không làm hỏng cả lô (error = 'load failed').
+    slice_tables: 'table' để materialise slice_with_names sau prefetch (xem slice_tables.py).
+    [NEW] trace_timeout: load timeout của cả lô + watchdog cho phần phân tích của
+    từng trace; query_timeout: giới hạn mỗi query (kể cả prefetch). Hết hạn thì
+    shell của trace đó bị kill và batch_stats['batch_timeout'] = True.
+    """
+    config = BatchTraceProcessorConfig(
+        tp_config=TraceProcessorConfig(bin_path=bin_path,
+                                       load_timeout=int(trace_timeout or BATCH_LOAD_TIMEOUT_S)),
+        load_failure_handling=FailureHandling.INCREMENT_STAT,
+        execute_failure_handling=FailureHandling.INCREMENT_STAT,
+    )
+    with BatchTraceProcessor(list(trace_paths), config=config) as btp:
+        loaded = {id(tp): metadata['_path'] for tp, metadata in btp.tps_and_metadata}
+        if query_timeout:
+            for tp, _ in btp.tps_and_metadata:
+                set_query_timeout(tp, query_timeout)
+        btp.execute(ensure_slice_with_names_view)
+        frames = prefetch_shared_queries(btp, list(loaded.values()), shared_sqls)
+
+        def run_one(tp):
+            trace_path = loaded[id(tp)]
+            slice_stats = {}
+            view = PrefetchedTraceProcessor(prepare_slice_tables(tp, slice_tables, slice_stats),
+                                            frames[trace_path])
+            timed_out = False
+            try:
+                with trace_deadline(trace_timeout, lambda: kill_trace_processor(tp)):
+                    try:
+                        metrics, error = analyse_fn(view, trace_path), None
+                    except TimeoutError as e:
+                        # Query treo: shell vẫn đang chạy query -> kill
+                        kill_trace_processor(tp)
+                        raise TraceTimeout(f"query vượt quá {query_timeout}s") from e
+            except TraceTimeout as e:
+                metrics, error, timed_out = None, str(e), True
+            except Exception as e:
+                metrics, error = None, str(e)
+            batch_stats = {'batch_size': len(loaded), 'batch_query_hits': view.hits,
+                           'batch_query_misses': view.misses, 'batch_timeout': timed_out,
+                           **slice_stats}
+            return (trace_path, metrics, error, batch_stats)
+
+        results = btp.execute(run_one)
+
+    done = {r[0] for r in results}
+    for trace_path in trace_paths:
+        if trace_path not in done:
+            results.append((trace_path, None, 'load failed', {}))
+    return results
+
+
+def format_batch_summary(stats_list: Iterable[Dict[str, Any]]) -> Optional[str]:
+    """Dòng báo cáo: tỉ lệ query được phục vụ từ kết quả batch."""
+    hits = misses = traces = 0
+    for stats in stats_list:
+        if 'batch_query_hits' not in stats:
+            continue
+        traces += 1
+        hits += stats['batch_query_hits']
+        misses += stats['batch_query_misses']
+    if not traces:
+        return None
+    total = hits + misses
+    return (f"[BATCH] {traces} traces, {hits}/{total} queries served from batch "
+            f"({hits / total * 100 if total else 0.0:.0f}%)")
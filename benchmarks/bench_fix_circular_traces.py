@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_fix_circular_traces.py
+
+Benchmark fix_circular_traces trên một circular trace tổng hợp (mặc định 500 MB).
+So sánh bản quét ngược trên bytearray với bản regex search lặp (logic cũ).
+
+Usage:
+    python benchmarks/bench_fix_circular_traces.py [--size-mb 500] [--legacy]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from atracetosystrace import fix_circular_traces
+
+HEADER = (
+    b'# tracer: nop\n'
+    b'#\n'
+    b'# entries-in-buffer/entries-written: 0/0   #P:8\n'
+    b'#\n'
+    b'#           TASK-PID     TGID   CPU#  ||||    TIMESTAMP  FUNCTION\n'
+    b'#              | |         |      |   ||||       |         |\n'
+)
+EVENT_LINE = (
+    b'     system_server-1500  ( 1500) [002] ...1  %d.%06d: '
+    b'tracing_mark_write: B|1500|activityStart\n'
+)
+
+
+def build_circular_trace(size_mb: int, num_cpus: int = 8) -> bytearray:
+    """Dựng trace ~size_mb MB, mỗi CPU có một marker 'buffer started' rải đều trong nửa sau."""
+    target = size_mb * 1024 * 1024
+    block = b''.join(EVENT_LINE % (100 + i // 1000000, i % 1000000) for i in range(4096))
+
+    out = bytearray(HEADER)
+    marker_at = {target // 2 + (target // 2) * cpu // num_cpus: cpu for cpu in range(num_cpus)}
+    pending = sorted(marker_at)
+    while len(out) < target:
+        if pending and len(out) >= pending[0]:
+            cpu = marker_at[pending.pop(0)]
+            out += b'##### CPU %d buffer started ####\n' % cpu
+        out += block
+    return out
+
+
+def legacy_fix_circular_traces(out):
+    """Bản cũ: regex search lặp từ hit trước và splice bằng slicing."""
+    buffer_start_re = re.compile(rb'^#+ CPU \d+ buffer started', re.MULTILINE)
+    start_of_full_trace = 0
+
+    while True:
+        result = buffer_start_re.search(out, start_of_full_trace + 1)
+        if result:
+            start_of_full_trace = result.start()
+        else:
+            break
+
+    if start_of_full_trace > 0:
+        end_of_header = re.search(rb'^[^#]', out, re.MULTILINE).start()
+        out = out[:end_of_header] + out[start_of_full_trace:]
+    return out
+
+
+def run(fn, data, label):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn(data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {elapsed:8.3f} s | peak alloc {peak / 1e6:9.1f} MB | out {len(result) / 1e6:9.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fix_circular_traces')
+    parser.add_argument('--size-mb', type=int, default=500, help='Kích thước trace tổng hợp (MB)')
+    parser.add_argument('--legacy', action='store_true', help='Chạy thêm bản regex cũ để so sánh')
+    args = parser.parse_args()
+
+    print(f"Building synthetic circular trace ({args.size_mb} MB)...")
+    data = build_circular_trace(args.size_mb)
+    print(f"Input: {len(data) / 1e6:.1f} MB")
+
+    if args.legacy:
+        expected = run(legacy_fix_circular_traces, bytes(data), "legacy")
+
+    result = run(fix_circular_traces, data, "reverse")
+
+    if args.legacy and bytes(result) != expected:
+        print("[ERROR] Output khác bản legacy!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
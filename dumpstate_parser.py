@@ -16,6 +16,8 @@ import shutil
 from typing import Dict, Optional, List, Any
 from pathlib import Path
 
+from atracetosystrace import is_trace_file, trace_stem
+
 
 # ---------------------------------------------------------------------------
 # App Group Mapping (6 nhóm test)
@@ -178,8 +180,8 @@ def get_bugreport_group_from_name(filename: str) -> int:
 
 
 def get_app_name_from_log(filename: str) -> str:
-    """Extract app name từ log filename (phần cuối trước .log)."""
-    name = Path(filename).stem.lower()
+    """Extract app name từ log filename (phần cuối trước .log / .log.gz ...)."""
+    name = trace_stem(filename).lower()
     # Format: A266_260108_164459_camera -> lấy phần cuối
     parts = name.split('_')
     if parts:
@@ -210,7 +212,7 @@ def build_trace_bugreport_mapping(folder_path: str, extracted: bool = False) ->
     for item in folder.iterdir():
         name_lower = item.name.lower()
         
-        if item.is_file() and name_lower.endswith('.log'):
+        if item.is_file() and is_trace_file(name_lower):
             # Trace file
             app_name = get_app_name_from_log(item.name)
             app_group = get_app_group(app_name)
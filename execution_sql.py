@@ -33,16 +33,39 @@ except Exception:
     pass
 
 import datetime
+import heapq
+import itertools
+import queue
+import time
 from pathlib import Path
 from typing import Dict, Optional, Any, Tuple, List
-from collections import defaultdict
+from collections import defaultdict, deque
 
 import xlsxwriter
 
 from perfetto.trace_processor.api import TraceProcessor, TraceProcessorConfig
 from sql_query import *
-from atracetosystrace import convert_trace
-from multiprocessing import Pool, cpu_count
+from atracetosystrace import (
+    convert_trace_raw, is_trace_file, trace_stem, DEFAULT_CROP_MARGINS_NS, DEFAULT_EVENT_ALLOWLIST,
+)
+from trace_loader import discard_scratch_trace, make_scratch_dir, remove_scratch_dir
+from trace_processor_pool import format_shell_summary, QUERY_TIMEOUT_S, TRACE_TIMEOUT_S
+from batch_engine import (
+    analyze_batch, shared_query_sqls, format_batch_summary,
+    EXECUTION_SHARED_QUERIES, BATCH_MAX_TRACES,
+)
+from memory_scheduler import MemoryScheduler, default_memory_budget, trace_kind
+from startup_stdlib import (
+    analyze_trace_with_backend, format_stdlib_summary, print_parity_details, STARTUP_BACKENDS,
+)
+from slice_tables import format_slice_tables_summary, print_query_timings, SLICE_TABLE_MODES
+from trace_worker import (
+    _convert_stage_worker, _analyse_stage_worker, _skipped_result,
+    init_converter_worker, init_analyser_worker, pool_context, format_startup_summary,
+    ANALYSIS_ERROR, ANALYSIS_TIMEOUT,
+)
+import multiprocessing
+from multiprocessing import cpu_count
 from dumpstate_parser import (
     build_trace_bugreport_mapping,
     collect_bugreport_mappings, 
@@ -135,6 +158,25 @@ WARM_ONLY_KEYS = {
     "Touch Up ~ Activity Start"
 }
 
+# Launch-window cropping trước khi ingest (mặc định tắt, bật bằng --crop-launch-window)
+# (margin trước deliverInputEvent đầu tiên, margin sau end anchor cuối cùng) - ns
+CROP_MARGINS_NS = DEFAULT_CROP_MARGINS_NS
+
+# Event filter trước khi ingest (mặc định tắt, bật bằng --filter-events)
+# Chỉ giữ các event mà sql_query dùng; xem DEFAULT_EVENT_ALLOWLIST
+EVENT_ALLOWLIST = DEFAULT_EVENT_ALLOWLIST
+
+# [NEW] Trace vượt quá trace/query timeout được thử lại tối đa TRACE_MAX_ATTEMPTS lần
+TRACE_MAX_ATTEMPTS = 3
+# Backoff trước lần thử thứ n (n >= 2): RETRY_BACKOFF_S * 2 ** (n - 2)
+RETRY_BACKOFF_S = 5.0
+
+# Pipeline convert -> analyse: số payload đã convert được phép chờ analyser rảnh
+PIPELINE_READY_DEPTH = 4
+# [NEW] Chu kỳ (s) kiểm tra worker còn sống khi không có kết quả mới: task của
+# worker bị chết cứng (OOM kill, crash) không bao giờ gọi callback
+WORKER_POLL_S = 5.0
+
 # ---------------------------------------------------------------------------
 # Helper functions and analyze_trace 
 # ---------------------------------------------------------------------------
@@ -148,16 +190,17 @@ WARM_ONLY_KEYS = {
 
 def collect_trace_files(folder_path: str) -> List[str]:
     """
-    Collect file .log trong folder, đã sort theo tên (A-Z).
+    Collect file trace trong folder, đã sort theo tên (A-Z).
+    [UPDATED] Nhận cả .log.gz / .log.zst / .log.zip (xem TRACE_FILE_SUFFIXES).
     
     Returns:
-        List[str]: All file .log
+        List[str]: All trace files
     """
     folder = Path(folder_path)
     if not folder.exists() or not folder.is_dir():
         raise ValueError(f"Folder không tồn tại: {folder_path}")
     
-    log_files = sorted([str(f) for f in folder.glob("*.log")])
+    log_files = sorted([str(f) for f in folder.iterdir() if f.is_file() and is_trace_file(f.name)])
     return log_files
 
 def group_traces_by_app(trace_files: List[str], target_apps: List[str] = None) -> Dict[str, List[Tuple[str, int]]]:
@@ -170,7 +213,7 @@ def group_traces_by_app(trace_files: List[str], target_apps: List[str] = None) -
     print(f"Target Apps Filter: {target_apps}")
     
     for file_path in trace_files:
-        filename = Path(file_path).stem
+        filename = trace_stem(file_path)
         parts = filename.split('_')
         
         if len(parts) >= 2:
@@ -234,32 +277,255 @@ _ALL_FILES_SORTED = []
 #         print(f"    [ERROR] {Path(file_path).name}: {e}")
 #         return (app_name, occurrence, 'entry' if occurrence % 2 == 1 else 'reentry', None, filename)
 
-def _process_single_trace_worker(args):
+def default_num_converters(num_analysers: int) -> int:
+    """Conversion (Python) nhẹ hơn load + query trên trace_processor: mặc định 1 converter / 2 analyser."""
+    return max(1, num_analysers // 2)
+
+
+def _run_trace_pipeline(tasks: List[tuple], num_converters: int, num_analysers: int,
+                        ready_depth: int = PIPELINE_READY_DEPTH,
+                        scheduler: Optional[MemoryScheduler] = None,
+                        start_method: Optional[str] = None):
     """
-    Worker function cho multiprocessing.
-    [UPDATED] Nhận trực tiếp pid_mapping từ tham số, không dùng biến Global.
+    Producer/consumer: converter pool (Python, CPU-bound) -> payload path ->
+    analyser pool (mỗi worker sở hữu một trace_processor).
+    Backpressure: số trace đang convert + chờ/đang phân tích không vượt quá
+    num_analysers + ready_depth, nên scratch payload và RAM luôn bị chặn.
+    [NEW] scheduler: trace chỉ được nhận (từ lúc convert tới khi phân tích xong)
+    khi RSS dự kiến còn nằm trong memory budget (xem memory_scheduler.py).
+    [NEW] Trace bị timeout được xếp lại vào hàng đợi (tối đa ingest_options
+    'max_attempts' lần, backoff lũy thừa) thay vì chặn analyser; trong lúc chờ
+    backoff các trace khác vẫn chạy. Hết số lần thử -> ANALYSIS_TIMEOUT.
+    [NEW] Worker chạy code trong trace_worker.py (không import execution_sql),
+    start_method chọn fork/forkserver/spawn; thời gian khởi động được báo cáo.
+    [NEW] Mỗi WORKER_POLL_S không có kết quả, task đang chạy trên worker đã chết
+    được báo lỗi (ANALYSIS_ERROR) thay vì chờ mãi (xem _lost_tasks).
+    Yield (task, kết quả) theo thứ tự hoàn thành; kết quả cùng format với
+    _process_single_trace_worker.
     """
-    # Unpack thêm tham số pid_mapping và mapping_info (mapping_info dùng sau khi process)
-    file_path, occurrence, app_name, pid_mapping, mapping_info = args 
-    
-    filename = Path(file_path).stem
-    config = TraceProcessorConfig(bin_path=TRACE_PROCESSOR_BIN)
-    
-    # DEBUG: Kiểm tra xem worker có nhận được mapping không
-    # if pid_mapping:
-    #     print(f"    [DEBUG Worker] {filename} received mapping with {len(pid_mapping)} entries")
-    
+    events = queue.Queue()
+    pending = deque(tasks)
+    converting = analysing = 0
+    max_in_flight = num_analysers + ready_depth
+    attempts = defaultdict(int)
+    retries = []  # heap (ready_at, seq, task)
+    retry_seq = itertools.count()
+
+    def release(task, result=None):
+        if scheduler is None:
+            return
+        scheduler.release(task[0])
+        metrics = result[3] if result else None
+        if metrics:
+            kind = trace_kind(task[0], (task[5] or {}).get('use_cache'))
+            scheduler.observe(task[0], kind, (metrics.get('ingest_stats') or {}).get('worker_rss'))
+
+    ctx = pool_context(start_method)
+    startups = {}
+    pool_started_at = time.time()
+    # (stage, file_path) -> task đã submit chưa có kết quả; pid của worker đang chạy
+    outstanding = {}
+    running = {}
+    lost_stages = set()
+    # SimpleQueue: put ghi thẳng vào pipe, không mất khi worker chết ngay sau đó
+    task_starts = ctx.SimpleQueue()
+    converters = ctx.Pool(processes=num_converters, initializer=init_converter_worker,
+                          initargs=(task_starts,))
+    analysers = ctx.Pool(processes=num_analysers, initializer=init_analyser_worker,
+                         initargs=(task_starts,))
     try:
-        with TraceProcessor(trace=convert_trace(file_path), config=config) as tp:
-            # Truyền pid_mapping vào analyze_trace
-            metrics = analyze_trace(tp, file_path, pid_mapping)
+        while pending or converting or analysing or retries:
+            # Trace hết backoff được ưu tiên chạy lại trước
+            while retries and retries[0][0] <= time.monotonic():
+                pending.appendleft(heapq.heappop(retries)[2])
+            while pending and converting < num_converters and converting + analysing < max_in_flight:
+                task = pending[0]
+                if scheduler is not None:
+                    trace_group = trace_kind(task[0], (task[5] or {}).get('use_cache'))
+                    estimate = scheduler.estimate(task[0], trace_group)
+                    if not scheduler.can_admit(estimate, task[0]):
+                        break
+                    scheduler.admit(task[0], estimate)
+                pending.popleft()
+                attempts[task[0]] += 1
+                outstanding[('convert', task[0])] = task
+                converters.apply_async(
+                    _convert_stage_worker, (task,),
+                    callback=lambda r: events.put(('converted', r)),
+                    error_callback=lambda e, t=task: events.put(('convert_failed', t)))
+                converting += 1
+
+            try:
+                wait_s = WORKER_POLL_S
+                if retries:
+                    wait_s = min(wait_s, max(0.0, retries[0][0] - time.monotonic()))
+                kind, payload = events.get(timeout=wait_s)
+            except queue.Empty:
+                for stage, task in _lost_tasks(task_starts, running, outstanding):
+                    print(f"    [ERROR] {Path(task[0]).name}: {stage} worker died")
+                    lost_stages.add(stage)
+                    events.put(('convert_failed' if stage == 'convert' else 'analyse_failed', task))
+                continue
+            # Kết quả tới muộn của task đã bị báo lỗi (worker chết) -> bỏ qua
+            task = payload[0] if kind in ('converted', 'analysed') else payload
+            stage = 'convert' if kind in ('converted', 'convert_failed') else 'analyse'
+            if outstanding.pop((stage, task[0]), None) is None:
+                continue
+            running.pop((stage, task[0]), None)
+            if kind == 'converted':
+                converting -= 1
+                task, trace_path, ingest_stats, reason = payload
+                startup = ingest_stats.pop('converter_startup', None)
+                if startup:
+                    startups[startup['pid']] = startup
+                if reason:
+                    release(task)
+                    yield task, _skipped_result(task, reason)
+                    continue
+                outstanding[('analyse', task[0])] = task
+                analysers.apply_async(
+                    _analyse_stage_worker, ((task, trace_path, ingest_stats),),
+                    callback=lambda r, t=task: events.put(('analysed', (t, r))),
+                    error_callback=lambda e, t=task: events.put(('analyse_failed', t)))
+                analysing += 1
+            elif kind == 'analysed':
+                analysing -= 1
+                task, result = payload
+                release(task, result)
+                startup = ((result[3] or {}).get('ingest_stats') or {}).pop('analyser_startup', None)
+                if startup:
+                    startups[startup['pid']] = startup
+                max_attempts = (task[5] or {}).get('max_attempts', TRACE_MAX_ATTEMPTS)
+                if result[5] == ANALYSIS_TIMEOUT and attempts[task[0]] < max_attempts:
+                    backoff = RETRY_BACKOFF_S * 2 ** (attempts[task[0]] - 1)
+                    print(f"    [RETRY] {Path(task[0]).name}: attempt {attempts[task[0]] + 1}/{max_attempts} "
+                          f"in {backoff:.0f}s")
+                    heapq.heappush(retries, (time.monotonic() + backoff, next(retry_seq), task))
+                    continue
+                yield task, result
+            elif kind == 'convert_failed':
+                converting -= 1
+                release(payload)
+                yield payload, _skipped_result(payload, ANALYSIS_ERROR)
+            else:
+                analysing -= 1
+                release(payload)
+                yield payload, _skipped_result(payload, ANALYSIS_ERROR)
+    finally:
+        # Pool còn giữ task mất (worker chết) thì close() + join() chờ mãi -> terminate
+        for stage, pool in (('convert', converters), ('analyse', analysers)):
+            if stage in lost_stages:
+                pool.terminate()
+            else:
+                pool.close()
+        converters.join()
+        analysers.join()
+    startup_summary = format_startup_summary(ctx.get_start_method(), pool_started_at, startups.values())
+    if startup_summary:
+        print(startup_summary)
+
+
+def _lost_tasks(task_starts, running: Dict[tuple, int], outstanding: Dict[tuple, tuple]) -> List[tuple]:
+    """
+    Task (stage, task) đang chạy trên worker đã chết: Pool thay worker mới
+    nhưng không bao giờ trả kết quả cho task đó. running được cập nhật từ
+    task_starts (report_task_start của trace_worker).
+    """
+    while not task_starts.empty():
+        stage, file_path, pid = task_starts.get()
+        if (stage, file_path) in outstanding:
+            running[(stage, file_path)] = pid
+    alive = {p.pid for p in multiprocessing.active_children()}
+    lost = []
+    for key, pid in list(running.items()):
+        if pid not in alive and key in outstanding:
+            del running[key]
+            lost.append((key[0], outstanding[key]))
+    return lost
+
+def _run_trace_batches(tasks: List[tuple], num_converters: int,
+                       batch_size: int = BATCH_MAX_TRACES, start_method: Optional[str] = None):
+    """
+    [NEW] Engine 'batch': converter pool chuẩn bị payload như pipeline, sau đó
+    mỗi lô batch_size trace được phân tích trong một BatchTraceProcessor
+    (query dùng chung chạy một lần cho cả lô, xem batch_engine.py).
+    [NEW] ingest_options 'trace_timeout' / 'query_timeout' được áp cho từng trace
+    trong lô; trace bị timeout được convert + phân tích lại trong vòng sau (tối
+    đa 'max_attempts' lần, backoff lũy thừa giữa các vòng), hết lượt -> ANALYSIS_TIMEOUT.
+    Yield (task, kết quả) cùng format với _run_trace_pipeline.
+    """
+    shared_sqls = shared_query_sqls(EXECUTION_SHARED_QUERIES)
+    converters = pool_context(start_method).Pool(processes=num_converters, initializer=init_converter_worker)
+    attempts = defaultdict(int)
+
+    def analyse_ready(ready, retries):
+        options = ready[0][0][5] or {}
+        by_path = {trace_path: (task, ingest_stats) for task, trace_path, ingest_stats in ready}
+
+        def analyse_fn(tp, trace_path):
+            task, ingest_stats = by_path[trace_path]
+            ingest_options = task[5] or {}
+            return analyze_trace_with_backend(tp, task[0], task[3],
+                                              backend=ingest_options.get('startup_backend', 'queries'),
+                                              parity=ingest_options.get('stdlib_parity', False),
+                                              stats=ingest_stats)
+
+        try:
+            batch_start = time.perf_counter()
+            results = analyze_batch(list(by_path), analyse_fn, TRACE_PROCESSOR_BIN, shared_sqls,
+                                    slice_tables=options.get('slice_tables', 'view'),
+                                    trace_timeout=options.get('trace_timeout'),
+                                    query_timeout=options.get('query_timeout'))
+            batch_s = time.perf_counter() - batch_start
+        finally:
+            for trace_path, (task, ingest_stats) in by_path.items():
+                if ingest_stats.get('source') == 'text':
+                    discard_scratch_trace(trace_path)
+        for trace_path, metrics, error, batch_stats in results:
+            task, ingest_stats = by_path[trace_path]
+            file_path, occurrence, app_name = task[0], task[1], task[2]
+            attempts[file_path] += 1
+            if batch_stats.pop('batch_timeout', False):
+                max_attempts = options.get('max_attempts', TRACE_MAX_ATTEMPTS)
+                print(f"    [TIMEOUT] {Path(file_path).name}: {error}")
+                if attempts[file_path] < max_attempts:
+                    retries.append(task)
+                else:
+                    yield task, _skipped_result(task, ANALYSIS_TIMEOUT)
+                continue
+            if metrics is None:
+                print(f"    [ERROR] {Path(file_path).name}: {error}")
+                yield task, _skipped_result(task, ANALYSIS_ERROR)
+                continue
+            ingest_stats.update(batch_stats, ingest_s=batch_s / len(results))
+            metrics['ingest_stats'] = ingest_stats
             category = 'entry' if occurrence % 2 == 1 else 'reentry'
-            return (app_name, occurrence, category, metrics, filename)
-    except Exception as e:
-        print(f"    [ERROR] {Path(file_path).name}: {e}")
-        # import traceback
-        # traceback.print_exc()
-        return (app_name, occurrence, 'entry' if occurrence % 2 == 1 else 'reentry', None, filename)
+            yield task, (app_name, occurrence, category, metrics, trace_stem(file_path), None)
+
+    try:
+        round_tasks, round_no = list(tasks), 0
+        while round_tasks:
+            if round_no:
+                # Backoff ở process chính, giữa hai vòng (không còn trace nào đang chạy)
+                backoff = RETRY_BACKOFF_S * 2 ** (round_no - 1)
+                print(f"    [RETRY] {len(round_tasks)} timed-out traces: attempt {round_no + 1} in {backoff:.0f}s")
+                time.sleep(backoff)
+            retries, ready = [], []
+            for task, trace_path, ingest_stats, reason in converters.imap_unordered(_convert_stage_worker,
+                                                                                    round_tasks):
+                if reason:
+                    yield task, _skipped_result(task, reason)
+                    continue
+                ready.append((task, trace_path, ingest_stats))
+                if len(ready) >= batch_size:
+                    yield from analyse_ready(ready, retries)
+                    ready = []
+            if ready:
+                yield from analyse_ready(ready, retries)
+            round_tasks, round_no = retries, round_no + 1
+    finally:
+        converters.close()
+        converters.join()
 
 def process_single_trace(args: Tuple[str, int, str], pid_mapping: Dict[int, str] = None) -> Tuple[str, int, str, Optional[Dict[str, Any]], str]:
     """
@@ -273,11 +539,11 @@ def process_single_trace(args: Tuple[str, int, str], pid_mapping: Dict[int, str]
         (app_name, occurrence, category, metrics, filename) hoặc (app_name, occurrence, category, None, filename) nếu lỗi
     """
     file_path, occurrence, app_name = args
-    filename = Path(file_path).stem
+    filename = trace_stem(file_path)
     config = TraceProcessorConfig(bin_path=TRACE_PROCESSOR_BIN)
     
     try:
-        with TraceProcessor(trace=convert_trace(file_path), config=config) as tp:
+        with TraceProcessor(trace=convert_trace_raw(file_path), config=config) as tp:
             metrics = analyze_trace(tp, file_path, pid_mapping)
             category = 'entry' if occurrence % 2 == 1 else 'reentry'
             return (app_name, occurrence, category, metrics, filename)
@@ -289,10 +555,11 @@ def process_single_trace(args: Tuple[str, int, str], pid_mapping: Dict[int, str]
 
 # [File: execution_sql.py] -> function process_all_traces
 
-def process_all_traces(folder_path: str, label: str, num_workers: int = 8, 
-                       target_apps: List[str] = None, extracted: bool = False) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+def build_folder_tasks(folder_path: str, label: str, target_apps: List[str] = None,
+                       extracted: bool = False, ingest_options: Dict[str, Any] = None) -> List[tuple]:
     """
-    Xử lý tất cả traces.
+    Dựng task (file_path, occurrence, app_name, pid_mapping, mapping_info, ingest_options)
+    cho mọi trace của một folder.
     [UPDATED] Sử dụng sorted filename approach để match trace với bugreport.
     """
     trace_files = collect_trace_files(folder_path)
@@ -318,50 +585,160 @@ def process_all_traces(folder_path: str, label: str, num_workers: int = 8,
                 pid_mapping = None
             
             # Pass full mapping_info for later use in metrics
-            tasks.append((file_path, occurrence, app_name, pid_mapping, mapping_info))
-    
-    print(f"[{label}] Processing {len(tasks)} trace files with {num_workers} workers...")
+            tasks.append((file_path, occurrence, app_name, pid_mapping, mapping_info, ingest_options))
+    return tasks
+
+
+def _task_size(task) -> int:
+    try:
+        return os.path.getsize(task[0])
+    except OSError:
+        return 0
+
+
+def order_largest_first(tasks: List[tuple]) -> List[tuple]:
+    """Longest-processing-time: trace lớn chạy trước, trace nhỏ lấp phần đuôi."""
+    return sorted(tasks, key=_task_size, reverse=True)
+
+
+def process_folders(folders: List[Tuple[str, str]], num_workers: int = 8,
+                    target_apps: List[str] = None, extracted: bool = False,
+                    ingest_options: Dict[str, Any] = None,
+                    skipped: Optional[List[Tuple[str, str, str]]] = None,
+                    num_converters: Optional[int] = None,
+                    engine: str = 'pipeline',
+                    scheduler: Optional[MemoryScheduler] = None,
+                    start_method: Optional[str] = None,
+                    reaction_outcomes: Optional[Dict[str, tuple]] = None) -> Dict[str, Dict[str, Dict[str, List[Dict[str, Any]]]]]:
+    """
+    [NEW] Xử lý trace của nhiều folder [(folder_path, label), ...] trong MỘT hàng
+    đợi chung (sắp xếp trace lớn trước) và một bộ pool, nên không có pha "đuôi"
+    giữa DUT và REF. Kết quả được trả lại theo label: {label: {app: {'entry', 'reentry'}}}.
+    [NEW] ingest_options: option cho bước conversion trước khi ingest (vd. crop_window).
+    [NEW] skipped: list nhận (label, filename, reason) của các trace bị loại/lỗi.
+    [UPDATED] Pipeline 2 stage: num_converters process convert trace, num_workers
+    process (analyser) chạy trace_processor + query (xem _run_trace_pipeline).
+    [NEW] engine='batch': phân tích theo lô bằng BatchTraceProcessor (xem _run_trace_batches).
+    [NEW] scheduler: giới hạn số trace đồng thời theo memory budget (engine 'pipeline').
+    [NEW] start_method: start method của worker pool (fork/forkserver/spawn, None = mặc định).
+    [NEW] reaction_outcomes: dict nhận {trace_path: (reaction_metrics, reason)} khi
+    ingest_options['reaction'] bật (analyser chạy cả analyze_reaction_trace trên
+    cùng trace đã load). Trace chưa được load (bị loại ở bước convert) không có mặt.
+    """
+    # [NEW] Scratch dir (tmpfs) cho payload đã convert, xoá sau khi pool kết thúc
+    scratch_dir = make_scratch_dir()
+    ingest_options = dict(ingest_options or {}, scratch_dir=scratch_dir)
+    ingest_options.setdefault('bin_path', TRACE_PROCESSOR_BIN)
     
-    results = defaultdict(lambda: {'entry': [None] * 100, 'reentry': [None] * 100})
+    tasks = []
+    label_by_path = {}
+    for folder_path, label in folders:
+        folder_tasks = build_folder_tasks(folder_path, label, target_apps, extracted, ingest_options)
+        label_by_path.update((task[0], label) for task in folder_tasks)
+        tasks.extend(folder_tasks)
+    tasks = order_largest_first(tasks)
+    labels = "+".join(label for _, label in folders)
+    
+    num_converters = num_converters or default_num_converters(num_workers)
+    if engine == 'batch':
+        print(f"[{labels}] Processing {len(tasks)} trace files with "
+              f"{num_converters} converters + BatchTraceProcessor (<= {BATCH_MAX_TRACES} traces/batch)...")
+    else:
+        print(f"[{labels}] Processing {len(tasks)} trace files (largest first) with "
+              f"{num_converters} converters + {num_workers} analysers...")
     
-    # Store mapping info separately (since multiprocessing can't easily pass back)
-    task_mapping_info = {t[0]: t[4] for t in tasks}  # file_path -> mapping_info
+    results = {label: defaultdict(lambda: {'entry': [None] * 100, 'reentry': [None] * 100})
+               for _, label in folders}
+    all_ingest_stats = []
     
-    pool = Pool(processes=num_workers)
+    if engine == 'batch':
+        pipeline = _run_trace_batches(tasks, num_converters, start_method=start_method)
+    else:
+        pipeline = _run_trace_pipeline(tasks, num_converters, num_workers, scheduler=scheduler,
+                                       start_method=start_method)
     try:
-        for i, (app_name, occurrence, category, metrics, filename) in enumerate(pool.imap(_process_single_trace_worker, tasks)):
+        for i, (task, result) in enumerate(pipeline):
+            app_name, occurrence, category, metrics, filename, reason = result[:6]
+            label = label_by_path[task[0]]
+            # Trace không chạy tới reaction trên instance chung (bị loại ở convert,
+            # load lỗi/timeout) -> reaction_sql tự load lại theo đường riêng
+            if reaction_outcomes is not None and len(result) > 6:
+                reaction_outcomes[task[0]] = result[6]
+            if reason and skipped is not None:
+                skipped.append((label, filename, reason))
             if metrics:
                 cycle_index = (occurrence - 1) // 2
-                while len(results[app_name][category]) <= cycle_index:
-                    results[app_name][category].append(None)
+                label_results = results[label]
+                while len(label_results[app_name][category]) <= cycle_index:
+                    label_results[app_name][category].append(None)
                 
                 # [NEW] Add trace_mapping info to metrics for extended data access
-                trace_file = None
-                for task in tasks:
-                    if Path(task[0]).stem == filename:
-                        trace_file = task[0]
-                        break
+                metrics['trace_file'] = task[0]
+                metrics['trace_mapping'] = task[4] or {}
                 
-                if trace_file:
-                    metrics['trace_file'] = trace_file
-                    metrics['trace_mapping'] = task_mapping_info.get(trace_file, {})
+                label_results[app_name][category][cycle_index] = metrics
+                print(f"  - [{i+1}/{len(tasks)}] [{label}] {app_name} - {category} - cycle {cycle_index + 1} - {filename}")
                 
-                results[app_name][category][cycle_index] = metrics
-                print(f"  - [{i+1}/{len(tasks)}] {app_name} - {category} - cycle {cycle_index + 1} - {filename}")
+                # [NEW] Báo cáo lượng data bị bỏ ở bước conversion (crop / event filter)
+                ingest_stats = metrics.get('ingest_stats') or {}
+                all_ingest_stats.append(ingest_stats)
+                if ingest_stats.get('source') == 'cache':
+                    print(f"      [INGEST] protobuf cache {ingest_stats['payload_bytes'] / 1e6:.1f} MB "
+                          f"| load {ingest_stats.get('ingest_s', 0.0):.2f}s")
+                elif 'filter_events_removed' in ingest_stats or 'crop_bytes_removed' in ingest_stats:
+                    removed_bytes = ingest_stats.get('filter_bytes_removed', 0) + ingest_stats.get('crop_bytes_removed', 0)
+                    print(f"      [INGEST] removed {ingest_stats.get('filter_events_removed', 0)} events, "
+                          f"{removed_bytes / 1e6:.1f} MB | payload {ingest_stats.get('payload_bytes', 0) / 1e6:.1f} MB "
+                          f"| load {ingest_stats.get('ingest_s', 0.0):.2f}s")
+                print_parity_details(filename, ingest_stats)
     finally:
-        pool.close() 
-        pool.join()  
+        pipeline.close()
+        remove_scratch_dir(scratch_dir)
+    
+    # [NEW] Chi phí spawn/teardown trace_processor_shell (shell pool)
+    shell_summary = format_shell_summary(all_ingest_stats)
+    if shell_summary:
+        print(f"[{labels}] {shell_summary}")
+    batch_summary = format_batch_summary(all_ingest_stats)
+    if batch_summary:
+        print(f"[{labels}] {batch_summary}")
+    stdlib_summary = format_stdlib_summary(all_ingest_stats)
+    if stdlib_summary:
+        print(f"[{labels}] {stdlib_summary}")
+    # [NEW] Thời gian query theo helper (view vs slice_with_names materialise)
+    slice_summary = format_slice_tables_summary(all_ingest_stats)
+    if slice_summary:
+        print(f"[{labels}] {slice_summary}")
+        print_query_timings(all_ingest_stats)
     
     cleaned_results = {}
-    for app_name, categories in results.items():
-        cleaned_results[app_name] = {
-            'entry': [m for m in categories['entry'] if m is not None],
-            'reentry': [m for m in categories['reentry'] if m is not None]
-        }
+    for label, label_results in results.items():
+        cleaned_results[label] = {}
+        for app_name, categories in label_results.items():
+            cleaned_results[label][app_name] = {
+                'entry': [m for m in categories['entry'] if m is not None],
+                'reentry': [m for m in categories['reentry'] if m is not None]
+            }
     
     return cleaned_results
 
 
+def process_all_traces(folder_path: str, label: str, num_workers: int = 8, 
+                       target_apps: List[str] = None, extracted: bool = False,
+                       ingest_options: Dict[str, Any] = None,
+                       skipped: Optional[List[Tuple[str, str, str]]] = None,
+                       num_converters: Optional[int] = None,
+                       engine: str = 'pipeline',
+                       scheduler: Optional[MemoryScheduler] = None,
+                       start_method: Optional[str] = None) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    Xử lý tất cả traces của một folder.
+    [UPDATED] Wrapper của process_folders cho một folder.
+    """
+    return process_folders([(folder_path, label)], num_workers, target_apps, extracted, ingest_options,
+                           skipped, num_converters, engine, scheduler, start_method)[label]
+
+
 
 # ---------------------------------------------------------------------------
 # Excel Creation - Helper Functions
@@ -1864,11 +2241,32 @@ def extract_device_code(header_title):
     return ""
 
 
+def print_skipped_summary(skipped: List[Tuple[str, str, str]]) -> None:
+    """In danh sách trace bị loại (pre-validation) hoặc lỗi, gom theo reason."""
+    if not skipped:
+        return
+    by_reason = defaultdict(list)
+    for label, filename, reason in skipped:
+        by_reason[reason].append(f"{label}:{filename}")
+    print(f" SKIPPED {len(skipped)} traces:")
+    for reason, names in sorted(by_reason.items()):
+        print(f"   - {reason} ({len(names)}): {', '.join(names)}")
+
+
 # ---------------------------------------------------------------------------
 # Main
 # ---------------------------------------------------------------------------
 
-def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None, extracted: bool = False) -> None:
+def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None, extracted: bool = False,
+                 crop_launch_window: bool = False, filter_events: bool = False,
+                 use_cache: bool = False, cache_dir: Optional[str] = None,
+                 num_converters: Optional[int] = None, num_analysers: Optional[int] = None,
+                 reuse_shells: bool = False, engine: str = 'pipeline',
+                 memory_budget_gb: Optional[float] = None,
+                 trace_timeout_s: float = TRACE_TIMEOUT_S, query_timeout_s: float = QUERY_TIMEOUT_S,
+                 max_attempts: int = TRACE_MAX_ATTEMPTS, start_method: Optional[str] = None,
+                 startup_backend: str = 'queries', stdlib_parity: bool = False,
+                 with_reaction: bool = False, slice_tables: str = 'view') -> None:
     """
     Phân tích hiệu năng từ các trace trong DUT và REF folders
     
@@ -1877,8 +2275,54 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
         ref_folder: Đường dẫn folder REF
         target_apps: Danh sách apps cần xử lý (optional)
         extracted: True nếu các Bugreport đã được giải nén thành folder
+        crop_launch_window: True để chỉ ingest launch window (xem CROP_MARGINS_NS)
+        filter_events: True để bỏ các ftrace event không nằm trong EVENT_ALLOWLIST
+        use_cache: True để load bản protobuf từ convert-cache nếu có (python trace_cache.py)
+        cache_dir: Folder cache (mặc định .trace_cache/ cạnh mỗi trace)
+        num_converters: Số process convert trace (mặc định num_analysers // 2)
+        num_analysers: Số process chạy trace_processor (mặc định min(cpu, 16))
+        reuse_shells: True để mỗi analyser giữ một trace_processor_shell sống lâu
+                      (trace được stream qua HTTP, xem trace_processor_pool.py);
+                      False (mặc định) để spawn shell cho từng trace, shell tự đọc
+                      scratch file theo path
+        engine: 'pipeline' (mặc định, mỗi analyser một trace) hoặc 'batch'
+                (BatchTraceProcessor theo lô, xem batch_engine.py)
+        memory_budget_gb: RSS tối đa cho toàn bộ worker + trace_processor (mặc định
+                          MEMORY_BUDGET_FRACTION * RAM, 0 để tắt memory scheduler)
+        trace_timeout_s: Thời gian tối đa cho load + phân tích một trace (0 = không giới hạn)
+        query_timeout_s: Thời gian tối đa cho một query (0 = không giới hạn)
+        max_attempts: Số lần thử tối đa với trace bị timeout (engine 'pipeline' và 'batch')
+        start_method: Start method của worker pool ('fork', 'forkserver', 'spawn';
+                      None = mặc định của nền tảng), xem trace_worker.py
+        startup_backend: 'queries' (mặc định) hoặc 'stdlib' (mốc launch lấy từ module
+                         android.startup của trace_processor, xem startup_stdlib.py)
+        stdlib_parity: True để chạy thêm backend 'queries' và báo cáo metric lệch
+        with_reaction: True để chạy luôn reaction mode: mỗi trace chỉ load một lần,
+                       analyze_trace + analyze_reaction_trace chạy trên cùng instance,
+                       sau đó tạo cả workbook execution và reaction (engine 'pipeline',
+                       không crop/filter; ngược lại reaction load trace riêng)
+        slice_tables: 'view' (mặc định) hoặc 'table' (materialise slice_with_names có index
+                      cho mỗi trace, xem slice_tables.py); thời gian query theo helper
+                      được in ở cuối để so sánh hai mode
     """
-    num_workers = min(cpu_count(), 16)
+    num_workers = num_analysers or min(cpu_count(), 16)
+    num_converters = num_converters or default_num_converters(num_workers)
+    ingest_options = {
+        'crop_window': CROP_MARGINS_NS if crop_launch_window else None,
+        'event_allowlist': EVENT_ALLOWLIST if filter_events else None,
+        'use_cache': use_cache,
+        'cache_dir': cache_dir,
+        'reuse_shell': reuse_shells,
+        'trace_timeout': trace_timeout_s or None,
+        'query_timeout': query_timeout_s or None,
+        'max_attempts': max(1, max_attempts),
+        'startup_backend': startup_backend,
+        'stdlib_parity': stdlib_parity and startup_backend == 'stdlib',
+        # Reaction dùng chung trace đã load chỉ khi payload không bị crop/filter
+        # (crop/filter chỉ giữ phần execution cần)
+        'reaction': with_reaction and engine == 'pipeline' and not crop_launch_window and not filter_events,
+        'slice_tables': slice_tables,
+    }
     
     if not os.path.exists(dut_folder):
         raise FileNotFoundError(f"DUT folder not found: {dut_folder}")
@@ -1887,24 +2331,43 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
     
     print("=" * 70)
     print("BATCH EXECUTION TIME ANALYSIS")
-    print(f"Workers: {num_workers} | Available CPUs: {cpu_count()}")
+    print(f"Converters: {num_converters} | Analysers: {num_workers} | Available CPUs: {cpu_count()}")
     print(f"Extracted mode: {extracted}")
+    print(f"Crop launch window: {crop_launch_window} | Event filter: {filter_events}")
+    print(f"Protobuf cache: {use_cache}" + (f" ({cache_dir})" if use_cache and cache_dir else ""))
+    print(f"Shell pool: {reuse_shells} | Engine: {engine} | Start method: {start_method or multiprocessing.get_start_method()}")
+    print(f"Timeouts: trace {trace_timeout_s or 'none'}s | query {query_timeout_s or 'none'}s "
+          f"| max attempts {ingest_options['max_attempts']}")
+    print(f"Startup backend: {startup_backend}" + (" (parity check)" if ingest_options['stdlib_parity'] else ""))
+    print(f"slice_with_names: {slice_tables}")
+    if with_reaction:
+        print("Reaction mode: combined" + (" (shared trace load)" if ingest_options['reaction'] else
+                                           " (separate load: batch engine or cropped/filtered payload)"))
+    # [NEW] Số analyser chỉ còn là trần; số trace đồng thời do memory budget quyết định
+    if memory_budget_gb is None:
+        memory_budget = default_memory_budget()
+    else:
+        memory_budget = int(memory_budget_gb * 2**30) or None
+    # Shell pool: shell rảnh vẫn giữ trace trước -> chỉ admission theo ước lượng
+    scheduler = MemoryScheduler(memory_budget, live_check=not reuse_shells) if memory_budget else None
+    print("Memory budget: " + (f"{memory_budget / 2**30:.1f} GB" if scheduler else "disabled"))
     print("=" * 70)
     
     start_time = datetime.datetime.now()
 
-    # Process DUT folder
-    print("\n[1/2] Processing DUT folder...")
-    dut_results = process_all_traces(dut_folder, "DUT", num_workers, target_apps, extracted)
-    
-    # Process REF folder
-    print("\n[2/2] Processing REF folder...")
-    ref_results = process_all_traces(ref_folder, "REF", num_workers, target_apps, extracted)
+    # [UPDATED] DUT + REF chung một hàng đợi (trace lớn trước) và một bộ pool
+    print("\n[1/2] Processing DUT + REF folders...")
+    skipped = []
+    reaction_outcomes = {} if ingest_options['reaction'] else None
+    results = process_folders([(dut_folder, "DUT"), (ref_folder, "REF")], num_workers, target_apps, extracted,
+                              ingest_options, skipped, num_converters, engine, scheduler, start_method,
+                              reaction_outcomes)
+    dut_results, ref_results = results["DUT"], results["REF"]
     
     # Extract header title từ file đầu tiên
     dut_files = collect_trace_files(dut_folder)
     if dut_files:
-        first_file = Path(dut_files[0]).stem
+        first_file = trace_stem(dut_files[0])
         parts = first_file.split("_")
         header_title = "_".join(parts[:2]) if len(parts) >= 2 else "Metric"
     else:
@@ -1913,7 +2376,7 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
     # Extract REF header title
     ref_files = collect_trace_files(ref_folder)
     if ref_files:
-        first_ref_file = Path(ref_files[0]).stem
+        first_ref_file = trace_stem(ref_files[0])
         parts = first_ref_file.split("_")
         header_title_ref = "_".join(parts[:2]) if len(parts) >= 2 else "Metric"
     else:
@@ -1924,7 +2387,7 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
     ref_device_code = extract_device_code(header_title_ref)
     
     # Create Excel outputs
-    print("\n[3/3] Creating Excel files...")
+    print("\n[2/2] Creating Excel files...")
     output_folder = dut_folder  # Lưu vào thư mục DUT
     create_excel_output(dut_results, ref_results, output_folder, header_title, dut_device_code, ref_device_code, dut_folder, ref_folder)
     
@@ -1933,8 +2396,20 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
 
     print("\n" + "=" * 70)
     print(f" COMPLETED in {elapsed:.1f} seconds ({elapsed/60:.1f} minutes)")
+    print_skipped_summary(skipped)
+    if scheduler is not None:
+        print(scheduler.summary())
+        scheduler.save()
     print("=" * 70)
 
+    # [NEW] Reaction workbook từ kết quả đã tính trên cùng trace (chỉ load lại trace
+    # chưa từng được load, vd. bị loại bởi pre-check của execution)
+    if with_reaction:
+        import reaction_sql
+        reaction_sql.run_analysis(dut_folder, ref_folder, target_apps, use_cache=use_cache,
+                                  cache_dir=cache_dir, reuse_shells=reuse_shells,
+                                  precomputed=reaction_outcomes, slice_tables=slice_tables)
+
 # ---------------------------------------------------------------------------
 # Standalone Execution
 # ---------------------------------------------------------------------------
@@ -1947,11 +2422,66 @@ def main():
     parser.add_argument('ref_folder', help='Path to REF folder')
     parser.add_argument('--extracted', action='store_true', 
                         help='Set if Bugreport files are already extracted to folders')
+    parser.add_argument('--crop-launch-window', action='store_true',
+                        help='Only ingest ftrace events inside the launch window')
+    parser.add_argument('--filter-events', action='store_true',
+                        help='Drop ftrace event types that no query uses before ingestion')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='Load Perfetto protobuf traces from the convert-cache when available')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Convert-cache directory (default: .trace_cache next to each trace)')
+    parser.add_argument('--converters', type=int, default=None,
+                        help='Number of trace conversion processes (default: analysers / 2)')
+    parser.add_argument('--analysers', type=int, default=None,
+                        help='Number of trace_processor analysis processes (default: min(cpu, 16))')
+    parser.add_argument('--shell-pool', action='store_true',
+                        help='Reuse one trace_processor shell per worker; traces are then streamed over '
+                             'HTTP instead of being read by path (only pays off for small traces)')
+    parser.add_argument('--no-shell-pool', dest='shell_pool', action='store_false',
+                        help='Deprecated: a fresh trace_processor shell per trace is already the default '
+                             '(kept for existing scripts; the later of --shell-pool / --no-shell-pool wins)')
+    parser.add_argument('--memory-budget-gb', type=float, default=None,
+                        help='RSS budget for all analysers and trace_processor shells '
+                             '(default: 70%% of RAM, 0 disables the memory scheduler)')
+    parser.add_argument('--trace-timeout', type=float, default=TRACE_TIMEOUT_S,
+                        help='Wall-clock limit in seconds for loading + analysing one trace (0 disables)')
+    parser.add_argument('--query-timeout', type=float, default=QUERY_TIMEOUT_S,
+                        help='Limit in seconds for a single trace_processor query (0 disables)')
+    parser.add_argument('--max-attempts', type=int, default=TRACE_MAX_ATTEMPTS,
+                        help='Attempts per trace before a timed-out trace is reported as failed')
+    parser.add_argument('--start-method', choices=multiprocessing.get_all_start_methods(), default=None,
+                        help='Worker start method (default: platform default; forkserver keeps workers lean)')
+    parser.add_argument('--engine', choices=['pipeline', 'batch'], default='pipeline',
+                        help='pipeline: one trace per analyser process; '
+                             'batch: analyse folders in batches with BatchTraceProcessor')
+    parser.add_argument('--startup-backend', choices=STARTUP_BACKENDS, default='queries',
+                        help='queries: hand-written launch queries (default, fastest); '
+                             'stdlib: launch markers from the trace_processor android.startup module. '
+                             'stdlib is for parity checks against queries only: it replaces 4 lookups the '
+                             'slice index already answers, adds a module INCLUDE + startup query per trace '
+                             'and is not faster')
+    parser.add_argument('--with-reaction', action='store_true',
+                        help='Also produce the reaction workbooks, analysing each trace from the same load')
+    parser.add_argument('--slice-tables', choices=SLICE_TABLE_MODES, default='view',
+                        help='view: slice_with_names as a join view; '
+                             'table: materialise it per trace with indexes (query timings are logged)')
+    parser.add_argument('--stdlib-parity', action='store_true',
+                        help='With --startup-backend stdlib, also run the query backend and report metric differences')
     
     args = parser.parse_args()
     
     try:
-        run_analysis(args.dut_folder, args.ref_folder, extracted=True)
+        run_analysis(args.dut_folder, args.ref_folder, extracted=True,
+                     crop_launch_window=args.crop_launch_window,
+                     filter_events=args.filter_events,
+                     use_cache=args.use_cache, cache_dir=args.cache_dir,
+                     num_converters=args.converters, num_analysers=args.analysers,
+                     reuse_shells=args.shell_pool, engine=args.engine,
+                     memory_budget_gb=args.memory_budget_gb,
+                     trace_timeout_s=args.trace_timeout, query_timeout_s=args.query_timeout,
+                     max_attempts=args.max_attempts, start_method=args.start_method,
+                     startup_backend=args.startup_backend, stdlib_parity=args.stdlib_parity,
+                     with_reaction=args.with_reaction, slice_tables=args.slice_tables)
     except Exception as e:
         print(f"\n[ERROR] Analysis failed: {e}")
         traceback.print_exc()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+memory_scheduler.py
+
+Điều phối số trace chạy đồng thời theo bộ nhớ thay vì cố định theo số CPU.
+Mỗi trace được ước lượng RSS = WORKER_BASE_RSS + factor * kích thước file;
+factor (byte RSS / byte input) được học từ RSS thực đo của các lần chạy
+trước và lưu trong MEMORY_MODEL_PATH. Trace mới chỉ được nhận khi tổng ước
+lượng của các trace đang chạy + ước lượng của trace vẫn nằm trong budget.
+Luôn nhận ít nhất một trace, nên trace lớn hơn budget vẫn chạy (tuần tự)
+thay vì treo.
+
+[UPDATED] Admission dựa trên ước lượng đã đặt chỗ; RSS thực (worker + shell,
+đo ngay sau khi phân tích xong) hiệu chỉnh factor (observe).
+[NEW] Thêm kiểm tra headroom thực: RSS cả cây process (process_tree_rss) +
+phần ước lượng của trace mới (không tính WORKER_BASE_RSS, worker đã tồn tại)
+cũng phải nằm trong budget, để trace bị ước lượng thấp không đẩy máy vào swap.
+Với shell pool (live_check=False) bỏ kiểm tra này: shell rảnh vẫn giữ trace
+trước và chỉ nhả khi load trace mới, nên RSS cây process không phản ánh bộ
+nhớ mà trace mới cần thêm.
+
+[NEW] Khi SliceIndex bật, ước lượng cộng thêm peak lúc dựng index (DataFrame
+object của SLICE_INDEX_SQL, tối đa SLICE_INDEX_MAX_ROWS row) - phần này chỉ
+tồn tại trong lúc dựng nên được trừ ra khỏi RSS thực trước khi học factor.
+
+RSS thực đo bằng psutil nếu có, nếu không thì đọc /proc (Linux). Trên nền
+tảng khác không có psutil, factor giữ giá trị mặc định.
+"""
+
+import json
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import slice_index
+from atracetosystrace import COMPRESSED_TRACE_SUFFIXES
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+# Budget mặc định = tỉ lệ RAM vật lý (phần còn lại cho OS + process chính)
+MEMORY_BUDGET_FRACTION = 0.7
+# RSS cố định của một analyser (Python worker + trace_processor_shell rỗng)
+WORKER_BASE_RSS = 300 << 20
+# Byte RSS / byte input mặc định khi chưa học được (ftrace text vs protobuf cache)
+DEFAULT_BYTES_FACTOR = {'text': 3.0, 'cache': 12.0}
+# trace_processor giữ ít nhất cỡ payload trong RAM -> factor học được không thấp hơn mức này
+MIN_BYTES_FACTOR = 1.0
+FACTOR_EMA_ALPHA = 0.3
+# Peak (byte / row) khi dựng SliceIndex: 8 cột object của as_pandas_dataframe + mảng NumPy
+SLICE_INDEX_ROW_BYTES = 400
+# Số slice ước lượng theo input: byte input / slice (text: cặp B/E ~2 dòng ftrace)
+INPUT_BYTES_PER_SLICE = {'text': 200, 'cache': 60}
+# Trace nén (.gz/.zst/.zip) nở khoảng chừng này lần khi giải nén
+COMPRESSED_EXPANSION = 8
+MEMORY_MODEL_PATH = os.path.join(os.path.expanduser('~'), '.tracetool_memory_model.json')
+
+
+def total_memory_bytes():
+    """RAM vật lý (bytes), None nếu không xác định được."""
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def default_memory_budget():
+    total = total_memory_bytes()
+    return int(total * MEMORY_BUDGET_FRACTION) if total else None
+
+
+def _proc_rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _proc_children(pid):
+    children = []
+    try:
+        for tid in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def process_tree_rss(pid=None):
+    """
+    Tổng RSS (bytes) của pid và mọi process con/cháu (worker + trace_processor_shell).
+    None nếu không đo được trên nền tảng hiện tại.
+    """
+    pid = pid or os.getpid()
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            total = proc.memory_info().rss
+            for child in proc.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total
+        except psutil.Error:
+            return None
+    if not os.path.isdir(f'/proc/{pid}'):
+        return None
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _proc_rss(current)
+        stack.extend(_proc_children(current))
+    return total
+
+
+def trace_kind(file_path, use_cache=False):
+    """Nhóm trace dùng chung một factor: 'text'/'cache' + đuôi nén (nếu có)."""
+    lower = file_path.lower()
+    suffix = next((s for s in COMPRESSED_TRACE_SUFFIXES if lower.endswith(s)), '')
+    return ('cache' if use_cache else 'text') + suffix
+
+
+def slice_index_bytes(size, kind):
+    """Peak RSS ước lượng khi dựng SliceIndex cho input size byte (0 nếu index tắt)."""
+    if not slice_index.SLICE_INDEX_ENABLED or not size:
+        return 0
+    base, _, suffix = kind.partition('.')
+    if suffix:
+        size *= COMPRESSED_EXPANSION
+    rows = min(size // INPUT_BYTES_PER_SLICE.get(base, INPUT_BYTES_PER_SLICE['text']),
+               slice_index.SLICE_INDEX_MAX_ROWS)
+    return int(rows * SLICE_INDEX_ROW_BYTES)
+
+
+class MemoryScheduler:
+    """
+    Admission control theo bộ nhớ cho pipeline (xem execution_sql._run_trace_pipeline).
+    admit()/release() được gọi từ process chính; observe() nhận RSS thực đo
+    của worker để cập nhật factor.
+    """
+
+    def __init__(self, budget_bytes, model_path=MEMORY_MODEL_PATH, live_check=True):
+        self.budget = budget_bytes
+        self.model_path = model_path
+        self.live_check = live_check
+        self.factors = self._load_model()
+        self.reserved = {}
+        self.peak_projected = 0
+        self.peak_live = 0
+        # Mỗi trace bị hoãn chỉ đếm một lần dù can_admit được poll nhiều lần
+        self.deferred = set()
+
+    def _load_model(self):
+        try:
+            with open(self.model_path) as f:
+                return {k: float(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def save(self):
+        try:
+            with open(self.model_path, 'w') as f:
+                json.dump(self.factors, f, indent=2, sort_keys=True)
+        except OSError as e:
+            print(f"[WARN] Không ghi được memory model {self.model_path}: {e}")
+
+    def factor(self, kind):
+        base = kind.split('.', 1)[0]
+        return self.factors.get(kind, DEFAULT_BYTES_FACTOR.get(base, DEFAULT_BYTES_FACTOR['text']))
+
+    def estimate(self, file_path, kind):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            size = 0
+        return int(WORKER_BASE_RSS + self.factor(kind) * size + slice_index_bytes(size, kind))
+
+    def projected(self):
+        """Tổng ước lượng RSS của các trace đang được nhận."""
+        return sum(self.reserved.values())
+
+    def live_headroom(self):
+        """budget - RSS thực của cả cây process, None nếu không đo được."""
+        live = process_tree_rss()
+        if live is None:
+            return None
+        self.peak_live = max(self.peak_live, live)
+        return self.budget - live
+
+    def can_admit(self, estimate, key=None):
+        """
+        Luôn nhận khi không có trace nào đang chạy (tránh treo với trace > budget).
+        key: định danh trace, để summary đếm số trace bị hoãn thay vì số lần poll.
+        """
+        if not self.reserved:
+            return True
+        if self.projected() + estimate <= self.budget:
+            if not self.live_check:
+                return True
+            headroom = self.live_headroom()
+            if headroom is None or max(0, estimate - WORKER_BASE_RSS) <= headroom:
+                return True
+        self.deferred.add(key)
+        return False
+
+    def admit(self, key, estimate):
+        self.reserved[key] = estimate
+        self.peak_projected = max(self.peak_projected, self.projected())
+
+    def release(self, key):
+        self.reserved.pop(key, None)
+
+    def observe(self, file_path, kind, worker_rss):
+        """Cập nhật factor (EMA) từ RSS thực của worker + shell khi phân tích xong trace."""
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return
+        if not size or not worker_rss:
+            return
+        sample = max(MIN_BYTES_FACTOR,
+                     (worker_rss - WORKER_BASE_RSS - slice_index_bytes(size, kind)) / size)
+        previous = self.factors.get(kind)
+        self.factors[kind] = sample if previous is None else \
+            (1 - FACTOR_EMA_ALPHA) * previous + FACTOR_EMA_ALPHA * sample
+
+    def summary(self):
+        factors = ", ".join(f"{k}={v:.1f}" for k, v in sorted(self.factors.items())) or "default"
+        live = f" | peak live {self.peak_live / 2**30:.1f} GB" if self.peak_live else ""
+        return (f"[MEMORY] budget {self.budget / 2**30:.1f} GB | peak projected "
+                f"{self.peak_projected / 2**30:.1f} GB{live} | deferred traces {len(self.deferred)} | "
+                f"bytes factor: {factors}")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+reaction_analysis.py
+
+analyze_reaction_trace (Reaction Time Sequence) tách khỏi reaction_sql.py để
+analyser worker của pipeline execution + reaction (trace_worker._reaction_stage)
+không phải import xlsxwriter, multiprocessing pool và phần xuất Excel của
+reaction_sql. reaction_sql re-export hàm này cho code cũ.
+"""
+
+from typing import Any, Dict
+
+from perfetto.trace_processor import TraceProcessor
+
+from slice_index import ensure_slice_index
+from sql_query import (
+    to_ms, ensure_slice_with_names_view, detect_app_from_launch,
+    find_app_process, get_first_deliver_input, get_launcher_pid, get_end_deliver_input,
+    get_addStartingWindow, get_pid_systemUI, get_reaction_choreographer,
+    get_onTransactionReady, get_drawFrame,
+)
+
+
+def analyze_reaction_trace(tp: TraceProcessor, trace_path: str) -> Dict[str, Any]:
+    """
+    Phân tích Reaction Time Sequence:
+    Touch -> AddStartingWindow -> Choreographer -> onTransactionReady
+    """
+    metrics: Dict[str, Any] = {}
+    
+    # 1. Init Views
+    ensure_slice_with_names_view(tp)
+    ensure_slice_index(tp)
+    
+    # 2. Identify App & System Server
+    app_pkg = detect_app_from_launch(tp)
+    if not app_pkg:
+        pass
+
+    # App Process Info
+    app_proc = find_app_process(tp, app_pkg) if app_pkg else None
+    app_upid = app_proc[0] if app_proc else None
+
+    # 3. Get Event Timestamps
+    
+    # [Touch Down]
+    touch_down_ts = get_first_deliver_input(tp)
+    if touch_down_ts is None:
+        raise RuntimeError("Không tìm thấy Touch Down")
+
+    # [Touch Up]
+    launcher_pid = get_launcher_pid(tp)
+    touch_up_ts = None
+    if launcher_pid:
+        t_up, t_up_end = get_end_deliver_input(tp, launcher_pid)
+        touch_up_ts = t_up # Start Time của Touch Up slice
+
+    # [AddStartingWindow] (System Server)
+    asw_info = get_addStartingWindow(tp)
+    asw_ts, asw_dur, asw_end = asw_info if asw_info else (None, None, None)
+
+    # [Choreographer] (SystemUI Process - Reaction Logic)
+    cho_ts, cho_dur, cho_end = (None, None, None)
+    sysui_pids = get_pid_systemUI(tp)
+    if sysui_pids:
+        sysui_pid = int(sysui_pids[0])
+        # sysui_pid = sysui_pids
+        cho_info = get_reaction_choreographer(tp, sysui_pid)
+        if cho_info:
+            cho_ts, cho_dur, cho_end = cho_info
+    else:
+        print(f"    [WARN] Không tìm thấy SystemUI PID trong trace: {trace_path}")
+        pass
+
+
+
+
+    # [onTransactionReady] (System Server)
+    otr_info = get_onTransactionReady(tp)
+    otr_ts, otr_dur, otr_end = otr_info if otr_info else (None, None, None)
+
+    # [drawFrame] - Empty for now
+    df_ts = None
+
+    # 4. Calculate Metrics
+    
+    # --- Touch Duration ---
+    # Touch Duration = Touch Up - Touch Down
+    if touch_up_ts and touch_down_ts:
+        metrics["Touch Duration"] = to_ms(touch_up_ts - touch_down_ts)
+    else:
+        metrics["Touch Duration"] = 0.0
+
+    # --- Touch Up ~ AddStartingWindow ---
+    # Tính từ Start TouchUp -> Start AddStartingWindow
+    if touch_up_ts and asw_ts and asw_ts > touch_up_ts:
+        metrics["Touch Up ~ AddStartingWindow"] = to_ms(asw_ts - touch_up_ts)
+    else:
+        metrics["Touch Up ~ AddStartingWindow"] = 0.0
+
+    # --- AddStartingWindow Duration ---
+    metrics["AddStartingWindow"] = to_ms(asw_dur)
+
+    # --- AddStartingWindow ~ Choreographer ---
+    if asw_ts and cho_ts and cho_ts > asw_ts:
+        metrics["AddStartingWindow ~ Choreographer"] = to_ms(cho_ts - asw_end)
+    else:
+        metrics["AddStartingWindow ~ Choreographer"] = 0.0
+
+    # --- Choreographer Duration ---
+    metrics["Choreographer"] = to_ms(cho_dur)
+
+    # --- Choreographer ~ onTransactionReady ---
+    if cho_ts and otr_ts and otr_ts > cho_ts:
+        metrics["Choreographer ~ onTransactionReady"] = to_ms(otr_ts - cho_ts)
+    else:
+        metrics["Choreographer ~ onTransactionReady"] = 0.0
+
+    # --- onTransactionReady Duration ---
+    metrics["onTransactionReady"] = to_ms(otr_dur)
+
+    # --- onTransactionReady ~ drawFrame ---
+    if launcher_pid:
+        drawFrame = get_drawFrame(tp, launcher_pid)
+
+    df_end = None
+    if drawFrame is not None:
+        df_ts, df_dur, df_end = drawFrame
+        metrics["drawFrame"] = to_ms(df_dur)
+        metrics["onTransactionReady ~ drawFrame"] = to_ms(df_ts - otr_end)
+    else:
+        metrics["drawFrame"] = "" 
+        metrics["onTransactionReady ~ drawFrame"] = ""
+
+    # --- App Reaction Time --- 
+    if touch_down_ts and df_end is not None:
+        # print(f"Touch Down: {touch_down_ts}, OTR End: {otr_end}")
+        metrics["App Reaction Time"] = to_ms(df_end - touch_down_ts)
+    else:
+        metrics["App Reaction Time"] = 0.0
+
+    metrics["App Package"] = app_pkg if app_pkg else "Unknown"
+    return metrics
@@ -10,6 +10,10 @@ Tạo 2 file Excel: reaction_entry_... và reaction_reentry_...
 import os
 import sys
 import datetime
+import heapq
+import itertools
+import queue
+import time
 from pathlib import Path
 from typing import Dict, Optional, Any, Tuple, List
 from collections import defaultdict
@@ -19,6 +23,18 @@ import xlsxwriter
 from perfetto.trace_processor.api import TraceProcessor, TraceProcessorConfig
 
 from sql_query import *
+from trace_cache import cached_trace_path, cached_missing_markers
+from atracetosystrace import (
+    prescan_trace, load_trace_data, is_trace_file, trace_stem,
+)
+from trace_loader import (
+    write_scratch_trace, discard_scratch_trace, make_scratch_dir, remove_scratch_dir,
+)
+from trace_processor_pool import (
+    open_trace, format_shell_summary, TraceTimeout, QUERY_TIMEOUT_S, TRACE_TIMEOUT_S,
+)
+from slice_tables import prepare_slice_tables, format_slice_tables_summary, print_query_timings
+from reaction_analysis import analyze_reaction_trace
 # from atracetosystrace import convert_trace
 
 # ---------------------------------------------------------------------------
@@ -39,6 +55,17 @@ else:
 RELATIVE_BIN_PATH = os.path.join("perfetto_bin", TP_FILENAME)
 TRACE_PROCESSOR_BIN = get_resource_path(RELATIVE_BIN_PATH)
 
+# Pre-validation: marker bắt buộc (marker -> lý do loại) trước khi spawn trace_processor
+# (analyze_reaction_trace raise khi không có Touch Down)
+REQUIRED_MARKERS = {
+    b'deliverInputEvent': 'missing_deliver_input',
+}
+ANALYSIS_ERROR = 'analysis_error'
+# [NEW] Trace vượt quá trace/query timeout sau TRACE_MAX_ATTEMPTS lần thử
+ANALYSIS_TIMEOUT = 'analysis_timeout'
+TRACE_MAX_ATTEMPTS = 2
+RETRY_BACKOFF_S = 5.0
+
 APP_MAPPING = {
     "comsamsungperformancehelloworld_v6": "Helloworld",
     "comsamsungandroiddialer": "Dial",
@@ -81,153 +108,125 @@ TARGET_APPS = [
 # ---------------------------------------------------------------------------
 # Analysis Logic (Reaction Specific)
 # ---------------------------------------------------------------------------
-
-def analyze_reaction_trace(tp: TraceProcessor, trace_path: str) -> Dict[str, Any]:
-    """
-    Phân tích Reaction Time Sequence:
-    Touch -> AddStartingWindow -> Choreographer -> onTransactionReady
-    """
-    metrics: Dict[str, Any] = {}
-    
-    # 1. Init Views
-    ensure_slice_with_names_view(tp)
-    
-    # 2. Identify App & System Server
-    app_pkg = detect_app_from_launch(tp)
-    if not app_pkg:
-        pass
-
-    # App Process Info
-    app_proc = find_app_process(tp, app_pkg) if app_pkg else None
-    app_upid = app_proc[0] if app_proc else None
-
-    # 3. Get Event Timestamps
-    
-    # [Touch Down]
-    touch_down_ts = get_first_deliver_input(tp)
-    if touch_down_ts is None:
-        raise RuntimeError("Không tìm thấy Touch Down")
-
-    # [Touch Up]
-    launcher_pid = get_launcher_pid(tp)
-    touch_up_ts = None
-    if launcher_pid:
-        t_up, t_up_end = get_end_deliver_input(tp, launcher_pid)
-        touch_up_ts = t_up # Start Time của Touch Up slice
-
-    # [AddStartingWindow] (System Server)
-    asw_info = get_addStartingWindow(tp)
-    asw_ts, asw_dur, asw_end = asw_info if asw_info else (None, None, None)
-
-    # [Choreographer] (SystemUI Process - Reaction Logic)
-    cho_ts, cho_dur, cho_end = (None, None, None)
-    sysui_pids = get_pid_systemUI(tp)
-    if sysui_pids:
-        sysui_pid = int(sysui_pids[0])
-        # sysui_pid = sysui_pids
-        cho_info = get_reaction_choreographer(tp, sysui_pid)
-        if cho_info:
-            cho_ts, cho_dur, cho_end = cho_info
-    else:
-        print(f"    [WARN] Không tìm thấy SystemUI PID trong trace: {trace_path}")
-        pass
-
-
-
-
-    # [onTransactionReady] (System Server)
-    otr_info = get_onTransactionReady(tp)
-    otr_ts, otr_dur, otr_end = otr_info if otr_info else (None, None, None)
-
-    # [drawFrame] - Empty for now
-    df_ts = None
-
-    # 4. Calculate Metrics
-    
-    # --- Touch Duration ---
-    # Touch Duration = Touch Up - Touch Down
-    if touch_up_ts and touch_down_ts:
-        metrics["Touch Duration"] = to_ms(touch_up_ts - touch_down_ts)
-    else:
-        metrics["Touch Duration"] = 0.0
-
-    # --- Touch Up ~ AddStartingWindow ---
-    # Tính từ Start TouchUp -> Start AddStartingWindow
-    if touch_up_ts and asw_ts and asw_ts > touch_up_ts:
-        metrics["Touch Up ~ AddStartingWindow"] = to_ms(asw_ts - touch_up_ts)
-    else:
-        metrics["Touch Up ~ AddStartingWindow"] = 0.0
-
-    # --- AddStartingWindow Duration ---
-    metrics["AddStartingWindow"] = to_ms(asw_dur)
-
-    # --- AddStartingWindow ~ Choreographer ---
-    if asw_ts and cho_ts and cho_ts > asw_ts:
-        metrics["AddStartingWindow ~ Choreographer"] = to_ms(cho_ts - asw_end)
-    else:
-        metrics["AddStartingWindow ~ Choreographer"] = 0.0
-
-    # --- Choreographer Duration ---
-    metrics["Choreographer"] = to_ms(cho_dur)
-
-    # --- Choreographer ~ onTransactionReady ---
-    if cho_ts and otr_ts and otr_ts > cho_ts:
-        metrics["Choreographer ~ onTransactionReady"] = to_ms(otr_ts - cho_ts)
-    else:
-        metrics["Choreographer ~ onTransactionReady"] = 0.0
-
-    # --- onTransactionReady Duration ---
-    metrics["onTransactionReady"] = to_ms(otr_dur)
-
-    # --- onTransactionReady ~ drawFrame ---
-    if launcher_pid:
-        drawFrame = get_drawFrame(tp, launcher_pid)
-
-    df_end = None
-    if drawFrame is not None:
-        df_ts, df_dur, df_end = drawFrame
-        metrics["drawFrame"] = to_ms(df_dur)
-        metrics["onTransactionReady ~ drawFrame"] = to_ms(df_ts - otr_end)
-    else:
-        metrics["drawFrame"] = "" 
-        metrics["onTransactionReady ~ drawFrame"] = ""
-
-    # --- App Reaction Time --- 
-    if touch_down_ts and df_end is not None:
-        # print(f"Touch Down: {touch_down_ts}, OTR End: {otr_end}")
-        metrics["App Reaction Time"] = to_ms(df_end - touch_down_ts)
-    else:
-        metrics["App Reaction Time"] = 0.0
-
-    metrics["App Package"] = app_pkg if app_pkg else "Unknown"
-    return metrics
+# [UPDATED] analyze_reaction_trace nằm trong reaction_analysis.py (module gọn cho worker)
 
 
 # ---------------------------------------------------------------------------
 # Batch Processing (Multiprocessing)
 # ---------------------------------------------------------------------------
 
-def process_single_trace(args: Tuple[str, int, str]) -> Tuple[str, int, str, Optional[Dict[str, Any]]]:
-    file_path, occurrence, app_name = args
-    config = TraceProcessorConfig(bin_path=TRACE_PROCESSOR_BIN)
+def process_single_trace(args: Tuple[str, int, str, Dict[str, Any]]) -> Tuple[str, int, str, Optional[Dict[str, Any]], Optional[str]]:
+    # [NEW] ingest_options: {'use_cache', 'cache_dir'} cho convert-cache, 'reuse_shell' cho shell pool
+    file_path, occurrence, app_name, ingest_options = args
+    ingest_options = ingest_options or {}
+    category = 'entry' if occurrence % 2 == 1 else 'reentry'
+    scratch_path = None
     
     try:
-        with TraceProcessor(trace=file_path, config=config) as tp:
-            # GỌI HÀM PHÂN TÍCH MỚI
-            metrics = analyze_reaction_trace(tp, file_path)
-            category = 'entry' if occurrence % 2 == 1 else 'reentry'
-            return (app_name, occurrence, category, metrics)
+        cached = cached_trace_path(file_path, ingest_options.get('cache_dir')) if ingest_options.get('use_cache') else None
+        # [NEW] Pre-scan ở mức byte, loại trace hỏng trước khi spawn trace_processor
+        if cached:
+            missing = cached_missing_markers(cached, REQUIRED_MARKERS)
+            reason = missing[0] if missing else None
+        else:
+            reason = prescan_trace(file_path, REQUIRED_MARKERS)
+        if reason:
+            print(f"    [SKIP REACTION] {Path(file_path).name}: {reason}")
+            return (app_name, occurrence, category, None, reason)
+
+        trace_path = cached
+        if not cached:
+            # [UPDATED] Cùng payload với chế độ execution + reaction (trace_worker): ftrace text
+            # qua load_trace_data (giải nén, fix circular buffer), shell đọc từ scratch
+            scratch_path = write_scratch_trace(load_trace_data(file_path), ingest_options.get('scratch_dir'))
+            trace_path = scratch_path
+
+        # [UPDATED] Dùng lại shell sống lâu của worker (reuse_shell), hoặc spawn shell
+        # riêng đọc trực tiếp payload (scratch / .pftrace) theo path
+        # [NEW] Hết trace/query timeout -> shell bị kill, process chính xếp lại sau backoff
+        shell_stats = {}
+        try:
+            with open_trace(trace_path, TRACE_PROCESSOR_BIN,
+                            reuse_shell=ingest_options.get('reuse_shell', False),
+                            stats=shell_stats,
+                            query_timeout=ingest_options.get('query_timeout', QUERY_TIMEOUT_S),
+                            trace_timeout=ingest_options.get('trace_timeout', TRACE_TIMEOUT_S)) as tp:
+                # [NEW] slice_tables 'table': materialise slice_with_names (slice_tables.py)
+                tp = prepare_slice_tables(tp, ingest_options.get('slice_tables', 'view'), shell_stats)
+                # GỌI HÀM PHÂN TÍCH MỚI
+                metrics = analyze_reaction_trace(tp, file_path)
+                metrics['shell_stats'] = shell_stats
+                return (app_name, occurrence, category, metrics, None)
+        except TraceTimeout as e:
+            print(f"    [TIMEOUT REACTION] {Path(file_path).name}: {e}")
+            return (app_name, occurrence, category, None, ANALYSIS_TIMEOUT)
     except Exception as e:
         print(f"    [ERROR REACTION] {Path(file_path).name}: {e}")
-        return (app_name, occurrence, 'entry' if occurrence % 2 == 1 else 'reentry', None)
+        return (app_name, occurrence, category, None, ANALYSIS_ERROR)
+    finally:
+        if scratch_path:
+            discard_scratch_trace(scratch_path)
 
 
-def process_all_traces(folder_path: str, label: str, num_workers: int = 8, target_apps: List[str] = None):
+def _run_reaction_pool(pool, tasks):
+    """
+    Submit process_single_trace cho từng task; trace bị timeout được xếp lại
+    (tối đa TRACE_MAX_ATTEMPTS lần, backoff lũy thừa) từ process chính, worker
+    không ngủ trong lúc chờ nên vẫn phân tích trace khác.
+    Yield (task, kết quả) theo thứ tự hoàn thành.
+    """
+    events = queue.Queue()
+    attempts = defaultdict(int)
+    retries = []  # heap (ready_at, seq, task)
+    retry_seq = itertools.count()
+    in_flight = 0
+
+    def submit(task):
+        attempts[task[0]] += 1
+        pool.apply_async(process_single_trace, (task,),
+                         callback=lambda r, t=task: events.put((t, r)),
+                         error_callback=lambda e, t=task: events.put(
+                             (t, (t[2], t[1], None, None, ANALYSIS_ERROR))))
+
+    for task in tasks:
+        submit(task)
+        in_flight += 1
+    while in_flight or retries:
+        while retries and retries[0][0] <= time.monotonic():
+            submit(heapq.heappop(retries)[2])
+            in_flight += 1
+        wait_s = max(0.0, retries[0][0] - time.monotonic()) if retries else None
+        if not in_flight:
+            time.sleep(wait_s)
+            continue
+        try:
+            task, result = events.get(timeout=wait_s)
+        except queue.Empty:
+            continue
+        in_flight -= 1
+        if result[4] == ANALYSIS_TIMEOUT and attempts[task[0]] < TRACE_MAX_ATTEMPTS:
+            backoff = RETRY_BACKOFF_S * 2 ** (attempts[task[0]] - 1)
+            print(f"    [RETRY REACTION] {Path(task[0]).name}: attempt {attempts[task[0]] + 1}/"
+                  f"{TRACE_MAX_ATTEMPTS} in {backoff:.0f}s")
+            heapq.heappush(retries, (time.monotonic() + backoff, next(retry_seq), task))
+            continue
+        yield task, result
+
+
+def process_all_traces(folder_path: str, label: str, num_workers: int = 8, target_apps: List[str] = None,
+                       ingest_options: Dict[str, Any] = None, skipped: Optional[List[Tuple[str, str, str]]] = None,
+                       precomputed: Optional[Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]] = None):
+    """
+    [NEW] precomputed: {trace_path: (metrics, reason)} đã phân tích sẵn trên trace
+    load bởi execution (chế độ execution + reaction, xem execution_sql.run_analysis);
+    chỉ trace không có trong đó mới được load lại trong pool.
+    """
+    precomputed = precomputed or {}
     # Fallback nếu không truyền
     if target_apps is None:
         target_apps = TARGET_APPS
 
-    trace_files = sorted([str(f) for f in Path(folder_path).glob("*.log")])
+    trace_files = collect_trace_files(folder_path)
     
     if label == "DUT":
         print(f"Target Apps Filter: {target_apps}")
@@ -236,7 +235,7 @@ def process_all_traces(folder_path: str, label: str, num_workers: int = 8, targe
     app_occurrence_count = defaultdict(int)
     
     for file_path in trace_files:
-        filename = Path(file_path).stem
+        filename = trace_stem(file_path)
         parts = filename.split('_')
         
         if len(parts) >= 2:
@@ -250,28 +249,65 @@ def process_all_traces(folder_path: str, label: str, num_workers: int = 8, targe
             app_occurrence_count[app_name] += 1
             app_groups[app_name].append((file_path, app_occurrence_count[app_name]))
 
+    # [NEW] Scratch dir cho payload của trace nén, xoá sau khi pool kết thúc
+    scratch_dir = make_scratch_dir()
+    ingest_options = dict(ingest_options or {}, scratch_dir=scratch_dir)
+
     tasks = []
     for app_name, file_list in app_groups.items():
         for file_path, occurrence in file_list:
-            tasks.append((file_path, occurrence, app_name))
+            tasks.append((file_path, occurrence, app_name, ingest_options))
 
-    print(f"\n[{label}] Processing {len(tasks)} files (Reaction Analysis)...")
+    pool_tasks = [task for task in tasks if task[0] not in precomputed]
+    if precomputed:
+        print(f"\n[{label}] Processing {len(tasks)} files (Reaction Analysis, "
+              f"{len(tasks) - len(pool_tasks)} reused from execution load)...")
+    else:
+        print(f"\n[{label}] Processing {len(tasks)} files (Reaction Analysis)...")
     
     # Pre-allocate results structure
     results = defaultdict(lambda: {'entry': [None] * 50, 'reentry': [None] * 50})
-
-    pool = Pool(processes=num_workers)
+    shell_stats = []
+
+    def store(task, metrics, reason, done):
+        file_path, occurrence, app_name = task[0], task[1], task[2]
+        category = 'entry' if occurrence % 2 == 1 else 'reentry'
+        if reason and skipped is not None:
+            skipped.append((label, trace_stem(file_path), reason))
+        if metrics:
+            shell_stats.append(metrics.pop('shell_stats', {}))
+            cycle_index = (occurrence - 1) // 2
+            while len(results[app_name][category]) <= cycle_index:
+                results[app_name][category].append(None)
+            results[app_name][category][cycle_index] = metrics
+            print(f"  - [{done}/{len(tasks)}] {app_name} - {category} - cycle {cycle_index + 1}")
+
+    done = 0
+    for task in tasks:
+        if task[0] in precomputed:
+            done += 1
+            store(task, *precomputed[task[0]], done)
+
+    pool = Pool(processes=num_workers) if pool_tasks else None
     try:
-        for i, (app_name, occurrence, category, metrics) in enumerate(pool.imap(process_single_trace, tasks)):
-            if metrics:
-                cycle_index = (occurrence - 1) // 2
-                while len(results[app_name][category]) <= cycle_index:
-                    results[app_name][category].append(None)
-                results[app_name][category][cycle_index] = metrics
-                print(f"  - [{i+1}/{len(tasks)}] {app_name} - {category} - cycle {cycle_index + 1}")
+        if pool is not None:
+            for task, (_, _, _, metrics, reason) in _run_reaction_pool(pool, pool_tasks):
+                done += 1
+                store(task, metrics, reason, done)
     finally:
-        pool.close()
-        pool.join()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        remove_scratch_dir(scratch_dir)
+
+    # [NEW] Chi phí spawn/teardown trace_processor_shell (shell pool)
+    shell_summary = format_shell_summary(shell_stats)
+    if shell_summary:
+        print(f"[{label}] {shell_summary}")
+    slice_summary = format_slice_tables_summary(shell_stats)
+    if slice_summary:
+        print(f"[{label}] {slice_summary}")
+        print_query_timings(shell_stats)
 
     cleaned = {}
     for app, cats in results.items():
@@ -483,11 +519,11 @@ def create_excel_output(
 # ---------------------------------------------------------------------------
 
 def collect_trace_files(folder_path: str) -> List[str]:
-    """Helper: Collect file .log trong folder"""
+    """Helper: Collect file trace (.log / .log.gz / .log.zst / .log.zip) trong folder"""
     folder = Path(folder_path)
     if not folder.exists() or not folder.is_dir():
         return []
-    return sorted([str(f) for f in folder.glob("*.log")])
+    return sorted([str(f) for f in folder.iterdir() if f.is_file() and is_trace_file(f.name)])
 
 # ... (phần đầu file giữ nguyên) ...
 
@@ -495,29 +531,43 @@ def collect_trace_files(folder_path: str) -> List[str]:
 # Main Function for External Call
 # ---------------------------------------------------------------------------
 
-def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None) -> None:
+def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None,
+                 use_cache: bool = False, cache_dir: Optional[str] = None,
+                 reuse_shells: bool = False,
+                 precomputed: Optional[Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]] = None,
+                 slice_tables: str = 'view') -> None:
     """
     Phân tích Reaction Time từ các trace trong DUT và REF folders
     
     Args:
         dut_folder: Đường dẫn folder DUT
         ref_folder: Đường dẫn folder REF
+        use_cache: True để load bản protobuf từ convert-cache nếu có (python trace_cache.py)
+        cache_dir: Folder cache (mặc định .trace_cache/ cạnh mỗi trace)
+        reuse_shells: True để mỗi worker giữ một trace_processor_shell sống lâu (trace
+                      stream qua HTTP); False (mặc định) để shell tự đọc trace theo path
+        precomputed: {trace_path: (metrics, reason)} đã phân tích trên trace do
+                     execution load (execution_sql.run_analysis(with_reaction=True))
+        slice_tables: 'view' hoặc 'table' (materialise slice_with_names, xem slice_tables.py)
     """
     num_workers = min(cpu_count(), 8)
+    ingest_options = {'use_cache': use_cache, 'cache_dir': cache_dir, 'reuse_shell': reuse_shells,
+                      'slice_tables': slice_tables}
 
     print("="*60)
     print("REACTION TIME ANALYSIS")
     print("="*60)
 
     # 1. Processing
-    dut_res = process_all_traces(dut_folder, "DUT", num_workers, target_apps)
-    ref_res = process_all_traces(ref_folder, "REF", num_workers, target_apps)
+    skipped = []
+    dut_res = process_all_traces(dut_folder, "DUT", num_workers, target_apps, ingest_options, skipped, precomputed)
+    ref_res = process_all_traces(ref_folder, "REF", num_workers, target_apps, ingest_options, skipped, precomputed)
 
     # 2. Extract Header Title từ file đầu tiên của DUT
     header_title = "Reaction Metric" # Default
     dut_files = collect_trace_files(dut_folder)
     if dut_files:
-        first_file = Path(dut_files[0]).stem
+        first_file = trace_stem(dut_files[0])
         parts = first_file.split("_")
         if len(parts) >= 2:
             header_title = f"{parts[0]}_{parts[1]}"
@@ -527,6 +577,10 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
     # 3. Generating Excel
     print("\nGenerating Excel...")
     create_excel_output(dut_res, ref_res, dut_folder, header_title)
+    if skipped:
+        print(f"\nSkipped {len(skipped)} traces:")
+        for label, filename, reason in skipped:
+            print(f"  - [{label}] {filename}: {reason}")
     print("\nDone.")
 
 # ---------------------------------------------------------------------------
@@ -535,14 +589,19 @@ def run_analysis(dut_folder: str, ref_folder: str, target_apps: List[str] = None
 
 def main():
     if len(sys.argv) < 3:
-        print("Usage: python reaction_sql.py <dut_folder> <ref_folder>")
+        print("Usage: python reaction_sql.py <dut_folder> <ref_folder> [--use-cache] [--shell-pool] "
+              "[--slice-tables-table]")
         sys.exit(1)
     
     dut_folder = sys.argv[1]
     ref_folder = sys.argv[2]
+    use_cache = '--use-cache' in sys.argv[3:]
+    reuse_shells = '--shell-pool' in sys.argv[3:]
+    slice_tables = 'table' if '--slice-tables-table' in sys.argv[3:] else 'view'
     
     try:
-        run_analysis(dut_folder, ref_folder)
+        run_analysis(dut_folder, ref_folder, use_cache=use_cache, reuse_shells=reuse_shells,
+                     slice_tables=slice_tables)
     except Exception as e:
         print(f"\n[ERROR] Analysis failed: {e}")
         traceback.print_exc()
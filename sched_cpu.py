@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sched_cpu.py
+
+CPU usage (top process / top thread) cho NHIỀU cửa sổ [touch_down, end_ts) cùng
+lúc. Thay cho get_top_cpu_usage_process / get_top_cpu_usage_thread (mỗi lần gọi
+dựng view trên toàn bộ sched_slice + SPAN_JOIN rồi drop), được gọi lại cho mỗi
+end_ts variant -> tối đa 6 lần quét sched mỗi trace.
+
+- Kéo sched slice giao với [touch_down, max end_ts) trên các CPU cần tính MỘT lần
+  (chỉ ts, dur, utid) + bảng thuộc tính thread (tid, tên, process).
+- Cắt slice theo tất cả cửa sổ bằng broadcasting NumPy (cửa sổ x slice), gom
+  theo (cửa sổ, utid) một lần rồi roll up lên thread và process.
+- DataFrame trả về cùng cột với query cũ (proc_name, raw_pid, dur_ms,
+  Occurences, dur_percent / tid, thread_name, proc_name, ...) nên
+  process_cpu_data_process / process_cpu_data_thread dùng lại được.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+DEFAULT_CPU_CORES = [0, 1, 2, 3, 4, 5, 6, 7]
+# dur_percent giữ đúng công thức của query cũ: SUM(dur) * 100 / dur_time * 7
+DUR_PERCENT_FACTOR = 7
+
+SCHED_WINDOW_SQL = """
+SELECT ts, dur, utid
+FROM sched_slice
+WHERE ts < {end_ts}
+  AND ts + dur > {start_ts}
+  AND dur > 0
+  AND cpu IN ({cpus});
+"""
+
+# Tên process theo 2 cách của query cũ: proc_name (bảng process, bỏ tên main
+# thread binder/kworker) và thread_proc_name (bảng thread)
+THREAD_ATTR_SQL = """
+SELECT
+    thread.utid, thread.tid, thread.name AS thread_name,
+    process.pid AS raw_pid,
+    COALESCE(
+        process.name,
+        CASE
+            WHEN main_thread.name LIKE '%binder%' OR main_thread.name LIKE '%kworker%' THEN NULL
+            ELSE main_thread.name
+        END,
+        'PID-' || process.pid
+    ) AS proc_name,
+    COALESCE(process.name, main_thread.name, 'PID-' || process.pid) AS thread_proc_name
+FROM thread JOIN process USING (upid)
+LEFT JOIN thread AS main_thread ON (process.pid = main_thread.tid)
+WHERE NOT thread.name LIKE 'swapper%';
+"""
+
+PROCESS_COLUMNS = ['proc_name', 'raw_pid', 'dur_ms', 'Occurences', 'dur_percent']
+THREAD_COLUMNS = ['tid', 'thread_name', 'proc_name', 'dur_ms', 'Occurences', 'dur_percent']
+
+
+def _query(tp, sql: str) -> Optional[pd.DataFrame]:
+    res = tp.query(sql)
+    return res.as_pandas_dataframe() if res is not None else None
+
+
+def _sql_round(values: pd.Series) -> pd.Series:
+    """ROUND(x, 2) của SQLite (làm tròn nửa ra xa 0), giá trị ở đây luôn >= 0."""
+    return np.floor(values * 100 + 0.5) / 100
+
+
+def _finish(grouped: pd.DataFrame, columns: List[str], dur_time: int) -> pd.DataFrame:
+    grouped = grouped.assign(
+        dur_ms=grouped['dur'] / 1e6,
+        dur_percent=_sql_round(grouped['dur'] * 100.0 / dur_time * DUR_PERCENT_FACTOR),
+    )
+    grouped = grouped.sort_values('dur_ms', ascending=False, kind='stable')
+    return grouped[columns].reset_index(drop=True)
+
+
+def clip_windows(ts: np.ndarray, dur: np.ndarray, start_ts: int, ends: np.ndarray) -> np.ndarray:
+    """Thời lượng giao của từng slice với từng cửa sổ [start_ts, end) -> mảng (cửa sổ, slice)."""
+    begin = np.maximum(ts, start_ts)
+    return np.minimum((ts + dur)[None, :], ends[:, None]) - begin[None, :]
+
+
+def get_cpu_usage_windows(tp, start_ts: int, end_times: Dict[str, int],
+                          cpu_cores: List[int] = None
+                          ) -> Optional[Dict[str, Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]]]:
+    """
+    CPU usage theo process và theo thread cho mọi cửa sổ [start_ts, end_ts).
+    end_times: {variant: end_ts}. Trả về {variant: (proc_df, thread_df)} (None
+    cho cửa sổ rỗng, như query cũ), hoặc None nếu query lỗi (người gọi dùng query cũ).
+    """
+    cpu_cores = DEFAULT_CPU_CORES if cpu_cores is None else cpu_cores
+    windows = {name: end for name, end in end_times.items()
+               if start_ts and end and end - start_ts > 0}
+    result = {name: (None, None) for name in end_times}
+    if not cpu_cores or not windows:
+        return result
+
+    names = list(windows)
+    ends = np.array([windows[n] for n in names], dtype=np.int64)
+    try:
+        sched = _query(tp, SCHED_WINDOW_SQL.format(start_ts=start_ts, end_ts=int(ends.max()),
+                                                   cpus=','.join(map(str, cpu_cores))))
+        attrs = _query(tp, THREAD_ATTR_SQL)
+    except SHELL_CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[SQL Error] {e}")
+        return None
+    if sched is None or sched.empty or attrs is None or attrs.empty:
+        return result
+
+    ts = sched['ts'].to_numpy(dtype=np.int64)
+    dur = sched['dur'].to_numpy(dtype=np.int64)
+    utid = sched['utid'].to_numpy(dtype=np.int64)
+    clipped = clip_windows(ts, dur, start_ts, ends)
+    window_idx, slice_idx = np.nonzero(clipped > 0)
+    if not len(window_idx):
+        return result
+
+    # (cửa sổ, utid) -> tổng dur, số slice; join thuộc tính thread (LEFT JOIN
+    # main_thread có thể trả nhiều dòng / utid -> nhân bản như SPAN_JOIN cũ)
+    per_utid = (pd.DataFrame({'window': window_idx, 'utid': utid[slice_idx],
+                              'dur': clipped[window_idx, slice_idx]})
+                .groupby(['window', 'utid'], sort=False)
+                .agg(dur=('dur', 'sum'), Occurences=('dur', 'size'))
+                .reset_index()
+                .merge(attrs, on='utid', how='inner'))
+
+    by_thread = (per_utid.groupby(['window', 'thread_name', 'thread_proc_name', 'tid'], sort=False, dropna=False)
+                 [['dur', 'Occurences']].sum().reset_index()
+                 .rename(columns={'thread_proc_name': 'proc_name'}))
+    # raw_pid của nhóm process: pid đóng góp nhiều CPU nhất
+    per_utid = per_utid.assign(_key=per_utid['proc_name'].where(per_utid['proc_name'].notna(),
+                                                                per_utid['raw_pid']))
+    by_process = per_utid.groupby(['window', '_key'], sort=False, dropna=False).agg(
+        proc_name=('proc_name', 'first'), dur=('dur', 'sum'), Occurences=('Occurences', 'sum'))
+    top_pid = (per_utid.groupby(['window', '_key', 'raw_pid'], sort=False, dropna=False)['dur'].sum()
+               .reset_index().sort_values('dur', ascending=False, kind='stable')
+               .drop_duplicates(['window', '_key']).set_index(['window', '_key'])['raw_pid'])
+    by_process = by_process.join(top_pid).reset_index()
+
+    for i, name in enumerate(names):
+        dur_time = int(ends[i] - start_ts)
+        procs = by_process[by_process['window'] == i]
+        threads = by_thread[by_thread['window'] == i]
+        result[name] = (_finish(procs, PROCESS_COLUMNS, dur_time) if not procs.empty else None,
+                        _finish(threads, THREAD_COLUMNS, dur_time) if not threads.empty else None)
+    return result
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+slice_index.py
+
+SliceIndex: toàn bộ slice_with_names của một trace được kéo về MỘT lần thành
+mảng NumPy (id, ts, dur, name id, utid, tid, upid, pid), sắp theo ts. Các helper
+tìm slice của sql_query (find_slice, get_event_ts, get_choreographer,
+get_launching_end...) trả lời trong bộ nhớ thay vì mỗi lần một round trip SQL.
+
+- Tên slice được intern (pd.factorize): mỗi tên có một đoạn row (theo ts) riêng,
+  nên lọc theo tên chỉ chạm vào các row của tên đó.
+- name_like theo đúng ngữ nghĩa LIKE của SQLite (%, _, không phân biệt hoa
+  thường ASCII), chỉ so khớp trên danh sách tên duy nhất rồi cache lại.
+- "Đầu tiên sau ts": searchsorted trên ts của các row ứng viên.
+
+Index được gắn vào TraceProcessor (attribute slice_index) bởi ensure_slice_index;
+helper không thấy index (vd. trace quá lớn) sẽ chạy SQL như cũ. Recorder SQL
+của batch engine mang index rỗng để không prefetch query mà index đã trả lời.
+"""
+
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+SLICE_INDEX_ENABLED = True
+# Trace có nhiều slice hơn mức này không dựng index (RAM + thời gian kéo dữ liệu)
+SLICE_INDEX_MAX_ROWS = 3_000_000
+# Giá trị thay cho NULL (utid/tid/upid/pid của slice không nằm trên thread track)
+NULL_ID = -1
+
+SLICE_INDEX_SQL = """
+SELECT id, ts, dur, name, utid, tid, upid, pid
+FROM slice_with_names
+ORDER BY ts, id;
+"""
+SLICE_COUNT_SQL = "SELECT COUNT(*) AS cnt FROM slice;"
+
+ID_COLUMNS = ('id', 'ts', 'dur', 'utid', 'tid', 'upid', 'pid')
+
+
+def like_to_regex(pattern: str) -> 're.Pattern':
+    """Pattern LIKE của SQLite -> regex (% = chuỗi bất kỳ, _ = một ký tự, không phân biệt hoa thường)."""
+    parts = []
+    for ch in pattern:
+        if ch == '%':
+            parts.append('.*')
+        elif ch == '_':
+            parts.append('.')
+        else:
+            parts.append(re.escape(ch))
+    return re.compile(''.join(parts), re.IGNORECASE | re.DOTALL)
+
+
+class SliceIndex:
+    """Slice của một trace trong mảng NumPy, sắp theo (ts, id)."""
+
+    def __init__(self, df: pd.DataFrame):
+        for column in ID_COLUMNS:
+            values = pd.to_numeric(df[column], errors='coerce').fillna(NULL_ID)
+            setattr(self, column, values.to_numpy(dtype=np.int64))
+        codes, names = pd.factorize(df['name'])
+        self.names = [str(n) for n in names]
+        self.name_codes = codes.astype(np.int32)
+        self._code_by_name = {name: code for code, name in enumerate(self.names)}
+        # Row của từng tên, giữ thứ tự ts (stable sort)
+        self._rows_by_name = np.argsort(self.name_codes, kind='stable')
+        sorted_codes = self.name_codes[self._rows_by_name]
+        all_codes = np.arange(len(self.names))
+        self._name_start = np.searchsorted(sorted_codes, all_codes, 'left')
+        self._name_end = np.searchsorted(sorted_codes, all_codes, 'right')
+        self._like_cache: Dict[str, List[int]] = {}
+
+    def __len__(self):
+        return len(self.ts)
+
+    def codes_for(self, name_exact: str = None, name_like: str = None,
+                  names: List[str] = None) -> Optional[List[int]]:
+        """Name id khớp điều kiện tên (None = không lọc theo tên)."""
+        codes = None
+        if name_exact is not None or names is not None:
+            wanted = [name_exact] if name_exact is not None else list(names)
+            codes = [self._code_by_name[n] for n in wanted if n in self._code_by_name]
+        if name_like is not None:
+            like_codes = self._like_cache.get(name_like)
+            if like_codes is None:
+                regex = like_to_regex(name_like)
+                like_codes = [c for c, n in enumerate(self.names) if regex.fullmatch(n)]
+                self._like_cache[name_like] = like_codes
+            codes = like_codes if codes is None else sorted(set(codes) & set(like_codes))
+        return codes
+
+    def rows(self, codes: Optional[List[int]]) -> np.ndarray:
+        """Vị trí row (tăng dần = theo ts) của các name id."""
+        if codes is None:
+            return np.arange(len(self.ts))
+        segments = [self._rows_by_name[self._name_start[c]:self._name_end[c]] for c in codes]
+        if not segments:
+            return np.empty(0, dtype=np.int64)
+        if len(segments) == 1:
+            return segments[0]
+        return np.sort(np.concatenate(segments))
+
+    def select(self, name_exact: str = None, name_like: str = None, names: List[str] = None,
+               upid: int = None, pid: int = None, tid: int = None,
+               min_ts: int = None, before_ts: int = None) -> np.ndarray:
+        """Vị trí các row thoả mọi điều kiện, theo thứ tự ts."""
+        rows = self.rows(self.codes_for(name_exact, name_like, names))
+        if min_ts is not None and len(rows):
+            rows = rows[np.searchsorted(self.ts[rows], min_ts, 'left'):]
+        if before_ts is not None and len(rows):
+            rows = rows[:np.searchsorted(self.ts[rows], before_ts, 'left')]
+        mask = None
+        for column, value in (('upid', upid), ('pid', pid), ('tid', tid)):
+            if value is None:
+                continue
+            match = getattr(self, column)[rows] == int(value)
+            mask = match if mask is None else (mask & match)
+        return rows if mask is None else rows[mask]
+
+    def first(self, by_id: bool = False, **conditions) -> Optional[int]:
+        """
+        Row đầu tiên (ts nhỏ nhất) thoả điều kiện, None nếu không có.
+        by_id=True: row có id nhỏ nhất (thứ tự quét của query không có ORDER BY).
+        """
+        rows = self.select(**conditions)
+        if not len(rows):
+            return None
+        return int(rows[np.argmin(self.id[rows])]) if by_id else int(rows[0])
+
+    def _value(self, column: str, pos: int):
+        value = int(getattr(self, column)[pos])
+        return None if value == NULL_ID and column in ('utid', 'tid', 'upid', 'pid') else value
+
+    def row(self, pos: int) -> pd.Series:
+        """Row theo format của find_slice: ts, dur, end_ts, name, tid, pid, upid."""
+        ts, dur = int(self.ts[pos]), int(self.dur[pos])
+        code = self.name_codes[pos]
+        return pd.Series({
+            'ts': ts, 'dur': dur, 'end_ts': ts + dur,
+            'name': self.names[code] if code >= 0 else None,
+            'tid': self._value('tid', pos), 'pid': self._value('pid', pos),
+            'upid': self._value('upid', pos),
+        })
+
+    def count_sum_dur(self, **conditions):
+        """(số slice, tổng dur) của các row thoả điều kiện."""
+        rows = self.select(**conditions)
+        return len(rows), int(self.dur[rows].sum()) if len(rows) else 0
+
+
+def build_slice_index(tp) -> Optional[SliceIndex]:
+    """Kéo slice_with_names về thành SliceIndex (None nếu trace quá lớn hoặc lỗi)."""
+    try:
+        count = tp.query(SLICE_COUNT_SQL).as_pandas_dataframe()
+        if int(count.iloc[0]['cnt']) > SLICE_INDEX_MAX_ROWS:
+            return None
+        df = tp.query(SLICE_INDEX_SQL).as_pandas_dataframe()
+    except SHELL_CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[WARN] Không dựng được SliceIndex, dùng SQL: {e}")
+        return None
+    return SliceIndex(df)
+
+
+def ensure_slice_index(tp) -> Optional[SliceIndex]:
+    """Dựng SliceIndex một lần cho tp (cần view slice_with_names) và gắn vào tp.slice_index."""
+    if not SLICE_INDEX_ENABLED:
+        return None
+    if not hasattr(tp, 'slice_index'):
+        tp.slice_index = build_slice_index(tp)
+    return tp.slice_index
+
+
+def get_slice_index(tp) -> Optional[SliceIndex]:
+    """SliceIndex đã gắn vào tp (None -> helper chạy SQL)."""
+    return getattr(tp, 'slice_index', None)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+slice_tables.py
+
+Materialise slice_with_names thành TABLE (một lần cho mỗi trace) thay cho VIEW
+join slice + thread_track + thread + process: mỗi find_slice, get_choreographer,
+get_binder_transaction, query reaction... không phải chạy lại join 4 bảng.
+
+- slice_with_names: chỉ giữ các cột sql_query/reaction_sql dùng, index trên
+  name, (upid, name) và (tid, name, ts).
+- process_slice_with_names: slice trên process track (animating, animator,
+  slice của app process) cho get_animating, get_drawFrame, get_slice_on_app_process.
+
+Table phải được tạo TRƯỚC ensure_slice_with_names_view (CREATE VIEW IF NOT
+EXISTS sẽ bỏ qua vì tên đã tồn tại). Helper dùng process_slice_with_names chỉ
+khi has_process_slice_table(tp), ngược lại chạy query join như cũ.
+
+TimedTraceProcessor đo thời gian từng query theo helper đã gửi query; chạy
+với mode 'view' rồi 'table' để so sánh trước/sau (format_slice_tables_summary,
+print_query_timings).
+"""
+
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+SLICE_TABLE_MODES = ('view', 'table')
+# Số helper chậm nhất in ra trong báo cáo timing
+QUERY_TIMING_TOP = 12
+# Frame "đường ống" bỏ qua khi tìm helper đã gửi query
+QUERY_PLUMBING = frozenset({'query', 'query_df', '<lambda>'})
+
+SLICE_TABLE_STATEMENTS = (
+    "DROP VIEW IF EXISTS slice_with_names;",
+    """
+    CREATE TABLE IF NOT EXISTS slice_with_names AS
+    SELECT
+        s.id, s.ts, s.dur, s.name,
+        t.utid, t.name AS thread_name,
+        th.tid, th.upid,
+        p.pid, p.name AS process_name
+    FROM slice s
+    LEFT JOIN thread_track t ON s.track_id = t.id
+    LEFT JOIN thread th      ON t.utid = th.utid
+    LEFT JOIN process p      ON th.upid = p.upid;
+    """,
+    "CREATE INDEX IF NOT EXISTS slice_with_names_name ON slice_with_names(name);",
+    "CREATE INDEX IF NOT EXISTS slice_with_names_upid_name ON slice_with_names(upid, name);",
+    "CREATE INDEX IF NOT EXISTS slice_with_names_tid_name_ts ON slice_with_names(tid, name, ts);",
+)
+
+PROCESS_SLICE_TABLE_STATEMENTS = (
+    """
+    CREATE TABLE IF NOT EXISTS process_slice_with_names AS
+    SELECT
+        s.id, s.ts, s.dur, s.name,
+        pt.name AS track_name, pt.upid,
+        p.pid
+    FROM slice s
+    JOIN process_track pt ON s.track_id = pt.id
+    LEFT JOIN process p   ON pt.upid = p.upid;
+    """,
+    "CREATE INDEX IF NOT EXISTS process_slice_with_names_name ON process_slice_with_names(name);",
+    "CREATE INDEX IF NOT EXISTS process_slice_with_names_pid_name_ts "
+    "ON process_slice_with_names(pid, name, ts);",
+)
+
+
+def materialize_slice_tables(tp) -> Optional[float]:
+    """
+    Tạo slice_with_names + process_slice_with_names dạng table (có index) trên tp.
+    Trả về thời gian (s), hoặc None nếu lỗi (helper giữ đường view/join cũ).
+    """
+    start = time.perf_counter()
+    try:
+        for sql in SLICE_TABLE_STATEMENTS:
+            tp.query(sql)
+        for sql in PROCESS_SLICE_TABLE_STATEMENTS:
+            tp.query(sql)
+    except SHELL_CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[WARN] Không materialise được slice_with_names, dùng view: {e}")
+        return None
+    tp.process_slice_table = True
+    return time.perf_counter() - start
+
+
+def has_process_slice_table(tp) -> bool:
+    """True nếu tp đã có process_slice_with_names (materialize_slice_tables)."""
+    return getattr(tp, 'process_slice_table', False)
+
+
+def _caller_label() -> str:
+    """Tên helper (vd. find_slice, get_drawFrame) đã gửi query hiện tại."""
+    frame = sys._getframe(2)
+    while frame is not None and frame.f_code.co_name in QUERY_PLUMBING:
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else '?'
+
+
+class TimedTraceProcessor:
+    """
+    Bọc TraceProcessor: đo thời gian từng query, gom theo helper đã gửi query
+    -> timings {helper: [số query, tổng giây]}. Attribute khác (slice_index,
+    process_slice_table...) đọc từ tp gốc.
+    """
+
+    def __init__(self, tp, timings: Dict[str, List[float]] = None):
+        self.tp = tp
+        self.timings = timings if timings is not None else {}
+
+    def __getattr__(self, name):
+        if name == 'tp':
+            raise AttributeError(name)
+        return getattr(self.tp, name)
+
+    def query(self, sql):
+        label = _caller_label()
+        start = time.perf_counter()
+        try:
+            return self.tp.query(sql)
+        finally:
+            entry = self.timings.setdefault(label, [0, 0.0])
+            entry[0] += 1
+            entry[1] += time.perf_counter() - start
+
+
+def prepare_slice_tables(tp, mode: str = 'view', stats: Dict[str, Any] = None) -> TimedTraceProcessor:
+    """
+    Chuẩn bị slice_with_names theo mode ('view' | 'table') và trả về tp đã bọc
+    TimedTraceProcessor. stats (dict, optional) nhận slice_tables (mode thực tế),
+    slice_tables_s (thời gian materialise) và query_timings.
+    """
+    stats = stats if stats is not None else {}
+    applied = 'view'
+    if mode == 'table':
+        elapsed = materialize_slice_tables(tp)
+        if elapsed is not None:
+            applied = 'table'
+            stats['slice_tables_s'] = elapsed
+    stats['slice_tables'] = applied
+    timed = TimedTraceProcessor(tp)
+    stats['query_timings'] = timed.timings
+    return timed
+
+
+def merge_query_timings(stats_list) -> Dict[str, Dict[str, List[float]]]:
+    """Gom query_timings của các trace theo mode -> {mode: {helper: [số query, tổng giây]}}."""
+    merged: Dict[str, Dict[str, List[float]]] = {}
+    for stats in stats_list:
+        if 'query_timings' not in stats:
+            continue
+        by_helper = merged.setdefault(stats.get('slice_tables', 'view'), {})
+        for label, (count, seconds) in stats['query_timings'].items():
+            entry = by_helper.setdefault(label, [0, 0.0])
+            entry[0] += count
+            entry[1] += seconds
+    return merged
+
+
+def format_slice_tables_summary(stats_list) -> Optional[str]:
+    """Dòng báo cáo: số trace theo mode, chi phí materialise và tổng thời gian query."""
+    stats_list = [s for s in stats_list if 'slice_tables' in s]
+    if not stats_list:
+        return None
+    tables = [s for s in stats_list if s['slice_tables'] == 'table']
+    materialise_s = sum(s.get('slice_tables_s', 0.0) for s in tables)
+    parts = []
+    for mode, by_helper in sorted(merge_query_timings(stats_list).items()):
+        count = sum(c for c, _ in by_helper.values())
+        seconds = sum(t for _, t in by_helper.values())
+        avg_ms = seconds * 1000 / count if count else 0.0
+        parts.append(f"{mode}: {count} queries {seconds:.1f}s ({avg_ms:.2f} ms/query)")
+    line = (f"[SLICES] slice_with_names as table on {len(tables)}/{len(stats_list)} traces"
+            + (f" (materialise {materialise_s:.1f}s, {materialise_s / len(tables):.2f}s/trace)" if tables else ""))
+    return line + (" | " + ", ".join(parts) if parts else "")
+
+
+def print_query_timings(stats_list, top: int = QUERY_TIMING_TOP) -> None:
+    """In thời gian query theo helper (chậm nhất trước) cho từng mode."""
+    for mode, by_helper in sorted(merge_query_timings(stats_list).items()):
+        ranked = sorted(by_helper.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        if not ranked:
+            continue
+        print(f"[SLICES] query timings ({mode}):")
+        for label, (count, seconds) in ranked:
+            print(f"    {label:<32} {count:>6} queries {seconds:>8.2f}s "
+                  f"({seconds * 1000 / count:.2f} ms avg)")
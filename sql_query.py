@@ -6,6 +6,12 @@ from collections import defaultdict
 import pandas as pd
 from perfetto.trace_processor import TraceProcessor
 
+from slice_index import ensure_slice_index, get_slice_index
+from slice_tables import has_process_slice_table
+from sched_cpu import get_cpu_usage_windows
+from thread_state_timeline import ensure_thread_state_timeline, get_thread_state_timeline
+from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
 
 # -------------------------------------------------------------------
 def get_resource_path(relative_path):
@@ -51,7 +57,11 @@ def to_ms(ns: Optional[Union[int, float]]) -> float:
     return round(ns / 1_000_000.0, 3)
 
 def query_df(tp: TraceProcessor, sql: str) -> Optional[pd.DataFrame]:
-    """Thực thi SQL và trả về pandas.DataFrame (hoặc None nếu rỗng/lỗi)."""
+    """
+    Thực thi SQL và trả về pandas.DataFrame (hoặc None nếu rỗng/lỗi SQL).
+    [UPDATED] Query timeout (TimeoutError) và lỗi kết nối shell được raise lại
+    để open_trace đổi thành TraceTimeout / bỏ shell hỏng.
+    """
     try:
         res = tp.query(sql)
         if not res:
@@ -60,10 +70,19 @@ def query_df(tp: TraceProcessor, sql: str) -> Optional[pd.DataFrame]:
         if df is None or df.empty:
             return None
         return df
+    except SHELL_CONNECTION_ERRORS:
+        raise
     except Exception as e:
         print(f"[SQL Error] {e}")
         return None
 
+def get_stdlib_startup(tp: TraceProcessor) -> Optional[Dict[str, Any]]:
+    """
+    [NEW] Startup lấy từ stdlib android.startup (ts, ts_end, package, startup_type,
+    upid, pid) mà startup_stdlib.py gắn vào tp.stdlib_startup; None -> helper tự tìm.
+    """
+    return getattr(tp, 'stdlib_startup', None)
+
 def ensure_slice_with_names_view(tp: TraceProcessor) -> None:
     """
     Tạo view global slice_with_names.
@@ -101,7 +120,14 @@ def find_slice(
     """
     Hàm tìm kiếm slice đa năng.
     Trả về: 1 dòng (pd.Series) đầu tiên tìm thấy hoặc None.
+    [NEW] Trả lời từ SliceIndex (trong bộ nhớ) nếu tp đã có index.
     """
+    index = get_slice_index(tp)
+    if index is not None and order_by == 'ts' and not thread_name:
+        pos = index.first(name_exact=name_exact or None, name_like=name_like or None,
+                          upid=upid, pid=pid, tid=tid)
+        return index.row(pos) if pos is not None else None
+
     conditions = []
     if name_exact:
         conditions.append(f"name = '{name_exact}'")
@@ -139,6 +165,9 @@ def find_slice(
 
 def detect_app_from_launch(tp: TraceProcessor) -> Optional[str]:
     """Tìm app package từ event 'launching:%'."""
+    startup = get_stdlib_startup(tp)
+    if startup is not None:
+        return startup['package']
     row = find_slice(tp, name_like='launching:%')
     if row is None:
         return None
@@ -148,6 +177,16 @@ def detect_app_from_launch(tp: TraceProcessor) -> Optional[str]:
 def find_app_process(tp: TraceProcessor, app_pkg: str) -> Optional[Tuple[int, int, str, int]]:
     """Tìm process chính của app dựa vào activityStart/Resume."""
     # Logic: Tìm process có activityStart hoặc activityResume
+    startup = get_stdlib_startup(tp)
+    if startup is not None and startup['package'] == app_pkg:
+        return startup['upid'], startup['pid'], 'activityStart', startup['main_tid']
+    index = get_slice_index(tp)
+    if index is not None:
+        pos = index.first(names=['activityStart', 'activityResume'])
+        if pos is None:
+            return None
+        r = index.row(pos)
+        return int(r['upid']), int(r['pid']), str(r['name'] or ""), int(r['tid'])
     sql = """
     SELECT DISTINCT upid, pid, tid, name
     FROM slice_with_names
@@ -195,6 +234,13 @@ def get_activity_idle_end(tp: TraceProcessor, app_upid: int) -> Tuple[Optional[i
 
 def get_start_proc_start(tp: TraceProcessor, app_pkg: str) -> Optional[Tuple[int, int, int]]:
     """Lấy 'Start proc: <pkg>' trong thread ActivityManager."""
+    index = get_slice_index(tp)
+    if index is not None:
+        pos = index.first(name_like='startProcess:%', by_id=True)
+        if pos is None:
+            return None
+        r = index.row(pos)
+        return r['ts'], r['dur'], r['ts'] + r['dur']
     sql = """
     SELECT ts, dur
     FROM slice_with_names
@@ -211,6 +257,9 @@ def get_start_proc_start(tp: TraceProcessor, app_pkg: str) -> Optional[Tuple[int
 
 def has_bind_application(tp: TraceProcessor, app_upid: int) -> bool:
     """Kiểm tra xem app có bindApplication không (Cold launch)."""
+    startup = get_stdlib_startup(tp)
+    if startup is not None and startup['upid'] == app_upid and startup['startup_type']:
+        return startup['startup_type'] == 'cold'
     row = find_slice(tp, name_exact='bindApplication', upid=app_upid)
     return row is not None
 
@@ -228,6 +277,14 @@ def get_choreographer(tp: TraceProcessor, tid: int, min_ts: int = 0) -> Optional
     if tid is None:
         return None
 
+    index = get_slice_index(tp)
+    if index is not None:
+        pos = index.first(name_like='Choreographer#doFrame%', tid=tid, min_ts=min_ts)
+        if pos is None:
+            return None
+        r = index.row(pos)
+        return r['ts'], r['dur'], r['end_ts']
+
     # Truy vấn trực tiếp để filter theo timestamp
     sql = f"""
     SELECT ts, dur, (ts+dur) as end_ts
@@ -248,6 +305,9 @@ def get_choreographer(tp: TraceProcessor, tid: int, min_ts: int = 0) -> Optional
 
 def get_launching_end(tp: TraceProcessor, app_pkg: str) -> Optional[int]:
     """Lấy end timestamp của launching:<pkg>."""
+    startup = get_stdlib_startup(tp)
+    if startup is not None and startup['package'] == app_pkg:
+        return startup['ts_end']
     # Thử tìm có dấu cách
     row = find_slice(tp, name_like=f'launching: {app_pkg}')
     if row is not None:
@@ -258,13 +318,22 @@ def get_launching_end(tp: TraceProcessor, app_pkg: str) -> Optional[int]:
 
 def get_animating(tp: TraceProcessor) -> int:
     """Lấy end time của animating (Process Track)."""
-    sql = """
-    SELECT s.ts + s.dur as end_ts
-    FROM slice s 
-    JOIN process_track pt ON s.track_id = pt.id
-    WHERE pt.name = 'animating' AND s.name = 'animating'
-    LIMIT 1;
-    """
+    if has_process_slice_table(tp):
+        # [NEW] process_slice_with_names đã materialise (slice_tables.py)
+        sql = """
+        SELECT ts + dur as end_ts
+        FROM process_slice_with_names
+        WHERE track_name = 'animating' AND name = 'animating'
+        LIMIT 1;
+        """
+    else:
+        sql = """
+        SELECT s.ts + s.dur as end_ts
+        FROM slice s 
+        JOIN process_track pt ON s.track_id = pt.id
+        WHERE pt.name = 'animating' AND s.name = 'animating'
+        LIMIT 1;
+        """
     df = query_df(tp, sql)
     if df is None:
         # Nếu không thấy thì raise error hoặc return 0 tuỳ logic, ở đây giữ logic cũ raise error
@@ -276,9 +345,14 @@ def get_binder_transaction(tp: TraceProcessor, app_tid: int, end_ts: int):
     Tính thống kê Binder Transaction.
     Chỉ tính các transaction bắt đầu trước thời điểm end_ts (kết thúc launch).
     """
-    # Nếu không có end_ts hợp lệ thì trả về 0 để tránh lỗi SQL
-    if end_ts is None:
+    # Nếu không có end_ts / tid hợp lệ thì trả về 0 để tránh lỗi SQL
+    # (SliceIndex bỏ qua filter tid=None)
+    if end_ts is None or app_tid is None:
         return 0, 0.0
+    index = get_slice_index(tp)
+    if index is not None:
+        cnt, total_dur = index.count_sum_dur(name_exact='binder transaction', tid=app_tid, before_ts=end_ts)
+        return cnt, total_dur / 1000000.0
     sql = f"""
     SELECT COUNT(id) AS cnt, SUM(dur) / 1000000.0 AS total_ms 
     FROM slice_with_names
@@ -293,6 +367,33 @@ def get_binder_transaction(tp: TraceProcessor, app_tid: int, end_ts: int):
     row = df.iloc[0]
     return int(row['cnt']), float(row['total_ms'] or 0.0)
 
+def get_binder_transaction_slices(tp: TraceProcessor, app_tid: int, end_ts: int) -> Optional[pd.DataFrame]:
+    """
+    [NEW] Các binder transaction (ts, dur) của app_tid bắt đầu trước end_ts, để
+    WindowFamily lọc lại cho end_ts nhỏ hơn (summarize_binder_transactions).
+    """
+    if end_ts is None or app_tid is None:
+        return None
+    index = get_slice_index(tp)
+    if index is not None:
+        rows = index.select(name_exact='binder transaction', tid=app_tid, before_ts=end_ts)
+        return pd.DataFrame({'ts': index.ts[rows], 'dur': index.dur[rows]})
+    sql = f"""
+    SELECT ts, dur
+    FROM slice_with_names
+    WHERE name = 'binder transaction' 
+      AND tid = {app_tid}
+      AND ts < {end_ts}
+    ORDER BY ts;
+    """
+    return query_df(tp, sql)
+
+def summarize_binder_transactions(df) -> Tuple[int, float]:
+    """(số transaction, tổng ms) như get_binder_transaction."""
+    if df is None or df.empty:
+        return 0, 0.0
+    return len(df), float(df['dur'].sum()) / 1000000.0
+
 # -------------------------------------------------------------------
 # 3.1 REACTION QUERIES
 # -------------------------------------------------------------------
@@ -301,6 +402,13 @@ def get_onTransactionReady(tp: TraceProcessor) -> Optional[Tuple[int, int, int]]
     Get 'startAnimation' trong system_server.
     Return: (start_time, dur_time, end_time)
     """
+    index = get_slice_index(tp)
+    if index is not None:
+        pos = index.first(name_like='AIDL%startAnimation%', by_id=True)
+        if pos is None:
+            return None, None, None
+        r = index.row(pos)
+        return r['ts'], r['dur'], r['end_ts']
     sql = f"""
     SELECT ts, dur, (ts + dur) as end_ts
     FROM slice_with_names
@@ -317,6 +425,13 @@ def get_addStartingWindow(tp: TraceProcessor) -> Optional[Tuple[int, int, int]]:
     Get 'addStartingWindow' trong system_server.
     Return: (start_time, dur_time, end_time)
     """
+    index = get_slice_index(tp)
+    if index is not None:
+        pos = index.first(name_exact='addStartingWindow', by_id=True)
+        if pos is None:
+            return None, None, None
+        r = index.row(pos)
+        return r['ts'], r['dur'], r['end_ts']
     sql = f"""
     SELECT ts, dur, (ts + dur) as end_ts
     FROM slice_with_names
@@ -341,38 +456,58 @@ def get_drawFrame(tp: TraceProcessor, launcher_pid: int) -> Optional[Tuple[int,
     if not launcher_pid:
         return None
 
-    sql = f"""
-    WITH LastAnimator AS (
-        -- Bước 1: Lấy timestamp của slice 'animator' cuối cùng (Process Track)
-        SELECT s.ts
-        FROM slice s
-        JOIN process_track pt ON s.track_id = pt.id
-        JOIN process p ON pt.upid = p.upid
-        WHERE 
-            s.name = 'animator'
-            AND p.pid = {launcher_pid}
-        ORDER BY s.ts DESC
-        LIMIT 1
-    ),
-    TargetDrawFrame AS (
-        -- Bước 2: Tìm DrawFrame (Thread Track) xảy ra sau Animator
-        SELECT 
-            s.ts, 
-            s.dur
-        FROM slice s
-        JOIN thread_track tt ON s.track_id = tt.id
-        JOIN thread t ON tt.utid = t.utid
-        JOIN process p ON t.upid = p.upid
-        JOIN LastAnimator la ON 1=1 -- Cross join để lấy biến 'la.ts'
-        WHERE 
-            s.name LIKE '%DrawFrame%' 
-            AND p.pid = {launcher_pid}
-            AND s.ts > la.ts 
-        ORDER BY s.ts ASC 
-        LIMIT 1
-    )
-    SELECT * FROM TargetDrawFrame;
-    """
+    # [NEW] slice_with_names đã materialise (slice_tables.py): bỏ join track/thread/process
+    if has_process_slice_table(tp):
+        sql = f"""
+        WITH LastAnimator AS (
+            SELECT ts
+            FROM process_slice_with_names
+            WHERE name = 'animator' AND pid = {launcher_pid}
+            ORDER BY ts DESC
+            LIMIT 1
+        )
+        SELECT s.ts, s.dur
+        FROM slice_with_names s
+        JOIN LastAnimator la ON 1=1
+        WHERE s.name LIKE '%DrawFrame%'
+          AND s.pid = {launcher_pid}
+          AND s.ts > la.ts
+        ORDER BY s.ts ASC
+        LIMIT 1;
+        """
+    else:
+        sql = f"""
+        WITH LastAnimator AS (
+            -- Bước 1: Lấy timestamp của slice 'animator' cuối cùng (Process Track)
+            SELECT s.ts
+            FROM slice s
+            JOIN process_track pt ON s.track_id = pt.id
+            JOIN process p ON pt.upid = p.upid
+            WHERE 
+                s.name = 'animator'
+                AND p.pid = {launcher_pid}
+            ORDER BY s.ts DESC
+            LIMIT 1
+        ),
+        TargetDrawFrame AS (
+            -- Bước 2: Tìm DrawFrame (Thread Track) xảy ra sau Animator
+            SELECT 
+                s.ts, 
+                s.dur
+            FROM slice s
+            JOIN thread_track tt ON s.track_id = tt.id
+            JOIN thread t ON tt.utid = t.utid
+            JOIN process p ON t.upid = p.upid
+            JOIN LastAnimator la ON 1=1 -- Cross join để lấy biến 'la.ts'
+            WHERE 
+                s.name LIKE '%DrawFrame%' 
+                AND p.pid = {launcher_pid}
+                AND s.ts > la.ts 
+            ORDER BY s.ts ASC 
+            LIMIT 1
+        )
+        SELECT * FROM TargetDrawFrame;
+        """
 
     df = query_df(tp, sql)
     if df is None:
@@ -395,6 +530,19 @@ def get_reaction_choreographer(tp: TraceProcessor, sysui_pid: int) -> Optional[T
     if not sysui_pid:
         return None
 
+    index = get_slice_index(tp)
+    if index is not None:
+        trigger = index.first(name_exact='addStartingWindow', pid=sysui_pid)
+        trigger_row = index.row(trigger) if trigger is not None else None
+        if trigger_row is None or trigger_row['tid'] is None:
+            return None
+        pos = index.first(name_like='Choreographer#doFrame%', tid=trigger_row['tid'],
+                          min_ts=trigger_row['ts'])
+        if pos is None:
+            return None
+        r = index.row(pos)
+        return r['ts'], r['dur'], r['end_ts']
+
     sql = f"""
     WITH TargetTrigger AS (
         -- Bước 1: Tìm addStartingWindow đầu tiên trong PID được cung cấp
@@ -429,9 +577,13 @@ def get_thread_state_summary(tp: TraceProcessor, app_tid: int,
     """
     Tổng thời gian các state (Running, R, S, D...) của một thread.
     Sử dụng SPAN_JOIN giữa intervals và thread_state.
+    [NEW] Trả lời từ ThreadStateTimeline (prefix sum) nếu tp đã có timeline cho tid.
     """
     if ts_dur <= 0:
         return {}
+    timeline = get_thread_state_timeline(tp)
+    if timeline is not None and timeline.covers(app_tid):
+        return timeline.summary(app_tid, ts_start, ts_dur)
 
     # 1. View state_view
     sql = f"""
@@ -542,7 +694,8 @@ def top_block_IO(tp: TraceProcessor, app_pid: int, start_time: int, end_time: in
         SELECT 
         lib.name,
         io.dur,
-        MIN(io.ts) AS first_io_ts
+        MIN(io.ts) AS first_io_ts,
+        lib.ts -- [NEW] ts của slice thư viện (lọc theo end_ts, xem WindowFamily)
         FROM lib_slices lib
         JOIN io_states io 
         ON lib.utid = io.utid 
@@ -586,7 +739,7 @@ def get_loadApkAsset(tp: TraceProcessor, app_pids: List[int], start_time: int, e
         return None
     pids_str = ','.join(map(str, app_pids))
     sql = f"""
-        SELECT slice.name, slice.dur
+        SELECT slice.name, slice.dur, slice.ts
         FROM slice 
         JOIN thread_track ON slice.track_id = thread_track.id 
         JOIN thread USING (utid) 
@@ -786,6 +939,22 @@ def get_slice_on_app_process(tp: TraceProcessor, app_pid: int, slice_names: list
     if not slice_names:
         return None
     values_clause = ", ".join([f"('{name}')" for name in slice_names])
+    if has_process_slice_table(tp):
+        # [NEW] slice_with_names / process_slice_with_names đã materialise (slice_tables.py)
+        sql = f"""
+        WITH TargetPatterns(pattern) AS (VALUES {values_clause})
+        SELECT s.name AS slice_name, s.ts, s.dur
+        FROM slice_with_names s
+        JOIN TargetPatterns tn ON s.name LIKE tn.pattern
+        WHERE s.pid = {app_pid}
+        UNION ALL
+        SELECT s.name AS slice_name, s.ts, s.dur
+        FROM process_slice_with_names s
+        JOIN TargetPatterns tn ON s.name LIKE tn.pattern
+        WHERE s.pid = {app_pid}
+        ORDER BY ts;
+        """
+        return query_df(tp, sql)
     sql = f"""
     WITH 
     TargetProcess AS (SELECT DISTINCT upid FROM process WHERE pid = {app_pid}),
@@ -879,16 +1048,8 @@ def process_abnormal_data(df) -> List[Dict[str, Any]]:
     return result
 
 
-def get_background_process_states(tp: TraceProcessor, start_ts: int, end_ts: int) -> List[Dict[str, Any]]:
-    """
-    Lấy danh sách các background process (theo pattern gms, google...) 
-    có hoạt động (Running + Runnable) > 10ms trong khoảng thời gian launch.
-    """
-    if not start_ts or not end_ts or start_ts >= end_ts:
-        return []
-
-    duration = end_ts - start_ts
-
+def get_background_main_threads(tp: TraceProcessor) -> Optional[pd.DataFrame]:
+    """Main thread (proc_name, tid) của các background process theo pattern (gms, google...)."""
     # Danh sách các pattern tên process cần tìm
     target_patterns = [
         '%gms.persistent%', 
@@ -911,7 +1072,18 @@ def get_background_process_states(tp: TraceProcessor, start_ts: int, end_ts: int
       AND ({or_clauses});
     """
     
-    df_procs = query_df(tp, sql_find_tid)
+    return query_df(tp, sql_find_tid)
+
+def get_background_process_states(tp: TraceProcessor, start_ts: int, end_ts: int) -> List[Dict[str, Any]]:
+    """
+    Lấy danh sách các background process (theo pattern gms, google...) 
+    có hoạt động (Running + Runnable) > 10ms trong khoảng thời gian launch.
+    """
+    if not start_ts or not end_ts or start_ts >= end_ts:
+        return []
+
+    duration = end_ts - start_ts
+    df_procs = get_background_main_threads(tp)
     
     if df_procs is None or df_procs.empty:
         return []
@@ -1011,6 +1183,71 @@ def get_background_process_states(tp: TraceProcessor, start_ts: int, end_ts: int
 
 #     return results
 
+# -------------------------------------------------------------------
+# 4.1 WINDOW FAMILY (các cửa sổ cùng start, khác end)
+# -------------------------------------------------------------------
+
+class WindowFamily:
+    """
+    Họ cửa sổ [start_ts, end) có chung start (vd. các end_ts variant): kết quả
+    lồng nhau nên mỗi query chỉ chạy MỘT lần trên cửa sổ rộng nhất (giữ cột ts
+    của từng row), kết quả của từng end được lọc lại bằng pandas.
+
+    Metric mới phụ thuộc end_ts: register(key, fetch, ts_column, end_inclusive)
+    với fetch(tp, start_ts, end_ts) -> DataFrame | None có cột ts_column, rồi
+    select(key, end_ts) thay cho việc gọi query với từng end_ts.
+    """
+
+    def __init__(self, tp: TraceProcessor, start_ts: int, end_times: Dict[str, int]):
+        self.tp = tp
+        self.start_ts = start_ts
+        ends = [e for e in end_times.values() if e]
+        self.max_end = max(ends) if ends else None
+        self._metrics: Dict[str, Tuple[Any, str, bool]] = {}
+        self._frames: Dict[str, Optional[pd.DataFrame]] = {}
+
+    def register(self, key: str, fetch, ts_column: str, end_inclusive: bool = True) -> None:
+        self._metrics[key] = (fetch, ts_column, end_inclusive)
+
+    def covers(self, key: str, end_ts: int) -> bool:
+        return key in self._metrics and bool(end_ts) and self.max_end is not None and end_ts <= self.max_end
+
+    def select(self, key: str, end_ts: int) -> Optional[pd.DataFrame]:
+        """Row của metric key trong [start_ts, end_ts) / [start_ts, end_ts]; None nếu rỗng (như query_df)."""
+        fetch, ts_column, end_inclusive = self._metrics[key]
+        if key not in self._frames:
+            self._frames[key] = fetch(self.tp, self.start_ts, self.max_end)
+        df = self._frames[key]
+        if df is None or df.empty:
+            return None
+        mask = df[ts_column] <= end_ts if end_inclusive else df[ts_column] < end_ts
+        selected = df[mask]
+        return selected.reset_index(drop=True) if not selected.empty else None
+
+
+def build_end_ts_window_family(tp: TraceProcessor, touch_down_ts: int, end_ts_variants: Dict[str, int],
+                               app_pid: int, app_tid: int) -> WindowFamily:
+    """WindowFamily cho các metric của _query_end_ts_dependent_data (trừ CPU / thread state)."""
+    start_ts = touch_down_ts if touch_down_ts else 0
+    family = WindowFamily(tp, start_ts, end_ts_variants)
+
+    def load_apk_pids(tp_):
+        pids = get_pid_list(tp_)
+        if not pids:
+            pids = [app_pid]
+        if app_pid not in pids:
+            pids.append(app_pid)
+        return pids
+
+    family.register('block_io', lambda tp_, start, end: top_block_IO(tp_, app_pid, start, end), 'ts')
+    family.register('load_apk', lambda tp_, start, end: get_loadApkAsset(tp_, load_apk_pids(tp_), touch_down_ts, end),
+                    'ts', end_inclusive=False)
+    family.register('abnormal', lambda tp_, start, end: get_abnormal_processes(tp_, start, end, app_pid, ['bindApplication']),
+                    'start_time')
+    family.register('binder', lambda tp_, start, end: get_binder_transaction_slices(tp_, app_tid, end),
+                    'ts', end_inclusive=False)
+    return family
+
 # -------------------------------------------------------------------
 # 5. MAIN ANALYSIS LOGIC
 # -------------------------------------------------------------------
@@ -1022,11 +1259,17 @@ def _query_end_ts_dependent_data(
     end_ts: int,
     app_pid: int,
     app_tid: int,
-    pid_mapping: Dict[int, str] = None
+    pid_mapping: Dict[int, str] = None,
+    cpu_frames: Optional[Tuple[Optional[pd.DataFrame], Optional[pd.DataFrame]]] = None,
+    windows: Optional[WindowFamily] = None
 ) -> Dict[str, Any]:
     """
     Query tất cả data phụ thuộc vào end_ts.
     Helper function được gọi cho mỗi end_ts type (activityIdle, animating, startPreviewRequest).
+    [NEW] cpu_frames: (proc_df, thread_df) đã tính sẵn cho cửa sổ này bởi
+    get_cpu_usage_windows (sched_cpu.py); None -> query SPAN_JOIN cũ.
+    [NEW] windows: WindowFamily của mọi variant -> Block I/O, LoadApkAssets, Binder,
+    Abnormal lọc từ kết quả query một lần trên cửa sổ rộng nhất.
     
     Returns:
         Dict containing: Thread State, Block I/O, CPU, Binder, Abnormal, Background data
@@ -1045,31 +1288,44 @@ def _query_end_ts_dependent_data(
     # [Block I/O]
     safe_start_time = touch_down_ts if touch_down_ts else 0
     safe_end_time = end_ts if end_ts else (safe_start_time + 10_000_000_000)
-    block_io_df = top_block_IO(tp, app_pid, safe_start_time, safe_end_time)
+    if windows is not None and windows.covers('block_io', safe_end_time):
+        block_io_df = windows.select('block_io', safe_end_time)
+    else:
+        block_io_df = top_block_IO(tp, app_pid, safe_start_time, safe_end_time)
     data["Block_IO_Data"] = process_block_io_data(block_io_df)
     
     # [LoadApkAssets]
-    load_apk_pids = get_pid_list(tp)
-    if not load_apk_pids:
-        load_apk_pids = [app_pid]
-    if app_pid not in load_apk_pids:
-        load_apk_pids.append(app_pid)
-    loadapk_df = get_loadApkAsset(tp, load_apk_pids, touch_down_ts, end_ts if end_ts else 0)
+    if windows is not None and windows.covers('load_apk', end_ts):
+        loadapk_df = windows.select('load_apk', end_ts)
+    else:
+        load_apk_pids = get_pid_list(tp)
+        if not load_apk_pids:
+            load_apk_pids = [app_pid]
+        if app_pid not in load_apk_pids:
+            load_apk_pids.append(app_pid)
+        loadapk_df = get_loadApkAsset(tp, load_apk_pids, touch_down_ts, end_ts if end_ts else 0)
     data["LoadApkAsset_Data"] = process_loadapk_data(loadapk_df)
     
     # [CPU Usage]
     cpu_cores = [0, 1, 2, 3, 4, 5, 6, 7]
     
+    if cpu_frames is not None:
+        cpu_proc_df, cpu_thread_df = cpu_frames
+    else:
+        cpu_proc_df = get_top_cpu_usage_process(tp, touch_down_ts, dur_time, cpu_cores)
+        cpu_thread_df = get_top_cpu_usage_thread(tp, touch_down_ts, dur_time, cpu_cores)
+
     # 1. Get Top Process
-    cpu_proc_df = get_top_cpu_usage_process(tp, touch_down_ts, dur_time, cpu_cores)
     data["CPU_Process_Data"] = process_cpu_data_process(cpu_proc_df, pid_mapping)
     
     # 2. Get Top Thread
-    cpu_thread_df = get_top_cpu_usage_thread(tp, touch_down_ts, dur_time, cpu_cores)
     data["CPU_Thread_Data"] = process_cpu_data_thread(cpu_thread_df)
     
     # [Binder]
-    binder_count, binder_dur = get_binder_transaction(tp, app_tid, end_ts if end_ts else 0)
+    if windows is not None and windows.covers('binder', end_ts):
+        binder_count, binder_dur = summarize_binder_transactions(windows.select('binder', end_ts))
+    else:
+        binder_count, binder_dur = get_binder_transaction(tp, app_tid, end_ts if end_ts else 0)
     data["Binder_Transaction_Data"] = {
         'count': binder_count if binder_count is not None else 0,
         'duration_ms': binder_dur if binder_dur is not None else 0.0
@@ -1079,7 +1335,10 @@ def _query_end_ts_dependent_data(
     abnormal_start = touch_down_ts if touch_down_ts else 0
     abnormal_end = end_ts if end_ts else 0
     target_abnormal_slices = ['bindApplication']
-    abnormal_df = get_abnormal_processes(tp, abnormal_start, abnormal_end, app_pid, target_abnormal_slices)
+    if windows is not None and windows.covers('abnormal', abnormal_end):
+        abnormal_df = windows.select('abnormal', abnormal_end)
+    else:
+        abnormal_df = get_abnormal_processes(tp, abnormal_start, abnormal_end, app_pid, target_abnormal_slices)
     data["Abnormal_Process_Data"] = process_abnormal_data(abnormal_df)
     
     # [Background Process States]
@@ -1113,6 +1372,8 @@ def analyze_trace(tp: TraceProcessor, trace_path: str, pid_mapping: Dict[int, st
     metrics: Dict[str, Any] = {}
 
     ensure_slice_with_names_view(tp)
+    # [NEW] Slice lookup của các helper chạy trên SliceIndex (một lần kéo dữ liệu)
+    ensure_slice_index(tp)
 
     # 1. Detect Recent Case & Launch Type
     file_name = Path(trace_path).stem.lower()
@@ -1407,6 +1668,15 @@ def analyze_trace(tp: TraceProcessor, trace_path: str, pid_mapping: Dict[int, st
     
     # 2. Query data cho MỖI end_ts type
     data_by_end_ts = {}
+    # [NEW] CPU usage của mọi variant trong một lần quét sched (sched_cpu.py)
+    cpu_by_end_ts = get_cpu_usage_windows(tp, touch_down_ts, end_ts_variants) or {}
+    # [NEW] thread_state của app main thread + background main thread nạp một lần,
+    # summary theo cửa sổ tính bằng prefix sum (thread_state_timeline.py)
+    background_threads = get_background_main_threads(tp)
+    timeline_tids = [app_tid] + (background_threads['tid'].tolist() if background_threads is not None else [])
+    ensure_thread_state_timeline(tp, timeline_tids)
+    # [NEW] Block I/O, LoadApkAssets, Binder, Abnormal: query một lần trên cửa sổ rộng nhất
+    windows = build_end_ts_window_family(tp, touch_down_ts, end_ts_variants, app_pid, app_tid)
     
     for end_ts_type, end_ts_value in end_ts_variants.items():
         if end_ts_value and end_ts_value > 0:
@@ -1416,7 +1686,9 @@ def analyze_trace(tp: TraceProcessor, trace_path: str, pid_mapping: Dict[int, st
                 end_ts=end_ts_value,
                 app_pid=app_pid,
                 app_tid=app_tid,
-                pid_mapping=pid_mapping
+                pid_mapping=pid_mapping,
+                cpu_frames=cpu_by_end_ts.get(end_ts_type),
+                windows=windows
             )
     
     metrics["data_by_end_ts"] = data_by_end_ts
@@ -1467,9 +1739,13 @@ def analyze_trace(tp: TraceProcessor, trace_path: str, pid_mapping: Dict[int, st
         
         cpu_cores = [0, 1, 2, 3, 4, 5, 6, 7]
         dur_time = (end_ts - touch_down_ts) if end_ts else 0
-        cpu_proc_df = get_top_cpu_usage_process(tp, touch_down_ts, dur_time, cpu_cores)
+        cpu_frames = (get_cpu_usage_windows(tp, touch_down_ts, {'primary': end_ts}, cpu_cores) or {}).get('primary')
+        if cpu_frames is not None:
+            cpu_proc_df, cpu_thread_df = cpu_frames
+        else:
+            cpu_proc_df = get_top_cpu_usage_process(tp, touch_down_ts, dur_time, cpu_cores)
+            cpu_thread_df = get_top_cpu_usage_thread(tp, touch_down_ts, dur_time, cpu_cores)
         metrics["CPU_Process_Data"] = process_cpu_data_process(cpu_proc_df, pid_mapping)
-        cpu_thread_df = get_top_cpu_usage_thread(tp, touch_down_ts, dur_time, cpu_cores)
         metrics["CPU_Thread_Data"] = process_cpu_data_thread(cpu_thread_df)
         
         binder_count, binder_dur = get_binder_transaction(tp, app_tid, end_ts if end_ts else 0)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+startup_stdlib.py
+
+Backend 'stdlib' cho analyze_trace: package, launch type, process app và
+launching end của launch lấy từ module stdlib android.startup.startups
+(C++/SQL native) thay vì tìm lại từ slice launching: / activityStart /
+bindApplication.
+
+Startup được gắn vào TraceProcessor (attribute stdlib_startup) trong lúc chạy
+analyze_trace; detect_app_from_launch, find_app_process, has_bind_application
+và get_launching_end của sql_query trả lời từ đó. Các mốc còn lại
+(activityResume, Choreographer, activityIdle, deliverInputEvent...) vẫn do
+SliceIndex trả lời, thread state / CPU do thread_state_timeline / sched_cpu.
+
+Trace không có startup trong stdlib (vd. Recent, trace thiếu launching:) hoặc
+shell không hỗ trợ module -> chạy analyze_trace như cũ.
+
+Parity mode chạy thêm analyze_trace với query cũ trên cùng trace và ghi lại
+các metric lệch để so sánh hai backend trước khi chuyển hẳn.
+
+Backend này chỉ để kiểm tra parity, không nhanh hơn: nó thêm INCLUDE module +
+STARTUP_SQL cho mỗi trace để thay 4 lookup mà SliceIndex đã trả lời trong bộ
+nhớ. Mặc định vẫn là 'queries'.
+"""
+
+import time
+from typing import Any, Dict, Optional
+
+from sql_query import analyze_trace, query_df, ensure_slice_with_names_view
+from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+STARTUP_BACKENDS = ('queries', 'stdlib')
+STDLIB_STARTUP_MODULES = ('android.startup.startups',)
+# Chênh lệch (ms) dưới mức này coi như khớp (làm tròn to_ms)
+PARITY_TOLERANCE_MS = 0.01
+# Metric không so sánh trong parity report (không phải kết quả phân tích)
+# (data_by_end_ts được so sánh đệ quy, xem compare_metrics)
+PARITY_IGNORED_KEYS = ('ingest_stats', 'startup_stats', 'PID_Mapping')
+
+# main_tid: main thread của process app (thread chạy activityStart), như
+# find_app_process của backend query; không có thread table thì dùng pid
+STARTUP_SQL = """
+SELECT s.startup_id, s.ts, s.ts_end, s.package, s.startup_type, p.upid, p.pid,
+       COALESCE(t.tid, p.pid) AS main_tid
+FROM android_startups s
+JOIN android_startup_processes sp USING (startup_id)
+JOIN process p ON p.upid = sp.upid
+LEFT JOIN thread t ON t.upid = p.upid AND t.is_main_thread = 1
+ORDER BY s.ts
+LIMIT 1;
+"""
+
+def include_stdlib_modules(tp, modules=STDLIB_STARTUP_MODULES) -> bool:
+    """INCLUDE các module stdlib; False nếu trace_processor_shell không có module."""
+    try:
+        for module in modules:
+            tp.query(f"INCLUDE PERFETTO MODULE {module};")
+        return True
+    except SHELL_CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[WARN] stdlib không khả dụng ({e}), dùng query cũ")
+        return False
+
+
+def query_startup(tp) -> Optional[Dict[str, Any]]:
+    """Startup đầu tiên (android_startups) + process app, None nếu không có."""
+    df = query_df(tp, STARTUP_SQL)
+    if df is None:
+        return None
+    row = df.iloc[0]
+    return {
+        'ts': int(row['ts']), 'ts_end': int(row['ts_end']),
+        'package': str(row['package']), 'startup_type': str(row['startup_type'] or ''),
+        'upid': int(row['upid']), 'pid': int(row['pid']), 'main_tid': int(row['main_tid']),
+    }
+
+
+def _values_match(legacy, stdlib) -> bool:
+    if isinstance(legacy, (int, float)) and isinstance(stdlib, (int, float)):
+        return abs(legacy - stdlib) <= PARITY_TOLERANCE_MS
+    return legacy == stdlib
+
+
+def _compare_values(path: str, legacy, stdlib, mismatches: Dict[str, Any]) -> int:
+    """So sánh đệ quy dict / list cùng độ dài; trả về số giá trị lá đã so sánh."""
+    if isinstance(legacy, dict) and isinstance(stdlib, dict):
+        compared = 0
+        for key in sorted(legacy.keys() | stdlib.keys(), key=str):
+            compared += _compare_values(f"{path}.{key}", legacy.get(key), stdlib.get(key), mismatches)
+        return compared
+    if isinstance(legacy, list) and isinstance(stdlib, list) and len(legacy) == len(stdlib):
+        return sum(_compare_values(f"{path}[{i}]", a, b, mismatches)
+                   for i, (a, b) in enumerate(zip(legacy, stdlib)))
+    if not _values_match(legacy, stdlib):
+        mismatches[path] = (legacy, stdlib)
+    return 1
+
+
+def compare_metrics(legacy: Dict[str, Any], stdlib: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    So sánh metrics của hai backend -> {'compared': n, 'mismatches': {path: (legacy, stdlib)}}.
+    Giá trị lồng nhau (data_by_end_ts) được so từng lá, path dạng
+    'data_by_end_ts.activityIdle.CPU_Process_Data[0].dur_ms'.
+    """
+    mismatches = {}
+    compared = 0
+    keys = [k for k in legacy.keys() | stdlib.keys() if k not in PARITY_IGNORED_KEYS]
+    for key in sorted(keys):
+        compared += _compare_values(key, legacy.get(key), stdlib.get(key), mismatches)
+    return {'compared': compared, 'mismatches': mismatches}
+
+
+def analyze_trace_stdlib(tp, trace_path: str, pid_mapping: Dict[int, str] = None,
+                         stats: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    analyze_trace với package / launch type / process app / launching end lấy từ
+    stdlib android.startup (xem module docstring).
+    stats (dict, optional) nhận stdlib_used / stdlib_startup_type.
+    """
+    stats = stats if stats is not None else {}
+    stats['stdlib_used'] = False
+    if not include_stdlib_modules(tp):
+        return analyze_trace(tp, trace_path, pid_mapping)
+    ensure_slice_with_names_view(tp)
+    startup = query_startup(tp)
+    if startup is None:
+        return analyze_trace(tp, trace_path, pid_mapping)
+
+    tp.stdlib_startup = startup
+    try:
+        metrics = analyze_trace(tp, trace_path, pid_mapping)
+    finally:
+        # Parity run (query cũ) trên cùng tp không được thấy startup này
+        tp.stdlib_startup = None
+    stats.update(stdlib_used=True, stdlib_startup_type=startup['startup_type'])
+    return metrics
+
+
+def analyze_trace_with_backend(tp, trace_path: str, pid_mapping: Dict[int, str] = None,
+                               backend: str = 'queries', parity: bool = False,
+                               stats: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Chạy analyze_trace theo backend ('queries' | 'stdlib').
+    parity=True (chỉ với 'stdlib'): chạy thêm backend 'queries' trên cùng trace,
+    kết quả so sánh ghi vào stats['stdlib_parity']. Metrics trả về là của backend đã chọn.
+    """
+    stats = stats if stats is not None else {}
+    if backend != 'stdlib':
+        return analyze_trace(tp, trace_path, pid_mapping)
+
+    start = time.perf_counter()
+    metrics = analyze_trace_stdlib(tp, trace_path, pid_mapping, stats)
+    stats['stdlib_analyse_s'] = time.perf_counter() - start
+    if parity:
+        start = time.perf_counter()
+        legacy = analyze_trace(tp, trace_path, pid_mapping)
+        stats['legacy_analyse_s'] = time.perf_counter() - start
+        stats['stdlib_parity'] = compare_metrics(legacy, metrics)
+    return metrics
+
+
+def format_stdlib_summary(stats_list) -> Optional[str]:
+    """Dòng báo cáo: số trace dùng stdlib và parity với query cũ."""
+    used = fallback = 0
+    parity_traces = parity_ok = 0
+    stdlib_s = legacy_s = 0.0
+    mismatch_counts: Dict[str, int] = {}
+    for stats in stats_list:
+        if 'stdlib_used' not in stats:
+            continue
+        if not stats['stdlib_used']:
+            fallback += 1
+            continue
+        used += 1
+        parity = stats.get('stdlib_parity')
+        if parity is None:
+            continue
+        parity_traces += 1
+        stdlib_s += stats.get('stdlib_analyse_s', 0.0)
+        legacy_s += stats.get('legacy_analyse_s', 0.0)
+        if not parity['mismatches']:
+            parity_ok += 1
+        for key in parity['mismatches']:
+            mismatch_counts[key] = mismatch_counts.get(key, 0) + 1
+    if not used and not fallback:
+        return None
+    line = f"[STDLIB] {used} traces via android.startup ({fallback} fallback to queries)"
+    if parity_traces:
+        mismatched = ", ".join(f"{k} ({n})" for k, n in
+                               sorted(mismatch_counts.items(), key=lambda kv: -kv[1])) or "none"
+        line += (f" | parity {parity_ok}/{parity_traces} traces match "
+                 f"(stdlib {stdlib_s:.1f}s vs queries {legacy_s:.1f}s), mismatched: {mismatched}")
+    return line
+
+
+def print_parity_details(trace_name: str, stats: Dict[str, Any]) -> None:
+    """In chi tiết metric lệch của một trace (parity mode)."""
+    parity = stats.get('stdlib_parity')
+    if not parity or not parity['mismatches']:
+        return
+    for key, (legacy, stdlib) in parity['mismatches'].items():
+        print(f"      [PARITY] {trace_name}: {key}: queries={legacy!r} stdlib={stdlib!r}")
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Fixture dùng chung: module ở thư mục gốc repo + trace_processor_shell giả."""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def fake_tp_bin(tmp_path, monkeypatch):
+    """Đường dẫn trace_processor_shell giả (fake_trace_processor.py); request ghi vào FAKE_TP_LOG."""
+    if os.name != 'posix':
+        pytest.skip("fake trace_processor_shell cần shebang (POSIX)")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_trace_processor.py')
+    bin_path = tmp_path / 'trace_processor'
+    bin_path.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    bin_path.chmod(0o755)
+    log_path = tmp_path / 'requests.log'
+    monkeypatch.setenv('FAKE_TP_LOG', str(log_path))
+    return str(bin_path)
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / 'scratch.trace'
+    path.write_bytes(b'# tracer: nop\n')
+    return str(path)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fake_trace_processor.py
+
+trace_processor_shell giả cho test: nói đúng HTTP RPC mà perfetto Python API
+dùng (/status, /parse, /notify_eof, /query) nhưng không phân tích trace.
+- Query chứa STALL_MARKER treo (giả lập query kẹt) cho tới khi bị kill.
+- Mọi query khác trả về kết quả rỗng.
+Mỗi request được ghi vào file log (biến môi trường FAKE_TP_LOG) để test kiểm
+tra trace được load theo path hay qua /parse.
+"""
+
+import os
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STALL_MARKER = b'fake_tp_stall'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _log(self, line):
+        path = os.environ.get('FAKE_TP_LOG')
+        if path:
+            with open(path, 'a') as f:
+                f.write(line + '\n')
+
+    def _reply(self, body=b''):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._log(f"GET {self.path}")
+        self._reply()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._log(f"POST {self.path}")
+        if self.path == '/query' and STALL_MARKER in body:
+            time.sleep(3600)
+        self._reply()
+
+
+def main(argv):
+    port = int(argv[argv.index('--http-port') + 1])
+    paths = [a for a in argv[1:] if not a.startswith('-') and a != str(port)]
+    for path in paths:
+        with open(os.environ.get('FAKE_TP_LOG', os.devnull), 'a') as f:
+            f.write(f"LOAD {path}\n")
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
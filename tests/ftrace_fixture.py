@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+atrace .log giả (ftrace text) cho test ingestion: header, sched_switch,
+tracing_mark_write B/E/S/F và event khác, ghi ra .log thường (zlib hoặc text)
+hoặc dạng nén .log.gz / .log.zst / .log.zip.
+"""
+
+import gzip
+import zipfile
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+HEADER = (
+    b'# tracer: nop\n'
+    b'#\n'
+    b'# entries-in-buffer/entries-written: 0/0   #P:4\n'
+    b'#\n'
+    b'#           TASK-PID    TGID   CPU#  ||||    TIMESTAMP  FUNCTION\n'
+    b'#              | |        |      |   ||||       |         |\n'
+)
+CAPTURE_PREFIX = b'capturing trace... done\nTRACE:\n'
+
+
+class FtraceBuilder:
+    """Dòng ftrace theo ts (µs); text() sắp lại theo ts như atrace xuất ra."""
+
+    def __init__(self):
+        self.lines = []
+
+    def event(self, ts_us, comm, pid, tgid, cpu, name, args):
+        sec, usec = divmod(int(ts_us), 1_000_000)
+        line = (f'{comm:>16}-{pid:<5} ({tgid:>5}) [{cpu:03d}] ...1 '
+                f'{sec:5d}.{usec:06d}: {name}: {args}\n').encode()
+        self.lines.append((ts_us, len(self.lines), line))
+
+    def mark(self, ts_us, comm, pid, tgid, cpu, payload):
+        self.event(ts_us, comm, pid, tgid, cpu, 'tracing_mark_write', payload)
+
+    def slice(self, start_us, dur_us, comm, pid, tgid, cpu, name):
+        self.mark(start_us, comm, pid, tgid, cpu, f'B|{tgid}|{name}')
+        self.mark(start_us + dur_us, comm, pid, tgid, cpu, f'E|{tgid}')
+
+    def sched_switch(self, ts_us, cpu, prev, prev_state, next_):
+        (prev_comm, prev_pid), (next_comm, next_pid) = prev, next_
+        self.event(ts_us, prev_comm, prev_pid, prev_pid, cpu, 'sched_switch',
+                   f'prev_comm={prev_comm} prev_pid={prev_pid} prev_prio=120 prev_state={prev_state} '
+                   f'==> next_comm={next_comm} next_pid={next_pid} next_prio=120')
+
+    def raw(self, ts_us, line):
+        self.lines.append((ts_us, len(self.lines), line))
+
+    def text(self, header=HEADER):
+        return header + b''.join(line for _, _, line in sorted(self.lines))
+
+
+IDLE = ('swapper/0', 0)
+LAUNCHER = ('id.app.launcher', 2000)
+SYSTEM_SERVER = ('system_server', 1000)
+APP = ('com.example.app', 3000)
+APP_PKG = 'com.example.app'
+
+
+def launch_trace(base_us=1_000_000_000, noise_events=200):
+    """
+    Cold launch của com.example.app (ts theo µs từ base_us): input trên launcher,
+    launching / startProcess / activityIdle trong system_server, mốc của app,
+    sched_switch trên 4 CPU và event ngoài allow-list (irq, cpu_frequency).
+    """
+    b = FtraceBuilder()
+    at = lambda ms: base_us + int(ms * 1000)  # noqa: E731
+    # Trước launch: thread chạy rồi ngủ, một B mở vắt qua đầu window
+    for cpu in range(4):
+        b.sched_switch(at(-900 + cpu), cpu, IDLE, 'R', SYSTEM_SERVER)
+        b.sched_switch(at(-800 + cpu), cpu, SYSTEM_SERVER, 'S', IDLE)
+    b.mark(at(-700), *LAUNCHER, LAUNCHER[1], 0, f'B|{LAUNCHER[1]}|Launcher#longSlice')
+    b.slice(at(-650), 2000, *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, 'earlySlice')
+    b.mark(at(-600), *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, f'S|{SYSTEM_SERVER[1]}|asyncOpen|7')
+
+    b.slice(at(0), 5000, *LAUNCHER, LAUNCHER[1], 0, 'deliverInputEvent src=0x1002')
+    b.slice(at(50), 2000, *LAUNCHER, LAUNCHER[1], 0, 'dispatchInputEvent MotionEvent ACTION_UP')
+    b.mark(at(60), *LAUNCHER, LAUNCHER[1], 0, f'E|{LAUNCHER[1]}')
+    b.mark(at(55), *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, f'S|{SYSTEM_SERVER[1]}|launching: {APP_PKG}|0')
+    b.slice(at(60), 10_000, *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, f'startProcess: {APP_PKG}')
+    b.slice(at(80), 20_000, *APP, APP[1], 2, 'ActivityThreadMain')
+    b.slice(at(100), 100_000, *APP, APP[1], 2, 'bindApplication')
+    b.slice(at(210), 50_000, *APP, APP[1], 2, 'activityStart')
+    b.slice(at(260), 20_000, *APP, APP[1], 2, 'activityResume')
+    b.slice(at(290), 30_000, *APP, APP[1], 2, 'Choreographer#doFrame 11')
+    b.mark(at(655), *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, f'F|{SYSTEM_SERVER[1]}|launching: {APP_PKG}|0')
+    b.mark(at(660), *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, f'F|{SYSTEM_SERVER[1]}|asyncOpen|7')
+    b.slice(at(700), 5000, *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, 'activityIdle')
+
+    # Scheduling của app / system_server quanh launch
+    for i, start in enumerate(range(70, 700, 20)):
+        cpu = i % 4
+        b.sched_switch(at(start), cpu, IDLE, 'R', APP)
+        b.sched_switch(at(start + 12), cpu, APP, 'S' if i % 3 else 'D', IDLE)
+        b.sched_switch(at(start + 13), cpu, IDLE, 'R', SYSTEM_SERVER)
+        b.sched_switch(at(start + 16), cpu, SYSTEM_SERVER, 'R+', IDLE)
+
+    # Event ngoài allow-list
+    for i in range(noise_events):
+        ms = -950 + i * 2400 / noise_events
+        b.event(at(ms), 'kworker/0:1', 40, 40, i % 4, 'irq_handler_entry', 'irq=5 name=arch_timer')
+        b.event(at(ms + 0.5), '<idle>', 0, 0, i % 4, 'cpu_frequency', f'state=1800000 cpu_id={i % 4}')
+    # Sau window
+    b.slice(at(1600), 1000, *SYSTEM_SERVER, SYSTEM_SERVER[1], 1, 'lateSlice')
+    return b
+
+
+def encode_log(text, compress=True):
+    """Nội dung file atrace .log: phần capture + 'TRACE:' + payload (zlib hoặc text)."""
+    return CAPTURE_PREFIX + (zlib.compress(text) if compress else text)
+
+
+def write_trace(path, text, compress=True):
+    """Ghi trace theo đuôi của path (.log / .log.gz / .log.zst / .log.zip)."""
+    data = encode_log(text, compress)
+    name = str(path)
+    if name.endswith('.log.gz'):
+        data = gzip.compress(data)
+    elif name.endswith('.log.zst'):
+        data = zstandard.ZstdCompressor().compress(data)
+    elif name.endswith('.log.zip'):
+        with zipfile.ZipFile(name, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('trace.log', data)
+        return str(path)
+    with open(name, 'wb') as f:
+        f.write(data)
+    return str(path)
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+TraceProcessor giả chạy trên SQLite in-memory + trace launch nhỏ dựng bằng tay.
+
+SqliteTraceProcessor nhận đúng SQL mà sql_query / stdlib gửi:
+- nhiều statement trong một query (kết quả là của statement cuối);
+- INCLUDE PERFETTO MODULE: bỏ qua (bảng stdlib được dựng sẵn trong fixture);
+- CREATE VIRTUAL TABLE x USING SPAN_JOIN(a, b): view giao khoảng [ts, ts + dur)
+  dương của hai bên (không partition), đủ cho các cửa sổ một interval của sql_query.
+
+build_launch_trace() dựng một cold launch của com.example.app: input trên
+launcher, startProcess / launching / activityIdle trong system_server, các mốc
+app process, animating (process track), sched_slice và thread_state; SystemUI
+(addStartingWindow, Choreographer), AIDL startAnimation và animator / DrawFrame
+của launcher cho reaction.
+
+load_ftrace(text) dựng cùng các bảng từ ftrace text (slice B/E), để test cả
+đường ingest .log -> payload -> phân tích mà không cần trace_processor_shell.
+"""
+
+import re
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+APP_PKG = 'com.example.app'
+APP_PID = 3000
+MS = 1_000_000
+BASE_TS = 1_000 * MS
+
+SCHEMA = """
+CREATE TABLE process (upid INTEGER PRIMARY KEY, pid INTEGER, name TEXT);
+CREATE TABLE thread (utid INTEGER PRIMARY KEY, tid INTEGER, name TEXT, upid INTEGER,
+                     is_main_thread INTEGER);
+CREATE TABLE thread_track (id INTEGER PRIMARY KEY, utid INTEGER, name TEXT);
+CREATE TABLE process_track (id INTEGER PRIMARY KEY, upid INTEGER, name TEXT);
+CREATE TABLE slice (id INTEGER PRIMARY KEY, ts INTEGER, dur INTEGER, name TEXT,
+                    track_id INTEGER, depth INTEGER DEFAULT 0);
+CREATE TABLE sched_slice (id INTEGER PRIMARY KEY, ts INTEGER, dur INTEGER, cpu INTEGER,
+                          utid INTEGER);
+CREATE TABLE thread_state (id INTEGER PRIMARY KEY, ts INTEGER, dur INTEGER, utid INTEGER,
+                           state TEXT);
+CREATE TABLE android_startups (startup_id INTEGER PRIMARY KEY, ts INTEGER, ts_end INTEGER,
+                               dur INTEGER, package TEXT, startup_type TEXT);
+CREATE TABLE android_startup_processes (startup_id INTEGER, upid INTEGER, pid INTEGER);
+"""
+
+SPAN_JOIN_RE = re.compile(
+    r'CREATE\s+VIRTUAL\s+TABLE\s+(\w+)\s+USING\s+span_join\s*\(\s*(\w+)\s*,\s*(\w+)\s*\)',
+    re.IGNORECASE)
+DROP_TABLE_RE = re.compile(r'DROP\s+TABLE\s+IF\s+EXISTS\s+(\w+)', re.IGNORECASE)
+INCLUDE_RE = re.compile(r'^\s*INCLUDE\s+PERFETTO\s+MODULE\b', re.IGNORECASE)
+
+
+class _Result:
+    def __init__(self, df: pd.DataFrame):
+        self._df = df
+
+    def __len__(self):
+        return len(self._df)
+
+    def as_pandas_dataframe(self) -> pd.DataFrame:
+        return self._df.copy()
+
+
+def split_statements(sql: str):
+    """Tách chuỗi SQL thành từng statement hoàn chỉnh."""
+    statements, buffer = [], ''
+    for part in sql.split(';'):
+        buffer += part + ';'
+        if sqlite3.complete_statement(buffer):
+            if buffer.strip(' \t\r\n;'):
+                statements.append(buffer.strip())
+            buffer = ''
+    if buffer.strip(' \t\r\n;'):
+        statements.append(buffer.strip())
+    return statements
+
+
+class SqliteTraceProcessor:
+    """query(sql) trên SQLite với cùng interface kết quả (len, as_pandas_dataframe)."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        self.sqls = []
+        self._span_views = set()
+
+    def _columns(self, name: str):
+        return [row[1] for row in self.db.execute(f"PRAGMA table_info({name})")]
+
+    def _span_join(self, name: str, left: str, right: str) -> str:
+        others = [f"a.{c}" for c in self._columns(left) if c not in ('ts', 'dur')]
+        others += [f"b.{c}" for c in self._columns(right) if c not in ('ts', 'dur')]
+        self._span_views.add(name)
+        return (f"CREATE VIEW {name} AS SELECT MAX(a.ts, b.ts) AS ts, "
+                f"MIN(a.ts + a.dur, b.ts + b.dur) - MAX(a.ts, b.ts) AS dur"
+                + ''.join(f", {c}" for c in others)
+                + f" FROM {left} a JOIN {right} b"
+                f" ON MIN(a.ts + a.dur, b.ts + b.dur) > MAX(a.ts, b.ts)")
+
+    def _translate(self, statement: str):
+        if INCLUDE_RE.match(statement):
+            return None
+        match = SPAN_JOIN_RE.search(statement)
+        if match:
+            return self._span_join(*match.groups())
+        match = DROP_TABLE_RE.search(statement)
+        if match and match.group(1) in self._span_views:
+            self._span_views.discard(match.group(1))
+            return f"DROP VIEW IF EXISTS {match.group(1)}"
+        return statement
+
+    def query(self, sql: str):
+        self.sqls.append(sql)
+        df = pd.DataFrame()
+        for statement in split_statements(sql):
+            statement = self._translate(statement)
+            if statement is None:
+                continue
+            cursor = self.db.execute(statement)
+            if cursor.description is not None:
+                # Giống perfetto as_pandas_dataframe: mảng object 2 chiều, NULL -> None
+                columns = [d[0] for d in cursor.description]
+                cells = np.array(cursor.fetchall(), dtype=object).reshape((-1, len(columns)))
+                df = pd.DataFrame(cells, columns=columns)
+        return _Result(df)
+
+
+class _TraceBuilder:
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.executescript(SCHEMA)
+        self.utid_by_tid = {}
+        self.track_by_tid = {}
+
+    def process(self, upid, pid, name, threads):
+        """threads: [(tid, tên)], thread đầu tiên là main thread."""
+        self.db.execute("INSERT INTO process VALUES (?, ?, ?)", (upid, pid, name))
+        for i, (tid, thread_name) in enumerate(threads):
+            utid = len(self.utid_by_tid) + 1
+            self.utid_by_tid[tid] = utid
+            self.track_by_tid[tid] = utid
+            self.db.execute("INSERT INTO thread VALUES (?, ?, ?, ?, ?)",
+                            (utid, tid, thread_name, upid, 1 if i == 0 else 0))
+            self.db.execute("INSERT INTO thread_track VALUES (?, ?, NULL)", (utid, utid))
+
+    def slice(self, tid, start_ms, dur_ms, name):
+        self.db.execute("INSERT INTO slice (ts, dur, name, track_id) VALUES (?, ?, ?, ?)",
+                        (BASE_TS + int(start_ms * MS), dur_ms * MS, name, self.track_by_tid[tid]))
+
+    def sched(self, tid, cpu, start_ms, dur_ms):
+        self.db.execute("INSERT INTO sched_slice (ts, dur, cpu, utid) VALUES (?, ?, ?, ?)",
+                        (BASE_TS + start_ms * MS, dur_ms * MS, cpu, self.utid_by_tid[tid]))
+
+    def states(self, tid, start_ms, pattern):
+        """pattern: [(state, dur_ms)] liên tiếp từ start_ms."""
+        ts = BASE_TS + start_ms * MS
+        for state, dur_ms in pattern:
+            self.db.execute("INSERT INTO thread_state (ts, dur, utid, state) VALUES (?, ?, ?, ?)",
+                            (ts, dur_ms * MS, self.utid_by_tid[tid], state))
+            ts += dur_ms * MS
+
+
+FTRACE_LINE_RE = re.compile(
+    rb'^\s*(.+?)-(\d+)\s+\(\s*(\d+)\)\s+\[\d+\]\s+\S+\s+(\d+)\.(\d+): tracing_mark_write: ([BE])\|(\d+)(?:\|(.*))?$')
+
+
+def load_ftrace(text: bytes) -> sqlite3.Connection:
+    """
+    Dựng bảng trace từ ftrace text như trace_processor (chỉ slice B/E của
+    tracing_mark_write trên thread track). Process = tgid, tên lấy theo comm của
+    main thread (tid == tgid).
+    """
+    b = _TraceBuilder()
+    threads, marks = {}, []
+    for line in text.splitlines():
+        m = FTRACE_LINE_RE.match(line)
+        if not m:
+            continue
+        comm, tid, tgid, sec, usec, kind, _, name = m.groups()
+        tid, tgid = int(tid), int(tgid)
+        threads.setdefault(tgid, {})[tid] = comm.strip().decode()
+        marks.append((int(sec) * 1_000_000_000 + int(usec) * 1000, tid, kind, name))
+    for upid, (pid, members) in enumerate(sorted(threads.items()), start=1):
+        order = sorted(members, key=lambda t: t != pid)
+        b.process(upid, pid, members.get(pid), [(t, members[t]) for t in order])
+    stacks = {}
+    for ts, tid, kind, name in sorted(marks, key=lambda m: m[0]):
+        if kind == b'B':
+            stacks.setdefault(tid, []).append((ts, name.decode()))
+        elif stacks.get(tid):
+            start, slice_name = stacks[tid].pop()
+            b.db.execute("INSERT INTO slice (ts, dur, name, track_id) VALUES (?, ?, ?, ?)",
+                         (start, ts - start, slice_name, b.track_by_tid[tid]))
+    b.db.commit()
+    return b.db
+
+
+def build_launch_trace() -> sqlite3.Connection:
+    """Cold launch của APP_PKG (mốc theo ms kể từ BASE_TS, xem module docstring)."""
+    b = _TraceBuilder()
+    b.process(1, 0, None, [(0, 'swapper/0')])
+    b.process(2, 1000, 'system_server', [(1000, 'system_server'), (1001, 'ActivityManager'),
+                                         (1002, 'android.anim')])
+    b.process(3, 2000, 'com.sec.android.app.launcher', [(2000, 'id.app.launcher')])
+    b.process(4, APP_PID, APP_PKG, [(APP_PID, APP_PKG), (3001, 'RenderThread')])
+    b.process(5, 4000, 'com.google.android.gms.persistent', [(4000, 'gms.persistent')])
+    b.process(6, 500, '/system/bin/surfaceflinger', [(500, 'surfaceflinger')])
+    b.process(7, 6000, 'com.other.service', [(6000, 'com.other.service')])
+    b.process(8, 7000, 'com.android.systemui', [(7000, 'com.android.systemui'), (7001, 'SysUiBg')])
+
+    # Input trên launcher
+    b.slice(2000, 0, 5, 'deliverInputEvent src=0x1002 eventTimeNano=1')
+    b.slice(2000, 50, 2, 'dispatchInputEvent MotionEvent ACTION_UP')
+    # system_server
+    b.slice(1001, 55, 600, f'launching: {APP_PKG}')
+    b.slice(1001, 60, 10, f'startProcess: {APP_PKG}')
+    b.slice(1000, 700, 5, 'activityIdle')
+    # App process
+    b.slice(APP_PID, 80, 20, 'ActivityThreadMain')
+    b.slice(APP_PID, 100, 100, 'bindApplication')
+    # D của main thread bắt đầu ở 115 ms -> 0.1 ms sau slice thư viện
+    b.slice(APP_PID, 114.9, 5, '1 , /system/lib64/libfoo.so')
+    b.slice(APP_PID, 134.95, 2, '1 , /system/lib64/libbar.so')
+    b.slice(APP_PID, 154.9, 2, '0 , /data/app/oat/base.odex')
+    b.slice(APP_PID, 130, 60, 'LoadApkAssets(/data/app/base.apk)')
+    for start in (150, 170, 240, 600):
+        b.slice(APP_PID, start, 8, 'binder transaction')
+    b.slice(APP_PID, 205, 3, 'Choreographer#doFrame 10')
+    b.slice(APP_PID, 210, 50, 'activityStart')
+    b.slice(APP_PID, 260, 20, 'activityResume')
+    b.slice(APP_PID, 290, 30, 'Choreographer#doFrame 11')
+    b.slice(3001, 292, 20, 'DrawFrames 11')
+    # Process khác khởi chạy trong cửa sổ launch
+    b.slice(6000, 400, 30, 'bindApplication')
+    b.slice(4000, 680, 10, 'bindApplication')
+    b.slice(1000, 500, 70, 'LoadApkAssets(/system/framework/framework-res.apk)')
+    # animating trên process track của system_server
+    b.db.execute("INSERT INTO process_track VALUES (100, 2, 'animating')")
+    b.db.execute("INSERT INTO slice (ts, dur, name, track_id) VALUES (?, ?, 'animating', 100)",
+                 (BASE_TS + 300 * MS, 350 * MS))
+
+    # Reaction: slice đầu tiên theo id không phải slice sớm nhất theo ts
+    b.slice(7000, 58, 2, 'addStartingWindow')
+    b.slice(1001, 56, 1, 'addStartingWindow')
+    b.slice(7000, 57, 1, 'Choreographer#doFrame 1')  # trước addStartingWindow
+    b.slice(7001, 59, 1, 'Choreographer#doFrame 2')  # thread khác
+    b.slice(7000, 62, 4, 'Choreographer#doFrame 3')
+    b.slice(1002, 70, 6, 'AIDL::java::IRemoteTransition::startAnimation::server')
+    b.slice(1001, 64, 3, 'AIDL::java::IRemoteTransition::startAnimation::server')
+    # animator (process track) + DrawFrame của launcher
+    b.db.execute("INSERT INTO process_track VALUES (101, 3, 'animator')")
+    for start in (66, 80):
+        b.db.execute("INSERT INTO slice (ts, dur, name, track_id) VALUES (?, ?, 'animator', 101)",
+                     (BASE_TS + start * MS, 5 * MS))
+    b.slice(2000, 78, 3, 'DrawFrames 5')
+    b.slice(2000, 90, 3, 'DrawFrames 6')
+
+    # sched: app main / RenderThread / gms / system_server / swapper
+    for i, start in enumerate(range(80, 700, 20)):
+        b.sched(APP_PID, i % 8, start, 12)
+        b.sched(3001, (i + 1) % 8, start + 5, 4)
+        b.sched(4000, (i + 2) % 8, start + 2, 9)
+        b.sched(1001, (i + 3) % 4, start + 8, 3)
+        b.sched(0, (i + 4) % 8, start, 20)
+    b.sched(APP_PID, 9, 100, 50)  # CPU ngoài danh sách cores
+
+    b.states(APP_PID, 70, [('S', 10)] + [('Running', 12), ('R', 3), ('D', 3), ('S', 2)] * 31)
+    b.states(4000, 0, [('Running', 9), ('S', 6), ('R', 5)] * 40)
+
+    # Bảng stdlib android.startup.startups
+    b.db.execute("INSERT INTO android_startups VALUES (1, ?, ?, ?, ?, 'cold')",
+                 (BASE_TS + 55 * MS, BASE_TS + 655 * MS, 600 * MS, APP_PKG))
+    b.db.execute("INSERT INTO android_startup_processes VALUES (1, 4, ?)", (APP_PID,))
+    b.db.commit()
+    return b.db
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Ingestion atrace: giải nén streaming, input nén, crop / filter in-place và export HTML."""
+
+import os
+import re
+import zipfile
+import zlib
+
+import pytest
+
+import atracetosystrace
+from atracetosystrace import (
+    COMPRESSED_TRACE_SUFFIXES, DEFAULT_EVENT_ALLOWLIST, PRESCAN_CORRUPT_PAYLOAD, convert_trace,
+    crop_launch_window, export_html, filter_ftrace_events, is_trace_file, load_trace_data,
+    prescan_trace, trace_stem,
+)
+from ftrace_fixture import CAPTURE_PREFIX, HEADER, encode_log, launch_trace, write_trace
+
+MS_NS = 1_000_000
+BASE_NS = 1_000 * 1_000_000_000
+
+
+@pytest.fixture
+def text():
+    return launch_trace(noise_events=2000).text()
+
+
+def test_streaming_decode_matches_text(tmp_path, text):
+    path = write_trace(tmp_path / 'a.log', text)
+    assert bytes(load_trace_data(path)) == text
+
+
+def test_truncated_zlib_payload_raises(tmp_path, text):
+    payload = zlib.compress(text)
+    assert len(payload) > 10_000
+    path = tmp_path / 'truncated.log'
+    path.write_bytes(CAPTURE_PREFIX + payload[:len(payload) // 2])
+
+    with pytest.raises(zlib.error, match='truncated'):
+        load_trace_data(str(path))
+    assert prescan_trace(str(path), {b'not-in-trace': 'missing'}) == PRESCAN_CORRUPT_PAYLOAD
+
+
+def _event_lines(data):
+    return [line for line in bytes(data).split(b'\n') if line and not line.startswith(b'#')]
+
+
+def _ts_ns(line):
+    sec, frac = line.split(b': ', 1)[0].rsplit(b' ', 1)[1].split(b'.')
+    return int(sec) * 1_000_000_000 + int(frac) * 1000
+
+
+def test_crop_launch_window(text):
+    data = bytearray(text)
+    stats = {}
+    cropped = crop_launch_window(data, 100 * MS_NS, 200 * MS_NS, stats=stats)
+
+    assert cropped is data
+    start, end = BASE_NS - 100 * MS_NS, BASE_NS + 700 * MS_NS + 200 * MS_NS
+    assert stats['crop_window_ns'] == (start, end)
+    assert cropped.startswith(HEADER)
+
+    lines = _event_lines(cropped)
+    seeds = [line for line in lines if _ts_ns(line) < start]
+    kept = [line for line in lines if _ts_ns(line) >= start]
+    # Mọi dòng trong window được giữ, theo thứ tự gốc; không dòng nào sau window
+    assert kept == [line for line in _event_lines(text) if start <= _ts_ns(line) < end]
+    assert stats['crop_seed_lines'] == len(seeds)
+    assert stats['crop_bytes_removed'] == len(text) - len(cropped)
+
+    # Seed: sched_switch cuối của mỗi CPU + B / async S còn mở ở đầu window
+    switches = [line for line in seeds if b' sched_switch: ' in line]
+    assert len(switches) == 4
+    assert all(b'prev_state=S ==> next_comm=swapper/0' in line for line in switches)
+    marks = [line.split(b'tracing_mark_write: ')[1] for line in seeds if b'tracing_mark_write' in line]
+    assert marks == [b'B|2000|Launcher#longSlice', b'S|1000|asyncOpen|7']
+
+
+def test_crop_without_anchor_keeps_trace():
+    text = launch_trace().text().replace(b'deliverInputEvent', b'otherInputEvent')
+    data = bytearray(text)
+    assert crop_launch_window(data, MS_NS, MS_NS) == text
+
+
+@pytest.mark.parametrize('block_size', [atracetosystrace.FILTER_BLOCK_SIZE, 257])
+def test_filter_ftrace_events(monkeypatch, text, block_size):
+    monkeypatch.setattr(atracetosystrace, 'FILTER_BLOCK_SIZE', block_size)
+    data = bytearray(text)
+    stats = {}
+    filtered = filter_ftrace_events(data, DEFAULT_EVENT_ALLOWLIST, stats=stats)
+
+    assert filtered is data
+    assert filtered.startswith(HEADER)
+    expected = [line for line in _event_lines(text)
+                if line.split(b': ', 2)[1].decode() in DEFAULT_EVENT_ALLOWLIST]
+    assert _event_lines(filtered) == expected
+    assert stats['filter_events_removed'] == len(_event_lines(text)) - len(expected) == 4000
+    assert stats['filter_bytes_removed'] == len(text) - len(filtered)
+    assert filtered.endswith(b'\n')
+
+
+def test_load_trace_data_crops_then_filters(tmp_path, text):
+    path = write_trace(tmp_path / 'a.log', text)
+    stats = {}
+    data = load_trace_data(path, crop_window=(100 * MS_NS, 200 * MS_NS),
+                           event_allowlist=DEFAULT_EVENT_ALLOWLIST, stats=stats)
+    expected = filter_ftrace_events(crop_launch_window(bytearray(text), 100 * MS_NS, 200 * MS_NS),
+                                    DEFAULT_EVENT_ALLOWLIST)
+    assert data == expected
+    assert stats['crop_seed_lines'] == 6 and stats['filter_events_removed'] > 0
+
+
+@pytest.mark.parametrize('suffix', COMPRESSED_TRACE_SUFFIXES)
+@pytest.mark.parametrize('zlib_payload', [True, False])
+def test_compressed_inputs_match_plain_log(tmp_path, text, suffix, zlib_payload):
+    if suffix == '.log.zst':
+        pytest.importorskip('zstandard')
+    plain = write_trace(tmp_path / 'a_camera.log', text, compress=zlib_payload)
+    packed = write_trace(tmp_path / f'a_camera{suffix}', text, compress=zlib_payload)
+
+    assert is_trace_file(packed) and trace_stem(packed) == trace_stem(plain) == 'a_camera'
+    assert load_trace_data(packed) == load_trace_data(plain)
+    assert prescan_trace(packed, {b'deliverInputEvent': 'no_input'}) is None
+    assert prescan_trace(packed, {b'not-in-trace': 'missing'}) == 'missing'
+
+
+def test_zip_without_log_member_uses_first_entry(tmp_path, text):
+    path = tmp_path / 'b.log.zip'
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('trace.txt', encode_log(text))
+    assert bytes(load_trace_data(str(path))) == text
+
+
+def test_truncated_gz_is_corrupt_payload(tmp_path, text):
+    path = write_trace(tmp_path / 'c.log.gz', text)
+    data = open(path, 'rb').read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    assert prescan_trace(path, {b'not-in-trace': 'missing'}) == PRESCAN_CORRUPT_PAYLOAD
+
+
+def _baseline_html(raw):
+    """
+    HTML của convert_trace trước khi chuyển sang streaming (đọc cả file vào str
+    latin-1). Bản cũ chỉ chạy với payload zlib (payload text lỗi ở .decode).
+    """
+    data = raw.split(b'\nTRACE:', 1)[1].decode('latin-1')
+    if data.startswith('\r\n'):
+        data = data.replace('\r\n', '\n')
+    elif data.startswith('\r\r\n'):
+        data = data.replace('\r\r\n', '\n')
+    data = data[1:]
+    data = zlib.decompress(data.encode('latin-1')).decode('latin-1').replace('\r', '')
+    data = re.sub(r'tracing_mark_write\.llvm\.\d+:', 'tracing_mark_write:', data).lstrip('\n')
+    starts = [m.start() for m in re.finditer(r'^#+ CPU \d+ buffer started', data, re.MULTILINE)]
+    if starts and starts[-1] > 0:
+        end_of_header = re.search(r'^[^#]', data, re.MULTILINE).start()
+        data = data[:end_of_header] + data[starts[-1]:]
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assets = {}
+    for name in ('prefix.html', 'suffix.html', 'systrace_trace_viewer.html'):
+        with open(os.path.join(root, name), encoding='latin-1') as f:
+            assets[name] = f.read()
+    prefix = assets['prefix.html'].replace('{{SYSTRACE_TRACE_VIEWER_HTML}}',
+                                           assets['systrace_trace_viewer.html'])
+    return (prefix.encode('latin-1') + b'<!-- BEGIN TRACE -->\n  <script class="trace-data" '
+            b'type="application/text">\n' + data.encode('utf-8') + b'  </script>\n<!-- END TRACE -->\n'
+            + assets['suffix.html'].encode('utf-8'))
+
+
+def _capture(text, crlf):
+    payload = zlib.compress(text)
+    if crlf:
+        return CAPTURE_PREFIX[:-1] + b'\r\n' + payload.replace(b'\n', b'\r\n')
+    return CAPTURE_PREFIX + payload
+
+
+@pytest.mark.parametrize('crlf', [True, False])
+def test_export_html_matches_baseline(tmp_path, crlf):
+    builder = launch_trace()
+    # Circular buffer (phần trước marker cuối bị bỏ), tên thread không phải ASCII, suffix .llvm
+    builder.raw(999_000_000, b'##### CPU 2 buffer started ####\n')
+    builder.mark(999_500_000, 'caf\xe9-thread', 3100, 3000, 2, 'B|3000|na\xefve')
+    builder.raw(999_600_000, b'   com.example.app-3000  ( 3000) [002] ...1   999.600000: '
+                             b'tracing_mark_write.llvm.1234: E|3000\n')
+    text = builder.text()
+    raw = _capture(text, crlf)
+    path = tmp_path / 'trace.log'
+    path.write_bytes(raw)
+
+    out = export_html(str(path), str(tmp_path / 'trace.html'))
+
+    assert open(out, 'rb').read() == _baseline_html(raw)
+    assert convert_trace(str(path)).getvalue() == _baseline_html(raw)
+    assert not [p for p in os.listdir(tmp_path) if p.endswith('.tmp')]
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Query dùng chung của batch engine phải là SQL mà analyze_trace thực sự gửi (kể cả khi có SliceIndex)."""
+
+import pytest
+
+import slice_index
+from batch_engine import EXECUTION_SHARED_QUERIES, PrefetchedTraceProcessor, shared_query_sqls
+from slice_tables import has_process_slice_table
+from sql_query import analyze_trace, ensure_slice_with_names_view
+from sqlite_trace import SqliteTraceProcessor, build_launch_trace
+
+TRACE_PATH = '/traces/app_launch.trace'
+
+
+class _TrackedFrames(dict):
+    """frames của PrefetchedTraceProcessor, ghi lại SQL đã được phục vụ."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.served = set()
+
+    def get(self, sql, default=None):
+        if sql in self:
+            self.served.add(sql)
+        return super().get(sql, default)
+
+
+def _prefetch(sqls):
+    """Giống prefetch_shared_queries cho một trace: chạy SQL trên một shell khác."""
+    tp = SqliteTraceProcessor(build_launch_trace())
+    ensure_slice_with_names_view(tp)
+    return _TrackedFrames({sql: tp.query(sql).as_pandas_dataframe() for sql in sqls})
+
+
+def test_slice_lookups_not_prefetched_with_index():
+    sqls = shared_query_sqls(EXECUTION_SHARED_QUERIES)
+    assert sqls
+    assert not any('slice_with_names' in sql for sql in sqls)
+
+
+def test_slice_lookups_prefetched_without_index(monkeypatch):
+    monkeypatch.setattr(slice_index, 'SLICE_INDEX_ENABLED', False)
+    sqls = shared_query_sqls(EXECUTION_SHARED_QUERIES)
+    assert any("launching:%" in sql for sql in sqls)
+
+
+@pytest.mark.parametrize('index_enabled', [True, False])
+def test_every_prefetched_query_is_served(monkeypatch, index_enabled):
+    monkeypatch.setattr(slice_index, 'SLICE_INDEX_ENABLED', index_enabled)
+    frames = _prefetch(shared_query_sqls(EXECUTION_SHARED_QUERIES))
+    view = PrefetchedTraceProcessor(SqliteTraceProcessor(build_launch_trace()), frames)
+
+    metrics = analyze_trace(view, TRACE_PATH)
+
+    # find_slice(activityResume) chỉ dùng cho trace Recent
+    unused = {sql for sql in frames if "name = 'activityResume'" in sql}
+    assert frames.served == set(frames) - unused
+    assert metrics == analyze_trace(SqliteTraceProcessor(build_launch_trace()), TRACE_PATH)
+
+
+def test_wrapper_exposes_tp_attributes():
+    tp = SqliteTraceProcessor(build_launch_trace())
+    tp.process_slice_table = True
+    view = PrefetchedTraceProcessor(tp, {})
+
+    assert has_process_slice_table(view)
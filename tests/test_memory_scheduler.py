@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""MemoryScheduler: admission theo ước lượng đã đặt chỗ + headroom RSS thực, RSS đo được hiệu chỉnh factor."""
+
+import memory_scheduler
+import slice_index
+from memory_scheduler import MemoryScheduler, SLICE_INDEX_ROW_BYTES, WORKER_BASE_RSS, slice_index_bytes
+
+
+def _trace(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b'\0' * size)
+    return str(path)
+
+
+def test_shell_pool_admission_ignores_idle_process_tree_rss(tmp_path, monkeypatch):
+    # Shell pool: shell rảnh giữ trace cũ làm RSS cả cây process vượt budget
+    monkeypatch.setattr(memory_scheduler, 'process_tree_rss', lambda pid=None: 64 << 30)
+    scheduler = MemoryScheduler(4 * WORKER_BASE_RSS, model_path=str(tmp_path / 'model.json'),
+                                live_check=False)
+    first, second = _trace(tmp_path, 'a.log', 1 << 10), _trace(tmp_path, 'b.log', 1 << 10)
+
+    scheduler.admit(first, scheduler.estimate(first, 'text'))
+    assert scheduler.can_admit(scheduler.estimate(second, 'text'))
+    assert scheduler.projected() == scheduler.estimate(first, 'text')
+
+
+def test_live_rss_limits_admission(tmp_path, monkeypatch):
+    # Trace đang chạy dùng nhiều hơn ước lượng: RSS thực chỉ còn 2 MB headroom
+    budget = 4 * WORKER_BASE_RSS
+    live = [budget - (2 << 20)]
+    monkeypatch.setattr(memory_scheduler, 'process_tree_rss', lambda pid=None: live[0])
+    scheduler = MemoryScheduler(budget, model_path=str(tmp_path / 'model.json'))
+    small, large = _trace(tmp_path, 'small.log', 1 << 10), _trace(tmp_path, 'large.log', 1 << 20)
+
+    scheduler.admit('running', WORKER_BASE_RSS)
+    assert scheduler.can_admit(scheduler.estimate(small, 'text'), small)
+    for _ in range(3):
+        assert not scheduler.can_admit(scheduler.estimate(large, 'text'), large)
+    live[0] = 2 * WORKER_BASE_RSS
+    assert scheduler.can_admit(scheduler.estimate(large, 'text'), large)
+    assert scheduler.deferred == {large}
+    assert "deferred traces 1" in scheduler.summary()
+
+
+def test_budget_limits_reserved_estimates(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_scheduler, 'process_tree_rss', lambda pid=None: None)
+    scheduler = MemoryScheduler(3 * WORKER_BASE_RSS, model_path=str(tmp_path / 'model.json'))
+    path = _trace(tmp_path, 'a.log', 1 << 10)
+    estimate = scheduler.estimate(path, 'text')
+    assert scheduler.can_admit(estimate)
+    scheduler.admit('a', estimate)
+    scheduler.admit('b', estimate)
+    assert not scheduler.can_admit(estimate)
+    scheduler.release('b')
+    assert scheduler.can_admit(estimate)
+
+
+def test_observed_rss_corrects_factor(tmp_path):
+    scheduler = MemoryScheduler(1 << 40, model_path=str(tmp_path / 'model.json'))
+    path = _trace(tmp_path, 'a.log', 1 << 20)
+    index_bytes = slice_index_bytes(1 << 20, 'text')
+    scheduler.observe(path, 'text', WORKER_BASE_RSS + 10 * (1 << 20) + index_bytes)
+    assert scheduler.factor('text') == 10.0
+    assert scheduler.estimate(path, 'text') == WORKER_BASE_RSS + 10 * (1 << 20) + index_bytes
+
+
+def test_slice_index_peak_is_estimated(monkeypatch):
+    assert slice_index_bytes(200 << 20, 'text') == (200 << 20) // 200 * SLICE_INDEX_ROW_BYTES
+    assert slice_index_bytes(10 << 20, 'text.gz') == slice_index_bytes(80 << 20, 'text')
+    # Trace vượt SLICE_INDEX_MAX_ROWS không dựng index quá mức trần
+    assert slice_index_bytes(100 << 30, 'text') == slice_index.SLICE_INDEX_MAX_ROWS * SLICE_INDEX_ROW_BYTES
+    monkeypatch.setattr(slice_index, 'SLICE_INDEX_ENABLED', False)
+    assert slice_index_bytes(200 << 20, 'text') == 0
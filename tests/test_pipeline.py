@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""_run_trace_pipeline không treo khi analyser worker chết cứng."""
+
+import multiprocessing
+import os
+
+import pytest
+
+import execution_sql
+from trace_worker import report_task_start, ANALYSIS_ERROR
+
+
+def _fake_convert(task):
+    report_task_start('convert', task[0])
+    return (task, task[0], {}, None)
+
+
+def _fake_analyse(args):
+    task, trace_path, ingest_stats = args
+    report_task_start('analyse', task[0])
+    if 'crash' in task[0]:
+        # Giả lập OOM kill: worker chết không trả kết quả
+        os._exit(1)
+    return (task[2], task[1], 'entry', {'ok': True}, os.path.basename(task[0]), None)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="cần fork")
+def test_dead_analyser_is_reported_instead_of_blocking(monkeypatch):
+    monkeypatch.setattr(execution_sql, '_convert_stage_worker', _fake_convert)
+    monkeypatch.setattr(execution_sql, '_analyse_stage_worker', _fake_analyse)
+    monkeypatch.setattr(execution_sql, 'WORKER_POLL_S', 0.2)
+    tasks = [(f'/traces/{name}.log', 1, name, None, None, {}) for name in ('a_ok', 'b_crash', 'c_ok')]
+
+    results = dict((task[0], result) for task, result in execution_sql._run_trace_pipeline(
+        tasks, num_converters=1, num_analysers=2, start_method='fork'))
+
+    assert set(results) == {t[0] for t in tasks}
+    assert results['/traces/b_crash.log'][5] == ANALYSIS_ERROR
+    assert results['/traces/a_ok.log'][3] == {'ok': True}
+    assert results['/traces/c_ok.log'][3] == {'ok': True}
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Reaction metrics của cùng một trace circular buffer phải như nhau khi chạy
+riêng (reaction_sql.process_single_trace) và khi chạy chung với execution
+(trace_worker: convert stage -> analyse stage với ingest_options['reaction']).
+Shell được thay bằng SQLite dựng từ đúng payload mà shell sẽ đọc theo path.
+"""
+
+from contextlib import contextmanager
+
+import pytest
+
+import reaction_sql
+import trace_processor_pool
+import trace_worker
+from atracetosystrace import _iter_payload, open_trace_source
+from ftrace_fixture import LAUNCHER, launch_trace, write_trace
+from sqlite_trace import SqliteTraceProcessor, load_ftrace
+
+BASE_US = 1_000_000_000
+
+
+def _read_like_shell(path):
+    """Payload mà trace_processor_shell thấy: atrace .log được giải nén nhưng không fix circular buffer."""
+    with open_trace_source(path) as raw_chunks:
+        if raw_chunks is not None:
+            return b''.join(_iter_payload(raw_chunks))
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@contextmanager
+def _fake_open_trace(trace_path, bin_path, **kwargs):
+    yield SqliteTraceProcessor(load_ftrace(_read_like_shell(trace_path)))
+
+
+def _circular_trace(tmp_path):
+    # deliverInputEvent cũ còn sót trước marker buffer started cuối cùng
+    b = launch_trace(base_us=BASE_US)
+    b.slice(BASE_US - 500_000, 5000, *LAUNCHER, LAUNCHER[1], 0, 'deliverInputEvent src=0x1002')
+    b.raw(BASE_US - 400_000, b'##### CPU 2 buffer started ####\n')
+    return write_trace(tmp_path / '1_camera.log', b.text())
+
+
+@pytest.fixture
+def shell(monkeypatch):
+    monkeypatch.setattr(reaction_sql, 'open_trace', _fake_open_trace)
+    monkeypatch.setattr(trace_processor_pool, 'open_trace', _fake_open_trace)
+
+
+def test_standalone_and_combined_reaction_match(tmp_path, shell):
+    path = _circular_trace(tmp_path)
+    scratch_dir = tmp_path / 'scratch'
+    scratch_dir.mkdir()
+    options = {'scratch_dir': str(scratch_dir), 'bin_path': 'trace_processor', 'reaction': True}
+
+    standalone = reaction_sql.process_single_trace((path, 1, 'camera', dict(options)))
+    task = (path, 1, 'camera', None, None, dict(options))
+    _, trace_path, ingest_stats, reason = trace_worker._convert_stage_worker(task)
+    assert reason is None
+    combined = trace_worker._analyse_stage_worker((task, trace_path, ingest_stats))
+
+    reaction_metrics, reaction_reason = combined[6]
+    assert standalone[4] is None and reaction_reason is None
+    standalone[3].pop('shell_stats')
+    assert standalone[3] == reaction_metrics
+    # Touch Down là deliverInputEvent sau marker, không phải bản sót lại trước đó
+    assert reaction_metrics['Touch Duration'] == 50.0
+    assert list(scratch_dir.iterdir()) == []
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""get_cpu_usage_windows (sched_cpu.py) phải khớp query SPAN_JOIN cũ cho từng cửa sổ."""
+
+import random
+
+import pytest
+
+from sched_cpu import DEFAULT_CPU_CORES, get_cpu_usage_windows
+from sql_query import get_top_cpu_usage_process, get_top_cpu_usage_thread
+from sqlite_trace import BASE_TS, MS, SqliteTraceProcessor, build_launch_trace
+
+PROCESS_KEYS = ['proc_name', 'raw_pid', 'dur_ms', 'Occurences', 'dur_percent']
+THREAD_KEYS = ['tid', 'thread_name', 'proc_name', 'dur_ms', 'Occurences', 'dur_percent']
+
+
+def _noisy_trace(seed: int = 7):
+    """Launch fixture + process không tên (main thread binder/kworker), slice dur <= 0, CPU ngoài cores."""
+    rnd = random.Random(seed)
+    db = build_launch_trace()
+    db.executemany("INSERT INTO process VALUES (?, ?, NULL)", [(20, 7000), (21, 7100)])
+    db.executemany("INSERT INTO thread VALUES (?, ?, ?, ?, ?)", [
+        (40, 7000, 'binder:7000_1', 20, 1), (41, 7001, 'worker', 20, 0),
+        (42, 7100, 'kworker/u8', 21, 1), (43, 7101, None, 21, 0), (44, 7102, 'swapper/3', 21, 0),
+    ])
+    utids = [row[0] for row in db.execute("SELECT utid FROM thread")]
+    db.executemany("INSERT INTO sched_slice (ts, dur, cpu, utid) VALUES (?, ?, ?, ?)", [
+        (BASE_TS + rnd.randrange(0, 800 * MS), rnd.choice([0, -1, rnd.randrange(1, 30 * MS)]),
+         rnd.randrange(0, 10), rnd.choice(utids))
+        for _ in range(2000)
+    ])
+    return db
+
+
+def _rows(df, keys):
+    if df is None:
+        return []
+    df = df.astype(object).where(df.notna(), None)
+    return sorted((tuple(r) for r in df[keys].itertuples(index=False)), key=str)
+
+
+@pytest.mark.parametrize('cores', [DEFAULT_CPU_CORES, [0, 2]])
+def test_windows_match_span_join(cores):
+    tp = SqliteTraceProcessor(_noisy_trace())
+    start = BASE_TS
+    ends = {'activityIdle': BASE_TS + 705 * MS, 'animating': BASE_TS + 650 * MS,
+            'short': BASE_TS + 3 * MS + 17, 'empty': start}
+
+    result = get_cpu_usage_windows(tp, start, ends, cores)
+
+    assert set(result) == set(ends)
+    assert result['empty'] == (None, None)
+    for name, end in ends.items():
+        if end <= start:
+            continue
+        proc_df, thread_df = result[name]
+        if proc_df is not None:
+            assert list(proc_df['dur_ms']) == sorted(proc_df['dur_ms'], reverse=True)
+        assert _rows(proc_df, PROCESS_KEYS) == _rows(
+            get_top_cpu_usage_process(tp, start, end - start, cores), PROCESS_KEYS)
+        assert _rows(thread_df, THREAD_KEYS) == _rows(
+            get_top_cpu_usage_thread(tp, start, end - start, cores), THREAD_KEYS)
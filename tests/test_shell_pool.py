@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""open_trace: mặc định shell tự đọc trace theo path, shell pool stream qua /parse."""
+
+import os
+
+from trace_processor_pool import open_trace, TraceProcessorShell
+
+
+def _requests():
+    with open(os.environ['FAKE_TP_LOG']) as f:
+        return f.read().splitlines()
+
+
+def test_default_open_trace_loads_by_path(fake_tp_bin, trace_file):
+    with open_trace(trace_file, fake_tp_bin) as tp:
+        tp.query("SELECT 1;")
+    requests = _requests()
+    assert f"LOAD {os.path.abspath(trace_file)}" in requests
+    assert "POST /parse" not in requests
+
+
+def test_pooled_shell_streams_trace(fake_tp_bin, trace_file):
+    shell = TraceProcessorShell(fake_tp_bin)
+    try:
+        with shell.load(trace_file) as tp:
+            tp.query("SELECT 1;")
+    finally:
+        shell.shutdown()
+    assert "POST /parse" in _requests()
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""SliceIndex bật / tắt cho cùng metrics (analyze_trace và analyze_reaction_trace)."""
+
+import pytest
+
+import slice_index
+from reaction_analysis import analyze_reaction_trace
+from sql_query import analyze_trace
+from sqlite_trace import SqliteTraceProcessor, build_launch_trace
+
+TRACE_PATH = '/traces/app_launch.trace'
+# Helper mà index trả lời trong bộ nhớ: khi bật index không còn SQL nào chứa các tên này
+INDEX_SERVED_NAMES = ('addStartingWindow', 'AIDL%startAnimation%', 'activityStart')
+
+
+def _run(analyse, monkeypatch, enabled):
+    monkeypatch.setattr(slice_index, 'SLICE_INDEX_ENABLED', enabled)
+    tp = SqliteTraceProcessor(build_launch_trace())
+    return analyse(tp, TRACE_PATH), tp.sqls
+
+
+@pytest.mark.parametrize('analyse', [analyze_trace, analyze_reaction_trace])
+def test_index_matches_sql(monkeypatch, analyse):
+    indexed, indexed_sqls = _run(analyse, monkeypatch, True)
+    legacy, legacy_sqls = _run(analyse, monkeypatch, False)
+
+    assert indexed == legacy
+    assert any(name in sql for sql in legacy_sqls for name in INDEX_SERVED_NAMES)
+    assert not any(name in sql for sql in indexed_sqls for name in INDEX_SERVED_NAMES)
+
+
+def test_reaction_helpers_are_covered(monkeypatch):
+    # addStartingWindow / startAnimation đầu tiên theo id, Choreographer cùng thread sau addStartingWindow
+    metrics, _ = _run(analyze_reaction_trace, monkeypatch, True)
+
+    assert metrics['AddStartingWindow'] == 2.0
+    assert metrics['Choreographer'] == 4.0
+    assert metrics['onTransactionReady'] == 6.0
+    assert metrics['drawFrame'] == 3.0
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Backend 'stdlib': mốc launch từ android.startup, parity với backend query cũ."""
+
+from startup_stdlib import analyze_trace_with_backend, compare_metrics, format_stdlib_summary
+from sqlite_trace import APP_PKG, SqliteTraceProcessor, build_launch_trace
+
+TRACE_PATH = '/traces/app_launch.trace'
+
+
+def _run(db, **kwargs):
+    stats = {}
+    tp = SqliteTraceProcessor(db)
+    metrics = analyze_trace_with_backend(tp, TRACE_PATH, backend='stdlib', parity=True,
+                                         stats=stats, **kwargs)
+    return tp, metrics, stats
+
+
+def test_stdlib_matches_queries():
+    tp, metrics, stats = _run(build_launch_trace())
+
+    assert stats['stdlib_used'] and stats['stdlib_startup_type'] == 'cold'
+    # data_by_end_ts được so từng lá
+    assert stats['stdlib_parity']['compared'] > 200
+    assert stats['stdlib_parity']['mismatches'] == {}
+    assert metrics['App Package'] == APP_PKG and metrics['Launch Type'] == 'Cold'
+    assert tp.stdlib_startup is None
+    assert "parity 1/1 traces match" in format_stdlib_summary([stats])
+
+
+def test_parity_reports_stdlib_values():
+    db = build_launch_trace()
+    db.execute("UPDATE android_startups SET startup_type = 'warm'")
+    _, metrics, stats = _run(db)
+
+    assert metrics['Launch Type'] == 'Warm'
+    assert stats['stdlib_parity']['mismatches'] == {'Launch Type': ('Cold', 'Warm')}
+
+
+def test_no_startup_falls_back_to_queries():
+    db = build_launch_trace()
+    db.execute("DELETE FROM android_startups")
+    _, metrics, stats = _run(db)
+
+    assert stats['stdlib_used'] is False
+    assert metrics['App Package'] == APP_PKG
+    assert "0 traces via android.startup (1 fallback to queries)" in format_stdlib_summary([stats])
+
+
+def test_main_thread_tid_not_assumed_equal_to_pid():
+    # activityStart / binder chạy trên main thread có tid khác pid (thread table là nguồn)
+    db = build_launch_trace()
+    db.execute("UPDATE thread SET tid = 3005 WHERE tid = 3000")
+    _, _, stats = _run(db)
+
+    assert stats['stdlib_used']
+    assert stats['stdlib_parity']['mismatches'] == {}
+
+
+def test_compare_metrics_reports_nested_paths():
+    legacy = {'App': 'a', 'data_by_end_ts': {'animating': {'Running': 10.0, 'Rows': [{'dur_ms': 1.0}]}},
+              'ingest_stats': {'x': 1}}
+    stdlib = {'App': 'a', 'data_by_end_ts': {'animating': {'Running': 12.0, 'Rows': [{'dur_ms': 1.001}]}},
+              'ingest_stats': {'x': 2}}
+
+    report = compare_metrics(legacy, stdlib)
+    assert report['compared'] == 3
+    assert report['mismatches'] == {'data_by_end_ts.animating.Running': (10.0, 12.0)}
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""ThreadStateTimeline.summary phải khớp get_thread_state_summary (SPAN_JOIN) cho mọi cửa sổ."""
+
+import random
+
+import pytest
+
+from sql_query import get_thread_state_summary
+from sqlite_trace import APP_PID, BASE_TS, MS, SqliteTraceProcessor, build_launch_trace
+from thread_state_timeline import build_thread_state_timeline, ensure_thread_state_timeline
+
+GMS_TID = 4000
+# tid 3500 được dùng lại bởi hai thread (hai utid), có state NULL và dur -1
+REUSED_TID = 3500
+
+
+def _trace():
+    db = build_launch_trace()
+    db.executemany("INSERT INTO thread VALUES (?, ?, ?, ?, 0)",
+                   [(50, REUSED_TID, 'pool-1', 4), (51, REUSED_TID, 'pool-2', 5)])
+    db.executemany("INSERT INTO thread_state (ts, dur, utid, state) VALUES (?, ?, ?, ?)", [
+        (BASE_TS + 100 * MS, 40 * MS, 50, 'Running'),
+        (BASE_TS + 140 * MS, 10 * MS, 50, None),
+        (BASE_TS + 150 * MS, -1, 50, 'R'),
+        (BASE_TS + 120 * MS, 30 * MS, 51, 'D'),
+        (BASE_TS + 150 * MS, 25 * MS, 51, 'R+'),
+    ])
+    return db
+
+
+def _windows(seed: int = 3):
+    rnd = random.Random(seed)
+    windows = [(BASE_TS, 705 * MS), (BASE_TS + 92 * MS, 3 * MS), (BASE_TS + 93 * MS, MS),
+               (BASE_TS - 50 * MS, 10 * MS), (BASE_TS + 900 * MS, 10 * MS), (BASE_TS, 0)]
+    windows += [(BASE_TS + rnd.randrange(0, 800 * MS), rnd.randrange(1, 300 * MS)) for _ in range(30)]
+    return windows
+
+
+@pytest.mark.parametrize('tid', [APP_PID, GMS_TID, REUSED_TID])
+def test_summary_matches_span_join(tid):
+    tp = SqliteTraceProcessor(_trace())
+    timeline = build_thread_state_timeline(tp, [APP_PID, GMS_TID, REUSED_TID])
+    assert timeline.covers(tid)
+
+    for ts_start, ts_dur in _windows():
+        assert timeline.summary(tid, ts_start, ts_dur) == get_thread_state_summary(tp, tid, ts_start, ts_dur)
+
+
+def test_helper_uses_timeline_only_for_loaded_tids():
+    tp = SqliteTraceProcessor(_trace())
+    ensure_thread_state_timeline(tp, [APP_PID])
+    sent = len(tp.sqls)
+
+    app = get_thread_state_summary(tp, APP_PID, BASE_TS, 705 * MS)
+    assert len(tp.sqls) == sent
+    assert app['Running'] == 372.0
+
+    gms = get_thread_state_summary(tp, GMS_TID, BASE_TS, 705 * MS)
+    assert len(tp.sqls) > sent
+    assert gms == build_thread_state_timeline(tp, [GMS_TID]).summary(GMS_TID, BASE_TS, 705 * MS)
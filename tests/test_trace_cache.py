@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Convert-cache: ftrace text -> Perfetto protobuf. prev_state của sched_switch
+phải mang đúng bit TASK_REPORT mà kernel in ra dạng chữ, và analyze_trace trên
+bản protobuf phải cho cùng metrics (kể cả tổng R / R+ / D / S) như trên text.
+"""
+
+import os
+import shutil
+
+import pytest
+from perfetto.protos.perfetto.trace import perfetto_trace_pb2 as pb
+
+from atracetosystrace import load_trace_data
+from ftrace_fixture import APP, IDLE, FtraceBuilder, launch_trace, write_trace
+from trace_cache import build_cache, cached_missing_markers, cached_trace_path, convert_to_proto
+
+# Bit TASK_REPORT (include/trace/events/sched.h, kernel >= 4.14) theo chữ mà
+# __trace_sched_switch_state in ra; R+ = TASK_REPORT_MAX (bị preempt)
+KERNEL_PREV_STATE = {
+    'R': 0x0, 'R+': 0x100, 'S': 0x1, 'D': 0x2, 'T': 0x4, 't': 0x8,
+    'X': 0x10, 'Z': 0x20, 'P': 0x40, 'I': 0x80, 'D|K': 0x2,
+}
+THREAD_STATE_KEYS = ('Running', 'Runnable', 'Uninterruptible Sleep', 'Sleeping')
+
+
+def _sched_switches(proto_path):
+    with open(proto_path, 'rb') as f:
+        trace = pb.Trace.FromString(f.read())
+    return [event.sched_switch for packet in trace.packet
+            for event in packet.ftrace_events.event if event.HasField('sched_switch')]
+
+
+def test_prev_state_bits_match_kernel_task_report(tmp_path):
+    b = FtraceBuilder()
+    states = list(KERNEL_PREV_STATE)
+    for i, state in enumerate(states):
+        b.sched_switch(1_000_000 + i * 10, 0, APP, state, IDLE)
+    path = write_trace(tmp_path / 'states.log', b.text())
+
+    convert_to_proto(path, str(tmp_path / 'states.pftrace'))
+    switches = _sched_switches(tmp_path / 'states.pftrace')
+
+    assert [s.prev_state for s in switches] == [KERNEL_PREV_STATE[state] for state in states]
+    assert {(s.prev_pid, s.next_pid) for s in switches} == {(APP[1], IDLE[1])}
+
+
+def test_markers_survive_conversion(tmp_path):
+    path = write_trace(tmp_path / 'launch.log', launch_trace().text())
+    stats = convert_to_proto(path, str(tmp_path / 'launch.pftrace'))
+
+    assert stats['proto_events'] and stats['proto_events_skipped'] == 400  # irq + cpu_frequency
+    required = {b'deliverInputEvent': 'missing_deliver_input', b'launching:': 'missing_launching',
+                b'notInTrace': 'missing_other'}
+    assert cached_missing_markers(str(tmp_path / 'launch.pftrace'), required) == ['missing_other']
+
+
+def test_cache_lookup_follows_content(tmp_path):
+    path = write_trace(tmp_path / 'launch.log', launch_trace().text())
+    assert cached_trace_path(path) is None
+
+    mapping = build_cache([str(tmp_path)], num_workers=1)
+    assert cached_trace_path(path) == mapping[path]
+
+    write_trace(path, launch_trace(noise_events=10).text())
+    assert cached_trace_path(path) is None
+
+
+def _trace_processor_bin():
+    path = os.environ.get('TRACE_PROCESSOR_BIN') or shutil.which('trace_processor_shell') \
+        or shutil.which('trace_processor')
+    return path if path and os.path.isfile(path) else None
+
+
+def _preempted_launch_trace():
+    """launch_trace + main thread của app bị preempt (R+) và chờ CPU (R) trong cửa sổ launch."""
+    b = launch_trace()
+    at = lambda ms: 1_000_000_000 + int(ms * 1000)  # noqa: E731
+    for i, start in enumerate(range(70, 700, 20)):
+        cpu = i % 4
+        b.sched_switch(at(start + 17), cpu, IDLE, 'R', APP)
+        b.sched_switch(at(start + 19), cpu, APP, 'R+' if i % 2 else 'R', IDLE)
+    return b.text()
+
+
+def _analyze(trace_path, bin_path):
+    from sql_query import analyze_trace
+    from trace_processor_pool import open_trace
+
+    with open_trace(trace_path, bin_path) as tp:
+        metrics = analyze_trace(tp, trace_path)
+    metrics.pop('PID_Mapping', None)
+    return metrics
+
+
+@pytest.mark.skipif(_trace_processor_bin() is None,
+                    reason="cần trace_processor_shell (TRACE_PROCESSOR_BIN hoặc PATH)")
+def test_text_and_proto_give_same_metrics(tmp_path):
+    bin_path = _trace_processor_bin()
+    log_path = write_trace(tmp_path / 'launch.log', _preempted_launch_trace())
+    text_path = tmp_path / 'launch.trace'
+    text_path.write_bytes(load_trace_data(log_path))
+    proto_path = str(tmp_path / 'launch.pftrace')
+    convert_to_proto(log_path, proto_path)
+
+    from_text = _analyze(str(text_path), bin_path)
+    from_proto = _analyze(proto_path, bin_path)
+
+    assert from_text['Runnable'] > 0 and from_text['Uninterruptible Sleep'] > 0
+    for key in THREAD_STATE_KEYS:
+        assert from_proto[key] == pytest.approx(from_text[key], abs=0.01), key
+    assert from_proto == from_text
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""TraceServerState: shell chết trong / giữa các request bị evict và load lại."""
+
+import pytest
+
+import trace_worker
+from trace_processor_pool import kill_trace_processor
+from trace_server import TraceServerState
+
+
+@pytest.fixture
+def state(fake_tp_bin, monkeypatch):
+    # Bỏ qua convert/pre-validate: shell giả không đọc nội dung trace
+    monkeypatch.setattr(trace_worker, 'load_ingest_payload',
+                        lambda path, options, stats: (path, None))
+    state = TraceServerState(fake_tp_bin, query_timeout=None)
+    yield state
+    state.close()
+
+
+def _kill_and_wait(entry):
+    kill_trace_processor(entry.tp)
+    entry.tp.subprocess.wait(timeout=5)
+
+
+def test_query_on_loaded_trace(state, trace_file):
+    result = state.query(trace_file, "SELECT 1;")
+    assert result['rows'] == []
+    assert len(state.traces) == 1
+
+
+def test_shell_dying_during_request_is_evicted(state, trace_file):
+    def swallowing_fn(entry):
+        # Như helper của analyze_trace: shell chết nhưng lỗi bị nuốt
+        _kill_and_wait(entry)
+        return {'metrics': {}}
+
+    with pytest.raises(RuntimeError):
+        state._run(trace_file, swallowing_fn)
+    assert not state.traces
+
+
+def test_dead_cached_shell_is_reloaded(state, trace_file):
+    first = state.get(trace_file)
+    _kill_and_wait(first)
+    second = state.get(trace_file)
+    assert second is not first and second.alive()
+    assert state.evictions == 1
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Timeout của open_trace / trace_deadline với shell bị treo hoặc bị kill; batch engine
+áp cùng timeout, trace timeout được xếp lại từ process chính (không ngủ trong worker).
+"""
+
+import multiprocessing
+import os
+import time
+
+import pytest
+
+import execution_sql
+import reaction_sql
+import trace_processor_pool
+from batch_engine import analyze_batch
+from sql_query import query_df
+from trace_worker import ANALYSIS_TIMEOUT
+from trace_processor_pool import (
+    open_trace, trace_deadline, kill_trace_processor, TraceTimeout, SHELL_CONNECTION_ERRORS,
+)
+
+STALL_SQL = "SELECT 'fake_tp_stall';"
+
+
+def _wait_dead(proc, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while proc.poll() is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return proc.poll() is not None
+
+
+def test_trace_deadline_raises_when_body_returns_after_expiry():
+    expired = []
+    with pytest.raises(TraceTimeout):
+        with trace_deadline(0.1, lambda: expired.append(True)):
+            time.sleep(0.3)
+    assert expired == [True]
+
+
+def test_trace_deadline_passes_through_fast_body():
+    with trace_deadline(5, lambda: pytest.fail("watchdog fired")):
+        pass
+
+
+def test_query_df_raises_on_killed_shell(fake_tp_bin, trace_file):
+    with open_trace(trace_file, fake_tp_bin, reuse_shell=False) as tp:
+        assert query_df(tp, "SELECT 1;") is None
+        proc = tp.subprocess
+        kill_trace_processor(tp)
+        assert _wait_dead(proc)
+        with pytest.raises(SHELL_CONNECTION_ERRORS):
+            query_df(tp, "SELECT 1;")
+
+
+def test_stalled_query_times_out(fake_tp_bin, trace_file):
+    start = time.monotonic()
+    with pytest.raises(TraceTimeout):
+        with open_trace(trace_file, fake_tp_bin, reuse_shell=False, query_timeout=0.5) as tp:
+            proc = tp.subprocess
+            query_df(tp, STALL_SQL)
+    assert time.monotonic() - start < 30
+    assert _wait_dead(proc)
+
+
+def test_trace_timeout_fires_when_errors_are_swallowed(fake_tp_bin, trace_file):
+    with pytest.raises(TraceTimeout):
+        with open_trace(trace_file, fake_tp_bin, reuse_shell=False, trace_timeout=2) as tp:
+            proc = tp.subprocess
+            try:
+                query_df(tp, STALL_SQL)
+            except Exception:
+                # Helper nuốt lỗi của shell bị kill: open_trace vẫn phải báo timeout
+                pass
+    assert _wait_dead(proc)
+
+
+def test_pooled_shell_is_dropped_after_query_timeout(fake_tp_bin, trace_file):
+    shell = trace_processor_pool.TraceProcessorShell(fake_tp_bin)
+    try:
+        with pytest.raises(TraceTimeout):
+            with shell.load(trace_file) as tp:
+                trace_processor_pool.set_query_timeout(tp, 0.5)
+                try:
+                    query_df(tp, STALL_SQL)
+                except TimeoutError as e:
+                    raise TraceTimeout("query timeout") from e
+        assert shell._owner is None
+    finally:
+        shell.shutdown()
+
+
+@pytest.mark.parametrize('timeouts, message', [({'query_timeout': 0.5}, 'query'),
+                                               ({'trace_timeout': 1}, 'trace')])
+def test_batch_engine_applies_timeouts(fake_tp_bin, trace_file, timeouts, message):
+    def stall(tp, trace_path):
+        query_df(tp, STALL_SQL)
+        return {}
+
+    start = time.monotonic()
+    [(path, metrics, error, stats)] = analyze_batch([trace_file], stall, fake_tp_bin, [], **timeouts)
+    assert time.monotonic() - start < 30
+    assert metrics is None and error.startswith(message) and stats['batch_timeout']
+
+
+def _fake_convert(task):
+    return (task, task[0], {}, None)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="cần fork")
+def test_batch_engine_retries_timed_out_traces(monkeypatch):
+    calls = []
+
+    def fake_analyze_batch(paths, analyse_fn, bin_path, shared_sqls, slice_tables='view',
+                           trace_timeout=None, query_timeout=None):
+        calls.append((list(paths), trace_timeout, query_timeout))
+        # 'slow' luôn timeout, 'flaky' chỉ timeout ở lần đầu
+        return [(p, None if 'slow' in p or ('flaky' in p and len(calls) == 1) else {'ok': True},
+                 'trace vượt quá 7s', {'batch_timeout': 'slow' in p or ('flaky' in p and len(calls) == 1)})
+                for p in paths]
+
+    monkeypatch.setattr(execution_sql, '_convert_stage_worker', _fake_convert)
+    monkeypatch.setattr(execution_sql, 'analyze_batch', fake_analyze_batch)
+    monkeypatch.setattr(execution_sql, 'RETRY_BACKOFF_S', 0.01)
+    options = {'trace_timeout': 7, 'query_timeout': 3, 'max_attempts': 3}
+    tasks = [(f'/traces/{name}.log', 1, name, None, None, options) for name in ('ok', 'flaky', 'slow')]
+
+    results = {task[0]: result for task, result in execution_sql._run_trace_batches(
+        tasks, num_converters=1, start_method='fork')}
+
+    assert results['/traces/ok.log'][3]['ok'] and results['/traces/flaky.log'][3]['ok']
+    assert results['/traces/slow.log'][5] == ANALYSIS_TIMEOUT
+    assert [sorted(c[0]) for c in calls] == [sorted(t[0] for t in tasks), ['/traces/flaky.log', '/traces/slow.log'],
+                                             ['/traces/slow.log']]
+    assert {c[1:] for c in calls} == {(7, 3)}
+
+
+def _flaky_reaction(task):
+    # Timeout ở lần đầu của mỗi trace (đếm qua file, worker là process khác)
+    marker = task[0] + '.attempt'
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        return (task[2], task[1], 'entry', None, reaction_sql.ANALYSIS_TIMEOUT)
+    return (task[2], task[1], 'entry', {'pid': os.getpid()}, None)
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason="cần fork")
+def test_reaction_timeout_is_requeued_by_parent(tmp_path, monkeypatch):
+    monkeypatch.setattr(reaction_sql, 'process_single_trace', _flaky_reaction)
+    monkeypatch.setattr(reaction_sql, 'RETRY_BACKOFF_S', 0.01)
+    tasks = [(str(tmp_path / f'{i}.log'), 1, 'app', {}) for i in range(3)]
+
+    with multiprocessing.get_context('fork').Pool(2) as pool:
+        results = {task[0]: result for task, result in reaction_sql._run_reaction_pool(pool, tasks)}
+
+    assert set(results) == {task[0] for task in tasks}
+    assert all(result[3] and result[4] is None for result in results.values())
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+load_ingest_payload: pre-scan loại trace trước khi decode, trace hợp lệ ra scratch file.
+Module của converter stage không import perfetto / pandas.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import trace_worker
+from ftrace_fixture import APP, CAPTURE_PREFIX, FtraceBuilder, launch_trace, write_trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _load(path, tmp_path):
+    stats = {}
+    (tmp_path / 'scratch').mkdir(exist_ok=True)
+    trace_path, reason = trace_worker.load_ingest_payload(
+        str(path), {'scratch_dir': str(tmp_path / 'scratch')}, stats)
+    return trace_path, reason, stats
+
+
+def test_valid_trace_is_written_to_scratch(tmp_path):
+    path = write_trace(tmp_path / 'launch.log', launch_trace().text())
+    trace_path, reason, stats = _load(path, tmp_path)
+
+    assert reason is None and stats['source'] == 'text'
+    assert os.path.getsize(trace_path) == stats['payload_bytes']
+    trace_worker.discard_scratch_trace(trace_path)
+
+
+@pytest.mark.parametrize('name', ['launch.log', 'launch.log.gz'])
+def test_missing_marker_rejected_before_load(tmp_path, monkeypatch, name):
+    b = FtraceBuilder()
+    b.slice(1_000_000_000, 5000, *APP, APP[1], 0, 'deliverInputEvent src=0x1002')
+    path = write_trace(tmp_path / name, b.text())
+
+    def _no_load(*args, **kwargs):
+        raise AssertionError('load_trace_data called for a rejected trace')
+    monkeypatch.setattr(trace_worker, 'load_trace_data', _no_load)
+
+    assert _load(path, tmp_path)[:2] == (None, 'missing_launching')
+
+
+def test_corrupt_payload_rejected_by_prescan(tmp_path, monkeypatch):
+    # zlib bị cắt trước khi tới marker đầu tiên
+    path = tmp_path / 'broken.log'
+    data = open(write_trace(path, launch_trace().text()), 'rb').read()
+    path.write_bytes(data[:len(CAPTURE_PREFIX) + 64])
+    monkeypatch.setattr(trace_worker, 'load_trace_data', None)
+
+    assert _load(path, tmp_path)[:2] == (None, trace_worker.PRESCAN_CORRUPT_PAYLOAD)
+
+
+def test_converter_modules_do_not_import_perfetto():
+    code = ("import sys, trace_worker\n"
+            "for name in trace_worker.CONVERTER_PRELOAD: __import__(name)\n"
+            "print(sorted(m for m in sys.modules if m.split('.')[0] in ('perfetto', 'pandas')))")
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == '[]'
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""WindowFamily (một query trên cửa sổ rộng nhất) phải khớp query theo từng end_ts variant."""
+
+import pytest
+
+import slice_index
+from sql_query import (
+    build_end_ts_window_family, ensure_slice_with_names_view, get_abnormal_processes,
+    get_binder_transaction, get_loadApkAsset, get_pid_list, summarize_binder_transactions, top_block_IO,
+)
+from sqlite_trace import APP_PID, BASE_TS, MS, SqliteTraceProcessor, build_launch_trace
+
+# End của các variant, gồm cả end trùng ts của một row (biên <= / < của từng metric)
+END_TS_VARIANTS = {
+    'activityIdle': BASE_TS + 705 * MS,
+    'animating': BASE_TS + 650 * MS,
+    'block_io_edge': BASE_TS + int(134.95 * MS),
+    'load_apk_edge': BASE_TS + 130 * MS,
+    'binder_edge': BASE_TS + 240 * MS,
+    'abnormal_edge': BASE_TS + 400 * MS,
+}
+
+
+def _same(family_df, legacy_df):
+    if legacy_df is None:
+        assert family_df is None
+    else:
+        assert family_df is not None
+        assert family_df.reset_index(drop=True).equals(legacy_df.reset_index(drop=True))
+
+
+@pytest.mark.parametrize('index_enabled', [True, False])
+def test_family_matches_per_variant_queries(monkeypatch, index_enabled):
+    monkeypatch.setattr(slice_index, 'SLICE_INDEX_ENABLED', index_enabled)
+    tp = SqliteTraceProcessor(build_launch_trace())
+    ensure_slice_with_names_view(tp)
+    slice_index.ensure_slice_index(tp)
+    start = BASE_TS
+    family = build_end_ts_window_family(tp, start, END_TS_VARIANTS, APP_PID, APP_PID)
+
+    sent = len(tp.sqls)
+    selected = {end: {key: family.select(key, end) for key in ('block_io', 'load_apk', 'abnormal', 'binder')}
+                for end in END_TS_VARIANTS.values()}
+    # Mỗi metric một query (+ get_pid_list cho LoadApkAssets) cho mọi variant
+    assert len(tp.sqls) - sent <= 5
+
+    pids = get_pid_list(tp)
+    pids.append(APP_PID)
+    for end, frames in selected.items():
+        assert all(family.covers(key, end) for key in frames)
+        _same(frames['block_io'], top_block_IO(tp, APP_PID, start, end))
+        _same(frames['load_apk'], get_loadApkAsset(tp, pids, start, end))
+        _same(frames['abnormal'], get_abnormal_processes(tp, start, end, APP_PID, ['bindApplication']))
+        assert summarize_binder_transactions(frames['binder']) == get_binder_transaction(tp, APP_PID, end)
+
+    # Fixture phải chạm cả hai phía của từng biên
+    assert selected[END_TS_VARIANTS['block_io_edge']]['block_io'] is not None
+    assert selected[END_TS_VARIANTS['load_apk_edge']]['load_apk'] is None
+    assert summarize_binder_transactions(selected[END_TS_VARIANTS['binder_edge']]['binder'])[0] == 2
+    assert len(selected[END_TS_VARIANTS['abnormal_edge']]['abnormal']) == 1
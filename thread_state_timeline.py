@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+thread_state_timeline.py
+
+Timeline thread_state của một số thread (theo tid), kéo về MỘT lần thành mảng
+NumPy đã sắp theo ts kèm tổng tích luỹ (prefix sum) thời lượng theo từng state.
+Tổng state của một cửa sổ [start, end) = hiệu hai prefix sum (tìm bằng binary
+search) + phần bị cắt của hai row ở biên, không cần SQL.
+
+Thay cho get_thread_state_summary dạng SPAN_JOIN (tạo state_view, intervals,
+virtual table rồi drop cho MỖI lần gọi): app main thread và mọi background
+process của mọi end_ts variant dùng chung một lần kéo dữ liệu.
+
+Timeline được gắn vào TraceProcessor (attribute thread_state_timeline) bởi
+ensure_thread_state_timeline; get_thread_state_summary chạy SQL như cũ với tid
+không có trong timeline.
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+THREAD_STATE_TIMELINE_ENABLED = True
+
+THREAD_STATE_SQL = """
+SELECT thread_state.utid, thread.tid, thread_state.ts, thread_state.dur, thread_state.state
+FROM thread_state
+JOIN thread USING (utid)
+WHERE thread.tid IN ({tids})
+ORDER BY thread_state.utid, thread_state.ts;
+"""
+
+
+class _UtidTimeline:
+    """Các state (không chồng lấn) của một utid, sắp theo ts, với prefix sum theo state."""
+
+    def __init__(self, starts: np.ndarray, durs: np.ndarray, codes: np.ndarray, n_states: int):
+        self.starts = starts
+        self.ends = starts + durs
+        self.codes = codes
+        # cum[k, i] = tổng dur của row < i có state k
+        self.cum = np.zeros((n_states, len(starts) + 1), dtype=np.int64)
+        for k in range(n_states):
+            np.cumsum(np.where(codes == k, durs, 0), out=self.cum[k, 1:])
+
+    def add_window(self, totals: np.ndarray, start: int, end: int) -> None:
+        """Cộng thời lượng từng state trong [start, end) vào totals (ns)."""
+        # Row nằm trọn trong cửa sổ: [first, last)
+        first = np.searchsorted(self.starts, start, 'left')
+        last = np.searchsorted(self.ends, end, 'right')
+        if first < last:
+            totals += self.cum[:, last] - self.cum[:, first]
+        # Row cắt biên trái / biên phải (hoặc một row phủ cả cửa sổ)
+        for pos in {first - 1, last}:
+            if 0 <= pos < len(self.starts) and not (first <= pos < last):
+                overlap = min(self.ends[pos], end) - max(self.starts[pos], start)
+                if overlap > 0:
+                    totals[self.codes[pos]] += overlap
+
+
+class ThreadStateTimeline:
+    """thread_state của các tid đã nạp; summary() trả lời như get_thread_state_summary."""
+
+    def __init__(self, df: pd.DataFrame, tids: Iterable[int]):
+        self.tids = {int(t) for t in tids}
+        # Row dur âm (state chưa kết thúc) không được tính
+        df = df[df['dur'] > 0]
+        # Key giống get_thread_state_summary cũ: str() của giá trị as_pandas_dataframe
+        # trả về (NULL -> 'None' hoặc 'nan' tuỳ dtype pandas suy ra)
+        codes, states = pd.factorize(df['state'].map(str))
+        self.states: List[str] = list(states)
+        self._by_tid: Dict[int, List[_UtidTimeline]] = {}
+        df = df.assign(_code=codes)
+        for (tid, _), group in df.groupby(['tid', 'utid'], sort=False):
+            group = group.sort_values('ts', kind='stable')
+            self._by_tid.setdefault(int(tid), []).append(_UtidTimeline(
+                group['ts'].to_numpy(dtype=np.int64), group['dur'].to_numpy(dtype=np.int64),
+                group['_code'].to_numpy(dtype=np.int64), len(self.states)))
+
+    def covers(self, tid) -> bool:
+        try:
+            return tid is not None and int(tid) in self.tids
+        except (TypeError, ValueError):
+            return False
+
+    def summary(self, tid: int, ts_start: int, ts_dur: int) -> Dict[str, float]:
+        """{state: tổng ms} trong [ts_start, ts_start + ts_dur), state có thời lượng > 0, giảm dần."""
+        if ts_dur <= 0:
+            return {}
+        totals = np.zeros(len(self.states), dtype=np.int64)
+        for timeline in self._by_tid.get(int(tid), []):
+            timeline.add_window(totals, ts_start, ts_start + ts_dur)
+        order = np.argsort(-totals, kind='stable')
+        return {self.states[k]: float(totals[k] / 1e6) for k in order if totals[k] > 0}
+
+
+def build_thread_state_timeline(tp, tids: Iterable[int]) -> Optional[ThreadStateTimeline]:
+    """Kéo thread_state của tids thành ThreadStateTimeline (None nếu lỗi)."""
+    tids = sorted({int(t) for t in tids if t is not None})
+    if not tids:
+        return None
+    try:
+        res = tp.query(THREAD_STATE_SQL.format(tids=','.join(map(str, tids))))
+        df = res.as_pandas_dataframe()
+    except SHELL_CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        print(f"[WARN] Không dựng được thread state timeline, dùng SQL: {e}")
+        return None
+    return ThreadStateTimeline(df, tids)
+
+
+def ensure_thread_state_timeline(tp, tids: Iterable[int]) -> Optional[ThreadStateTimeline]:
+    """Dựng timeline cho tids và gắn vào tp.thread_state_timeline."""
+    if not THREAD_STATE_TIMELINE_ENABLED:
+        return None
+    tp.thread_state_timeline = build_thread_state_timeline(tp, tids)
+    return tp.thread_state_timeline
+
+
+def get_thread_state_timeline(tp) -> Optional[ThreadStateTimeline]:
+    """Timeline đã gắn vào tp (None -> get_thread_state_summary chạy SQL)."""
+    return getattr(tp, 'thread_state_timeline', None)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace_cache.py
+
+Stage convert-cache: chuyển atrace .log (ftrace text) sang Perfetto protobuf
+(FtraceEventBundle) một lần, lưu theo content hash. Các lần chạy sau
+execution_sql / reaction_sql load bản binary thay vì parse lại text.
+
+Chỉ các event trong DEFAULT_EVENT_ALLOWLIST được chuyển (đủ cho sql_query);
+event khác bị bỏ và được đếm trong stats.
+
+Usage:
+    python trace_cache.py <folder> [<folder> ...] [--cache-dir DIR] [--workers N]
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import re
+from collections import defaultdict
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+
+from atracetosystrace import load_trace_data, find_end_of_header, find_missing_markers, is_trace_file
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+# Cache mặc định nằm cạnh input: <folder>/.trace_cache/<sha256>.pftrace
+CACHE_DIR_NAME = '.trace_cache'
+CACHE_SUFFIX = '.pftrace'
+# Tăng khi format output của converter đổi -> cache cũ tự bị bỏ qua
+CACHE_VERSION = 1
+INDEX_FILENAME = 'index.json'
+HASH_CHUNK_SIZE = 4 << 20
+# Số event tối đa trong một FtraceEventBundle
+BUNDLE_MAX_EVENTS = 4096
+TRUSTED_SEQUENCE_ID = 1
+
+# <task>-<tid> (<tgid>) [<cpu>] <flags> <sec>.<usec>: <event>: <args>
+FTRACE_LINE_RE = re.compile(
+    rb'^\s*(.+?)-(\d+)\s+(?:\(\s*([\d-]+)\)\s+)?\[(\d+)\]\s+(?:\S+\s+)?(\d+)\.(\d+): ([^\s:]+): ?(.*)$'
+)
+SCHED_SWITCH_RE = re.compile(
+    rb'prev_comm=(.*) prev_pid=(-?\d+) prev_prio=(-?\d+) prev_state=(\S+) ==> '
+    rb'next_comm=(.*) next_pid=(-?\d+) next_prio=(-?\d+)'
+)
+SCHED_WAKEUP_RE = re.compile(rb'comm=(.*) pid=(-?\d+) prio=(-?\d+)(?: success=(\d+))?(?: target_cpu=(\d+))?')
+SCHED_PROCESS_RE = re.compile(rb'comm=(.*) pid=(-?\d+) prio=(-?\d+)')
+SCHED_BLOCKED_RE = re.compile(rb'pid=(\d+) iowait=(\d+)')
+TASK_NEWTASK_RE = re.compile(rb'pid=(\d+) comm=(.*) clone_flags=([0-9a-fA-F]+) oom_score_adj=(-?\d+)')
+TASK_RENAME_RE = re.compile(rb'pid=(\d+) oldcomm=(.*) newcomm=(.*) oom_score_adj=(-?\d+)')
+
+# prev_state text -> bitmask TASK_REPORT (kernel >= 4.14), R+ = preempted
+PREV_STATE_BITS = {'S': 1, 'D': 2, 'T': 4, 't': 8, 'X': 16, 'Z': 32, 'P': 64, 'I': 128}
+PREEMPTED_STATE = 256
+
+
+# ---------------------------------------------------------------------------
+# Content hash & cache lookup
+# ---------------------------------------------------------------------------
+
+def file_digest(file_path: str) -> str:
+    """sha256 của file trace gốc (đọc qua mmap theo block; file nén hash bản nén)."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in range(0, len(mm), HASH_CHUNK_SIZE):
+                digest.update(mm[offset:offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def default_cache_dir(file_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), CACHE_DIR_NAME)
+
+
+def _load_index(cache_dir: str) -> dict:
+    try:
+        with open(os.path.join(cache_dir, INDEX_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(cache_dir: str, index: dict) -> None:
+    path = os.path.join(cache_dir, INDEX_FILENAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _index_key(file_path: str) -> str:
+    st = os.stat(file_path)
+    return f"{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}"
+
+
+def cache_key(file_path: str, index: dict = None) -> str:
+    """
+    Key của cache = sha256 nội dung + CACHE_VERSION.
+    index (path|size|mtime -> digest) giúp không phải hash lại file chưa đổi.
+    """
+    key = _index_key(file_path)
+    digest = index.get(key) if index is not None else None
+    if digest is None:
+        digest = file_digest(file_path)
+        if index is not None:
+            index[key] = digest
+    return f"{digest}.v{CACHE_VERSION}"
+
+
+def cached_trace_path(file_path: str, cache_dir: str = None) -> str:
+    """Trả về đường dẫn .pftrace nếu đã có trong cache, ngược lại None."""
+    cache_dir = cache_dir or default_cache_dir(file_path)
+    if not os.path.isdir(cache_dir):
+        return None
+    path = os.path.join(cache_dir, cache_key(file_path, _load_index(cache_dir)) + CACHE_SUFFIX)
+    return path if os.path.isfile(path) else None
+
+
+def cached_missing_markers(cache_path: str, required: dict) -> list:
+    """
+    Pre-scan trên file .pftrace: buf của print event nằm nguyên dạng UTF-8
+    trong protobuf nên chỉ cần mmap + find, không phải decode.
+    """
+    with open(cache_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return list(required.values())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return find_missing_markers(mm, required)
+
+
+# ---------------------------------------------------------------------------
+# ftrace text -> Perfetto protobuf
+# ---------------------------------------------------------------------------
+
+def _str(value: bytes) -> str:
+    return value.decode('utf-8', 'replace')
+
+
+def _prev_state(state: bytes) -> int:
+    text = _str(state)
+    if text.startswith('R'):
+        return PREEMPTED_STATE if text.endswith('+') else 0
+    bits = 0
+    for part in text.split('|'):
+        bits |= PREV_STATE_BITS.get(part[:1], 0)
+    return bits
+
+
+def _fill_event(event, name: bytes, args: bytes) -> bool:
+    """Điền payload của FtraceEvent theo tên event. False nếu không parse được."""
+    if name in (b'tracing_mark_write', b'print'):
+        if args.startswith(b'tracing_mark_write: '):
+            args = args[len(b'tracing_mark_write: '):]
+        event.print.buf = _str(args) + '\n'
+        return True
+
+    if name == b'sched_switch':
+        m = SCHED_SWITCH_RE.match(args)
+        if not m:
+            return False
+        ev = event.sched_switch
+        ev.prev_comm = _str(m.group(1))
+        ev.prev_pid = int(m.group(2))
+        ev.prev_prio = int(m.group(3))
+        ev.prev_state = _prev_state(m.group(4))
+        ev.next_comm = _str(m.group(5))
+        ev.next_pid = int(m.group(6))
+        ev.next_prio = int(m.group(7))
+        return True
+
+    if name in (b'sched_wakeup', b'sched_wakeup_new', b'sched_waking'):
+        m = SCHED_WAKEUP_RE.match(args)
+        if not m:
+            return False
+        ev = getattr(event, _str(name))
+        ev.comm = _str(m.group(1))
+        ev.pid = int(m.group(2))
+        ev.prio = int(m.group(3))
+        ev.success = int(m.group(4) or 1)
+        if m.group(5) is not None:
+            ev.target_cpu = int(m.group(5))
+        return True
+
+    if name in (b'sched_process_exit', b'sched_process_free'):
+        m = SCHED_PROCESS_RE.match(args)
+        if not m:
+            return False
+        ev = getattr(event, _str(name))
+        ev.comm = _str(m.group(1))
+        ev.pid = int(m.group(2))
+        ev.prio = int(m.group(3))
+        return True
+
+    if name == b'sched_blocked_reason':
+        # caller (symbol) không có dạng địa chỉ trong text -> chỉ giữ pid/io_wait
+        m = SCHED_BLOCKED_RE.match(args)
+        if not m:
+            return False
+        event.sched_blocked_reason.pid = int(m.group(1))
+        event.sched_blocked_reason.io_wait = int(m.group(2))
+        return True
+
+    if name == b'task_newtask':
+        m = TASK_NEWTASK_RE.match(args)
+        if not m:
+            return False
+        ev = event.task_newtask
+        ev.pid = int(m.group(1))
+        ev.comm = _str(m.group(2))
+        ev.clone_flags = int(m.group(3), 16)
+        ev.oom_score_adj = int(m.group(4))
+        return True
+
+    if name == b'task_rename':
+        m = TASK_RENAME_RE.match(args)
+        if not m:
+            return False
+        ev = event.task_rename
+        ev.pid = int(m.group(1))
+        ev.oldcomm = _str(m.group(2))
+        ev.newcomm = _str(m.group(3))
+        ev.oom_score_adj = int(m.group(4))
+        return True
+
+    return False
+
+
+def _bundle_packet(pb, cpu: int, events: list) -> bytes:
+    packet = pb.TracePacket(trusted_packet_sequence_id=TRUSTED_SEQUENCE_ID)
+    packet.ftrace_events.cpu = cpu
+    packet.ftrace_events.event.extend(events)
+    return pb.Trace(packet=[packet]).SerializeToString()
+
+
+def convert_to_proto(input_file: str, output_file: str, stats: dict = None) -> dict:
+    """
+    Chuyển một atrace .log sang Perfetto protobuf tại output_file.
+    Event được gom theo CPU thành FtraceEventBundle; tid -> tgid (cột TGID)
+    được ghi vào một ProcessTree packet ở đầu timeline.
+    """
+    # perfetto protos chỉ import khi thật sự convert: converter worker chỉ
+    # gọi cached_trace_path / cached_missing_markers thì không kéo perfetto vào
+    from perfetto.protos.perfetto.trace import perfetto_trace_pb2 as pb
+
+    stats = stats if stats is not None else {}
+    trace_data = load_trace_data(input_file)
+    view = memoryview(trace_data)
+    pos = find_end_of_header(trace_data)
+
+    pending = defaultdict(list)
+    threads = {}
+    first_ts = None
+    converted = skipped = 0
+
+    with open(output_file, 'wb') as out:
+        while pos < len(trace_data):
+            end = trace_data.find(b'\n', pos)
+            if end < 0:
+                end = len(trace_data)
+            line = view[pos:end].tobytes()
+            pos = end + 1
+
+            m = FTRACE_LINE_RE.match(line)
+            if not m:
+                continue
+            comm, tid, tgid, cpu, sec, frac, name, args = m.groups()
+            event = pb.FtraceEvent()
+            if not _fill_event(event, name, args):
+                skipped += 1
+                continue
+
+            tid = int(tid)
+            cpu = int(cpu)
+            event.timestamp = int(sec) * 1_000_000_000 + int(frac.ljust(9, b'0')[:9])
+            event.pid = tid
+            if first_ts is None:
+                first_ts = event.timestamp
+            thread = threads.setdefault(tid, [None, None])
+            thread[0] = _str(comm)
+            if tgid and tgid.strip(b'-'):
+                thread[1] = int(tgid)
+
+            pending[cpu].append(event)
+            converted += 1
+            if len(pending[cpu]) >= BUNDLE_MAX_EVENTS:
+                out.write(_bundle_packet(pb, cpu, pending.pop(cpu)))
+
+        for cpu, events in pending.items():
+            out.write(_bundle_packet(pb, cpu, events))
+
+        process_tree = pb.TracePacket(trusted_packet_sequence_id=TRUSTED_SEQUENCE_ID,
+                                      timestamp=first_ts or 0)
+        for tid, (comm, tgid) in sorted(threads.items()):
+            if tgid is None or tid == 0:
+                continue
+            process_tree.process_tree.threads.add(tid=tid, tgid=tgid, name=comm)
+        out.write(pb.Trace(packet=[process_tree]).SerializeToString())
+
+    view.release()
+    stats['proto_events'] = converted
+    stats['proto_events_skipped'] = skipped
+    stats['proto_bytes'] = os.path.getsize(output_file)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# convert-cache stage
+# ---------------------------------------------------------------------------
+
+def _write_cache_entry(file_path: str, path: str) -> dict:
+    """Convert vào file tạm rồi os.replace, để worker khác không đọc được file dở."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        stats = convert_to_proto(file_path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return stats
+
+
+def _convert_worker(args):
+    file_path, cache_dir, key = args
+    path = os.path.join(cache_dir, key + CACHE_SUFFIX)
+    if os.path.isfile(path):
+        return file_path, path, 'hit', None
+    try:
+        return file_path, path, 'converted', _write_cache_entry(file_path, path)
+    except Exception as e:
+        return file_path, None, 'error', str(e)
+
+
+def build_cache(folder_paths, cache_dir: str = None, num_workers: int = None) -> dict:
+    """
+    Convert toàn bộ trace (.log / .log.gz / .log.zst / .log.zip) trong các folder vào cache.
+    Trả về {log_path: pftrace_path} cho các file convert/hit thành công.
+    """
+    num_workers = num_workers or min(cpu_count(), 8)
+    tasks = []
+    indexes = {}
+    for folder in folder_paths:
+        for log_path in sorted(Path(folder).rglob("*")):
+            if CACHE_DIR_NAME in log_path.parts or not log_path.is_file() or not is_trace_file(log_path.name):
+                continue
+            log_path = str(log_path)
+            target_dir = cache_dir or default_cache_dir(log_path)
+            os.makedirs(target_dir, exist_ok=True)
+            index = indexes.setdefault(target_dir, _load_index(target_dir))
+            tasks.append((log_path, target_dir, cache_key(log_path, index)))
+
+    for target_dir, index in indexes.items():
+        _save_index(target_dir, index)
+
+    print(f"[CACHE] {len(tasks)} traces -> Perfetto protobuf ({num_workers} workers)")
+    mapping = {}
+    with Pool(processes=num_workers) as pool:
+        for i, (log_path, path, status, info) in enumerate(pool.imap_unordered(_convert_worker, tasks)):
+            name = Path(log_path).name
+            if status == 'error':
+                print(f"  - [{i+1}/{len(tasks)}] [ERROR] {name}: {info}")
+                continue
+            mapping[log_path] = path
+            if status == 'converted':
+                print(f"  - [{i+1}/{len(tasks)}] {name}: {info['proto_events']} events, "
+                      f"{os.path.getsize(log_path) / 1e6:.1f} MB -> {info['proto_bytes'] / 1e6:.1f} MB")
+            else:
+                print(f"  - [{i+1}/{len(tasks)}] {name}: cached")
+    return mapping
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert atrace .log files into a Perfetto protobuf cache')
+    parser.add_argument('folders', nargs='+', help='Folders containing .log traces (searched recursively)')
+    parser.add_argument('--cache-dir', default=None,
+                        help=f'Cache directory (default: {CACHE_DIR_NAME}/ next to each trace)')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes')
+    args = parser.parse_args()
+
+    mapping = build_cache(args.folders, cache_dir=args.cache_dir, num_workers=args.workers)
+    print(f"[CACHE] Done: {len(mapping)} traces cached")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace_loader.py
+
+Hand-off trace cho trace_processor qua đường dẫn file thay vì stream bytes
+qua Python API. Payload đã convert được ghi một lần vào scratch dir
+(ưu tiên tmpfs /dev/shm), shell được khởi động với đường dẫn đó và tự đọc
+file; Python không phải đẩy từng chunk qua RPC.
+
+Scratch dir được tạo cho mỗi lần chạy (make_scratch_dir) và xoá bởi
+process chính (remove_scratch_dir), nên file tạm không bị bỏ sót kể cả khi
+worker chết giữa chừng.
+"""
+
+import os
+import shutil
+import tempfile
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+# Override scratch dir bằng biến môi trường (vd. ổ SSD riêng trên Windows)
+SCRATCH_ENV_VAR = 'TRACETOOL_SCRATCH_DIR'
+TMPFS_DIR = '/dev/shm'
+SCRATCH_PREFIX = 'tracetool-'
+SCRATCH_SUFFIX = '.trace'
+WRITE_CHUNK_SIZE = 16 << 20
+# Shell chỉ trả lời /status sau khi đã load xong trace -> timeout phải đủ cho trace lớn
+PATH_LOAD_TIMEOUT_S = 300
+
+
+def scratch_base_dir() -> str:
+    """Thư mục gốc cho file tạm: env override > tmpfs (/dev/shm) > temp mặc định."""
+    override = os.environ.get(SCRATCH_ENV_VAR)
+    if override and os.path.isdir(override):
+        return override
+    if os.path.isdir(TMPFS_DIR) and os.access(TMPFS_DIR, os.W_OK):
+        return TMPFS_DIR
+    return tempfile.gettempdir()
+
+
+def make_scratch_dir() -> str:
+    """Tạo scratch dir riêng cho một lần chạy (gọi từ process chính)."""
+    return tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=scratch_base_dir())
+
+
+def remove_scratch_dir(scratch_dir: str) -> None:
+    if scratch_dir:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def write_scratch_trace(trace_data, scratch_dir: str = None) -> str:
+    """
+    Ghi payload (bytes/bytearray/memoryview) ra một file tạm và trả về đường dẫn.
+    Người gọi chịu trách nhiệm xoá (discard_scratch_trace).
+    """
+    fd, path = tempfile.mkstemp(prefix=SCRATCH_PREFIX, suffix=SCRATCH_SUFFIX,
+                                dir=scratch_dir or scratch_base_dir())
+    try:
+        view = memoryview(trace_data)
+        with os.fdopen(fd, 'wb') as f:
+            for offset in range(0, len(view), WRITE_CHUNK_SIZE):
+                f.write(view[offset:offset + WRITE_CHUNK_SIZE])
+        view.release()
+    except BaseException:
+        discard_scratch_trace(path)
+        raise
+    return path
+
+
+def discard_scratch_trace(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def open_trace_by_path(trace_path: str, bin_path: str,
+                       load_timeout: int = PATH_LOAD_TIMEOUT_S) -> 'TraceProcessor':
+    """
+    Khởi động trace_processor_shell với trace_path làm tham số dòng lệnh:
+    shell tự đọc file (-D mode load trace trước rồi mới mở HTTP server).
+    Trả về TraceProcessor đã kết nối; close() sẽ tắt shell.
+    """
+    # perfetto (kéo theo pandas) chỉ import khi thật sự mở trace: converter
+    # worker dùng write_scratch_trace mà không phải trả chi phí import này
+    from perfetto.trace_processor.api import TraceProcessor, TraceProcessorConfig
+
+    config = TraceProcessorConfig(bin_path=bin_path,
+                                  load_timeout=load_timeout,
+                                  extra_flags=[os.path.abspath(trace_path)])
+    return TraceProcessor(config=config)
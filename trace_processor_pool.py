@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace_processor_pool.py
+
+trace_processor_shell sống lâu trong mỗi worker process. Thay vì spawn +
+chọn port + kill một shell cho mỗi trace, worker giữ một shell và với mỗi
+trace chỉ mở kết nối mới (TraceProcessor(addr=...)); shell tự reset state
+khi nhận trace mới sau notify_eof.
+
+Shell được restart khi:
+- health check (/status) thất bại
+- load trace lỗi (state có thể hỏng)
+- đã phục vụ SHELL_MAX_TRACES trace (chặn leak bộ nhớ trong shell)
+
+Chi phí spawn/teardown được ghi vào stats của từng trace để báo cáo.
+
+Đánh đổi: HTTP RPC của shell không có lệnh load trace theo path, nên shell
+dùng lại chỉ nhận trace mới qua /parse -> Python phải stream toàn bộ payload
+qua kết nối HTTP. Shell spawn riêng cho từng trace (open_trace_by_path) tự
+đọc file, không tốn copy đó. Vì vậy pipeline mặc định KHÔNG dùng shell pool
+(reuse_shell=False); chỉ bật khi trace nhỏ và chi phí spawn chiếm phần lớn.
+
+open_trace còn áp timeout: mỗi query bị giới hạn bởi socket timeout của kết
+nối HTTP, cả trace bị giới hạn bởi watchdog thread; khi hết hạn shell bị kill
+(và reap khi close) rồi TraceTimeout được raise cho người gọi retry.
+"""
+
+import http.client
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+
+from perfetto.trace_processor.api import TraceProcessor, TraceProcessorConfig
+
+from trace_loader import open_trace_by_path
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+SHELL_MAX_TRACES = 50
+SHELL_START_TIMEOUT_S = 30
+# Health check không được treo theo shell đang kẹt
+SHELL_STATUS_TIMEOUT_S = 10
+# Timeout mặc định cho một query và cho toàn bộ một trace (load + phân tích)
+QUERY_TIMEOUT_S = 120
+TRACE_TIMEOUT_S = 600
+# Lỗi kết nối tới shell -> shell có thể đã chết/kẹt, không dùng lại
+SHELL_CONNECTION_ERRORS = (OSError, http.client.HTTPException)
+
+# Shell của worker process hiện tại (xem worker_shell)
+_WORKER_SHELL = None
+
+
+class TraceTimeout(Exception):
+    """Trace vượt quá trace timeout hoặc một query vượt quá query timeout."""
+
+
+def kill_trace_processor(tp):
+    """
+    Kill process tree của shell mà không chờ (an toàn khi gọi từ thread khác);
+    close() của TraceProcessor sau đó sẽ reap process.
+    """
+    proc = getattr(tp, 'subprocess', None)
+    if proc is None:
+        return
+    try:
+        if os.name == 'posix':
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        pass
+
+
+def set_query_timeout(tp, seconds):
+    """Giới hạn thời gian chờ mỗi request HTTP (query) tới shell."""
+    conn = tp.http.conn
+    conn.timeout = seconds
+    if conn.sock is not None:
+        conn.sock.settimeout(seconds)
+
+
+class TraceProcessorShell:
+    """Một trace_processor_shell dùng lại cho nhiều trace trong cùng process."""
+
+    def __init__(self, bin_path, max_traces=SHELL_MAX_TRACES):
+        self.bin_path = bin_path
+        self.max_traces = max_traces
+        self.addr = None
+        self.traces_served = 0
+        self._owner = None
+
+    def _spawn(self):
+        config = TraceProcessorConfig(bin_path=self.bin_path, load_timeout=SHELL_START_TIMEOUT_S)
+        self._owner = TraceProcessor(config=config)
+        set_query_timeout(self._owner, SHELL_STATUS_TIMEOUT_S)
+        conn = self._owner.http.conn
+        self.addr = f"{conn.host}:{conn.port}"
+        self.traces_served = 0
+
+    def shutdown(self):
+        """Tắt shell (nếu có). Trả về thời gian teardown (s)."""
+        if self._owner is None:
+            return 0.0
+        start = time.perf_counter()
+        try:
+            self._owner.close()
+        finally:
+            self._owner = None
+            self.addr = None
+        return time.perf_counter() - start
+
+    def kill(self):
+        """Kill shell đang kẹt (gọi được từ watchdog thread); shutdown() sẽ reap."""
+        if self._owner is not None:
+            kill_trace_processor(self._owner)
+
+    def healthy(self):
+        if self._owner is None:
+            return False
+        try:
+            self._owner.http.status()
+            return True
+        except Exception:
+            return False
+
+    @contextmanager
+    def load(self, trace_path, stats=None):
+        """
+        Yield TraceProcessor đã load trace_path trên shell dùng chung.
+        stats (dict, optional) nhận shell_spawn_s / shell_teardown_s / shell_reused.
+        """
+        stats = stats if stats is not None else {}
+        teardown_s = spawn_s = 0.0
+        if self._owner is not None and (self.traces_served >= self.max_traces or not self.healthy()):
+            teardown_s = self.shutdown()
+        reused = self._owner is not None
+        if not reused:
+            start = time.perf_counter()
+            self._spawn()
+            spawn_s = time.perf_counter() - start
+        stats['shell_spawn_s'] = spawn_s
+        stats['shell_teardown_s'] = teardown_s
+        stats['shell_reused'] = reused
+
+        try:
+            tp = TraceProcessor(trace=trace_path, addr=self.addr)
+        except Exception:
+            # Load lỗi -> bỏ shell, trace sau sẽ spawn shell mới
+            self.shutdown()
+            raise
+        self.traces_served += 1
+        try:
+            yield tp
+        except (TraceTimeout,) + SHELL_CONNECTION_ERRORS:
+            # Query timeout / shell chết giữa chừng -> bỏ shell này
+            self.shutdown()
+            raise
+        finally:
+            # addr mode: close() chỉ đóng kết nối HTTP, shell vẫn sống
+            tp.close()
+
+
+def worker_shell(bin_path, max_traces=SHELL_MAX_TRACES):
+    """
+    Shell của worker process hiện tại (tạo lần đầu). Được tắt khi worker
+    thoát qua multiprocessing Finalize (pool.close + join).
+    """
+    global _WORKER_SHELL
+    if _WORKER_SHELL is None:
+        _WORKER_SHELL = TraceProcessorShell(bin_path, max_traces)
+        Finalize(None, _WORKER_SHELL.shutdown, exitpriority=10)
+    return _WORKER_SHELL
+
+
+@contextmanager
+def trace_deadline(seconds, on_expire):
+    """
+    Watchdog cho cả một trace: hết `seconds` thì gọi on_expire() (kill shell) từ
+    thread riêng; lỗi phát sinh sau đó trong body được đổi thành TraceTimeout,
+    body kết thúc bình thường sau khi hết hạn cũng raise TraceTimeout.
+    """
+    if not seconds:
+        yield
+        return
+    expired = threading.Event()
+
+    def fire():
+        expired.set()
+        on_expire()
+
+    timer = threading.Timer(seconds, fire)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    except TraceTimeout:
+        raise
+    except Exception as e:
+        if expired.is_set():
+            raise TraceTimeout(f"trace vượt quá {seconds}s") from e
+        raise
+    finally:
+        timer.cancel()
+    # Body kết thúc bình thường sau khi shell bị kill (helper nuốt lỗi) ->
+    # kết quả không đáng tin, vẫn là timeout
+    if expired.is_set():
+        raise TraceTimeout(f"trace vượt quá {seconds}s")
+
+
+@contextmanager
+def open_trace(trace_path, bin_path, reuse_shell=False, stats=None,
+               query_timeout=None, trace_timeout=None):
+    """
+    Context manager trả về TraceProcessor đã load trace_path:
+    - reuse_shell=False (mặc định): spawn shell riêng, shell tự đọc file theo path
+    - reuse_shell=True: dùng shell sống lâu của worker (worker_shell), trace
+      được stream qua HTTP /parse (xem đánh đổi ở đầu module)
+    query_timeout / trace_timeout (giây, None = không giới hạn): hết hạn thì
+    shell bị kill + reap và TraceTimeout được raise.
+    """
+    shell = worker_shell(bin_path) if reuse_shell else None
+    current = {}
+
+    def kill():
+        if shell is not None:
+            shell.kill()
+        elif current.get('tp') is not None:
+            kill_trace_processor(current['tp'])
+
+    with trace_deadline(trace_timeout, kill):
+        if shell is not None:
+            ctx = shell.load(trace_path, stats)
+        elif trace_timeout:
+            ctx = open_trace_by_path(trace_path, bin_path, load_timeout=int(trace_timeout))
+        else:
+            ctx = open_trace_by_path(trace_path, bin_path)
+        with ctx as tp:
+            current['tp'] = tp
+            if query_timeout:
+                set_query_timeout(tp, query_timeout)
+            try:
+                yield tp
+            except TimeoutError as e:
+                # Query treo: shell vẫn đang chạy query -> kill trước khi close
+                kill()
+                raise TraceTimeout(f"query vượt quá {query_timeout}s") from e
+
+
+def summarize_shell_stats(stats_list):
+    """
+    Gom stats shell của các trace -> (spawns, spawn_s, teardown_s, reused).
+    stats_list: iterable các dict ingest_stats.
+    """
+    spawns = reused = 0
+    spawn_s = teardown_s = 0.0
+    for stats in stats_list:
+        if 'shell_reused' not in stats:
+            continue
+        if stats['shell_reused']:
+            reused += 1
+        else:
+            spawns += 1
+        spawn_s += stats.get('shell_spawn_s', 0.0)
+        teardown_s += stats.get('shell_teardown_s', 0.0)
+    return spawns, spawn_s, teardown_s, reused
+
+
+def format_shell_summary(stats_list):
+    """Dòng báo cáo: số shell spawn, chi phí spawn/teardown và ước lượng thời gian tiết kiệm."""
+    spawns, spawn_s, teardown_s, reused = summarize_shell_stats(stats_list)
+    if not spawns and not reused:
+        return None
+    avg_spawn = spawn_s / spawns if spawns else 0.0
+    return (f"[SHELL] {spawns} spawned ({spawn_s:.1f}s spawn, {teardown_s:.1f}s teardown), "
+            f"{reused} reused (~{reused * avg_spawn:.1f}s spawn saved)")
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace_server.py
+
+Server mode để điều tra lại một trace mà không chạy lại cả pipeline: các trace
+vừa phân tích được giữ nguyên trong trace_processor_shell (mỗi trace một
+shell), client gửi SQL ad-hoc hoặc chạy lại analyze_trace trên trace đã load.
+
+Trace được giữ theo LRU: sau mỗi lần load/query, RSS thực của các shell được
+đo lại và trace dùng lâu nhất bị đóng cho tới khi tổng RSS nằm trong budget
+(hoặc số trace <= SERVER_MAX_TRACES).
+
+Server chỉ nghe trên 127.0.0.1 và xử lý tuần tự từng request (trace_processor
+không an toàn khi query song song trên cùng một kết nối).
+
+Cách dùng:
+    python trace_server.py serve [--port 9021] [--memory-budget-gb 8] [--use-cache]
+    python trace_server.py query <trace> "SELECT name, dur FROM slice ORDER BY dur DESC LIMIT 10"
+    python trace_server.py analyze <trace> [--startup-backend stdlib] [--json]
+    python trace_server.py list
+    python trace_server.py evict [<trace>]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Dict, Optional
+
+from trace_loader import open_trace_by_path, discard_scratch_trace, make_scratch_dir, remove_scratch_dir
+from trace_processor_pool import (
+    set_query_timeout, kill_trace_processor, QUERY_TIMEOUT_S, SHELL_CONNECTION_ERRORS,
+)
+from memory_scheduler import process_tree_rss, default_memory_budget
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 9021
+# Giới hạn số trace giữ đồng thời (kể cả khi không đo được RSS)
+SERVER_MAX_TRACES = 16
+# analyze_trace chạy hàng chục query -> client chờ lâu hơn một query đơn
+CLIENT_TIMEOUT_S = 900
+
+
+def _json_default(value):
+    """numpy scalar -> kiểu Python; còn lại -> str."""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class LoadedTrace:
+    """Một trace đang được giữ trong trace_processor_shell riêng."""
+
+    def __init__(self, trace_path, tp, load_s, ingest_stats):
+        self.trace_path = trace_path
+        self.tp = tp
+        self.load_s = load_s
+        self.ingest_stats = ingest_stats
+        self.rss = None
+        self.last_used = time.time()
+        self.requests = 0
+
+    def measure(self):
+        proc = getattr(self.tp, 'subprocess', None)
+        self.rss = process_tree_rss(proc.pid) if proc is not None else None
+
+    def alive(self):
+        """False nếu trace_processor_shell đã thoát (crash, bị kill)."""
+        proc = getattr(self.tp, 'subprocess', None)
+        return proc is not None and proc.poll() is None
+
+    def describe(self):
+        return {
+            'trace': self.trace_path,
+            'rss_mb': round(self.rss / 2**20, 1) if self.rss else None,
+            'load_s': round(self.load_s, 2),
+            'idle_s': round(time.time() - self.last_used, 1),
+            'requests': self.requests,
+            'source': self.ingest_stats.get('source'),
+        }
+
+
+class TraceServerState:
+    """LRU các trace đã load, evict theo tổng RSS của shell."""
+
+    def __init__(self, bin_path, memory_budget=None, max_traces=SERVER_MAX_TRACES,
+                 ingest_options=None, query_timeout=QUERY_TIMEOUT_S):
+        self.bin_path = bin_path
+        self.memory_budget = memory_budget
+        self.max_traces = max_traces
+        self.query_timeout = query_timeout
+        self.scratch_dir = make_scratch_dir()
+        self.ingest_options = dict(ingest_options or {}, scratch_dir=self.scratch_dir)
+        self.traces = OrderedDict()
+        self.pid_mappings = {}
+        self.evictions = 0
+
+    def _load(self, trace_path):
+        # Import muộn: client không cần stack converter/pandas
+        from trace_worker import load_ingest_payload
+
+        ingest_stats = {}
+        start = time.perf_counter()
+        payload_path, reason = load_ingest_payload(trace_path, self.ingest_options, ingest_stats)
+        if reason:
+            raise RuntimeError(f"trace bị loại: {reason}")
+        try:
+            tp = open_trace_by_path(payload_path, self.bin_path)
+        finally:
+            # Shell đã đọc xong file khi trả về -> bỏ scratch ngay để giải phóng tmpfs
+            if ingest_stats.get('source') == 'text':
+                discard_scratch_trace(payload_path)
+        if self.query_timeout:
+            set_query_timeout(tp, self.query_timeout)
+        entry = LoadedTrace(trace_path, tp, time.perf_counter() - start, ingest_stats)
+        print(f"[SERVER] loaded {os.path.basename(trace_path)} in {entry.load_s:.1f}s")
+        return entry
+
+    def get(self, trace_path):
+        """Trace đã load (load nếu chưa có), đánh dấu vừa dùng."""
+        trace_path = os.path.abspath(trace_path)
+        entry = self.traces.get(trace_path)
+        if entry is not None and not entry.alive():
+            # Shell đã chết từ request trước -> load lại
+            self.evict(trace_path)
+            entry = None
+        if entry is None:
+            entry = self._load(trace_path)
+            self.traces[trace_path] = entry
+        self.traces.move_to_end(trace_path)
+        entry.last_used = time.time()
+        entry.requests += 1
+        return entry
+
+    def total_rss(self):
+        return sum(entry.rss or 0 for entry in self.traces.values())
+
+    def enforce_budget(self, keep=None):
+        """Đo lại RSS rồi đóng trace ít dùng nhất tới khi trong budget (không evict `keep`)."""
+        for entry in self.traces.values():
+            entry.measure()
+        while len(self.traces) > 1:
+            over_count = len(self.traces) > self.max_traces
+            over_memory = self.memory_budget and self.total_rss() > self.memory_budget
+            if not over_count and not over_memory:
+                break
+            oldest = next(iter(self.traces))
+            if oldest == keep:
+                break
+            self.evict(oldest)
+
+    def evict(self, trace_path=None):
+        """Đóng một trace (hoặc tất cả nếu trace_path=None). Trả về list trace đã đóng."""
+        paths = list(self.traces) if trace_path is None else [os.path.abspath(trace_path)]
+        evicted = []
+        for path in paths:
+            entry = self.traces.pop(path, None)
+            if entry is None:
+                continue
+            try:
+                entry.tp.close()
+            except Exception:
+                pass
+            self.evictions += 1
+            evicted.append(path)
+            print(f"[SERVER] evicted {os.path.basename(path)}")
+        return evicted
+
+    def _run(self, trace_path, fn):
+        """
+        Chạy fn(entry) trên trace; shell treo/chết -> kill + bỏ trace khỏi cache.
+        [UPDATED] Kiểm tra shell còn sống sau fn: helper của analyze_trace có thể
+        nuốt lỗi SQL nên shell chết giữa chừng vẫn trả về kết quả (không đáng tin).
+        """
+        entry = self.get(trace_path)
+        try:
+            result = fn(entry)
+            if not entry.alive():
+                raise RuntimeError("trace_processor đã dừng trong lúc xử lý request")
+            return result
+        except SHELL_CONNECTION_ERRORS as e:
+            kill_trace_processor(entry.tp)
+            self.evict(entry.trace_path)
+            raise RuntimeError(f"trace_processor không phản hồi, đã đóng trace: {e}") from e
+        except Exception as e:
+            if entry.alive():
+                raise
+            self.evict(entry.trace_path)
+            raise RuntimeError(f"trace_processor đã dừng, đã đóng trace: {e}") from e
+        finally:
+            if entry.trace_path in self.traces:
+                self.enforce_budget(keep=entry.trace_path)
+
+    def query(self, trace_path, sql):
+        def run(entry):
+            start = time.perf_counter()
+            df = entry.tp.query(sql).as_pandas_dataframe()
+            return {'columns': list(df.columns),
+                    'rows': json.loads(df.to_json(orient='values')),
+                    'query_s': round(time.perf_counter() - start, 3)}
+        return self._run(trace_path, run)
+
+    def pid_mapping(self, trace_path):
+        """pid_mapping từ bugreport cùng folder (giống pipeline, extracted mode), cache theo folder."""
+        from dumpstate_parser import build_trace_bugreport_mapping
+
+        folder = os.path.dirname(trace_path)
+        if folder not in self.pid_mappings:
+            mapping = build_trace_bugreport_mapping(folder, extracted=True)
+            self.pid_mappings[folder] = {os.path.abspath(k): (v or {}).get('pid_mapping') or None
+                                         for k, v in mapping.items()}
+        return self.pid_mappings[folder].get(trace_path)
+
+    def analyze(self, trace_path, backend='queries'):
+        from startup_stdlib import analyze_trace_with_backend
+
+        def run(entry):
+            start = time.perf_counter()
+            stats = {}
+            metrics = analyze_trace_with_backend(entry.tp, entry.trace_path,
+                                                 self.pid_mapping(entry.trace_path),
+                                                 backend=backend, stats=stats)
+            metrics['ingest_stats'] = dict(entry.ingest_stats, **stats)
+            return {'metrics': json.loads(json.dumps(metrics, default=_json_default)),
+                    'analyse_s': round(time.perf_counter() - start, 3)}
+        return self._run(trace_path, run)
+
+    def describe(self):
+        return {
+            'traces': [entry.describe() for entry in reversed(self.traces.values())],
+            'total_rss_mb': round(self.total_rss() / 2**20, 1),
+            'memory_budget_mb': round(self.memory_budget / 2**20, 1) if self.memory_budget else None,
+            'max_traces': self.max_traces,
+            'evictions': self.evictions,
+        }
+
+    def close(self):
+        self.evict()
+        remove_scratch_dir(self.scratch_dir)
+
+
+class TraceRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /traces                          -> trace đang giữ + RSS
+    POST /query    {trace, sql}           -> {columns, rows, query_s}
+    POST /analyze  {trace, backend}       -> {metrics, analyse_s}
+    POST /evict    {trace (optional)}     -> {evicted}
+    """
+    state: TraceServerState = None
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, default=_json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/traces':
+            self._send(200, self.state.describe())
+        else:
+            self._send(404, {'error': f"unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send(400, {'error': f"invalid JSON: {e}"})
+            return
+        trace = request.get('trace')
+        try:
+            if self.path == '/query':
+                result = self.state.query(trace, request['sql'])
+            elif self.path == '/analyze':
+                result = self.state.analyze(trace, request.get('backend', 'queries'))
+            elif self.path == '/evict':
+                result = {'evicted': self.state.evict(trace)}
+            else:
+                self._send(404, {'error': f"unknown endpoint {self.path}"})
+                return
+        except (KeyError, TypeError) as e:
+            self._send(400, {'error': f"missing field: {e}"})
+            return
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+            return
+        self._send(200, result)
+
+    def log_message(self, format, *args):
+        print(f"[SERVER] {self.address_string()} {format % args}")
+
+
+def serve(port=SERVER_PORT, bin_path=None, memory_budget=None, max_traces=SERVER_MAX_TRACES,
+          ingest_options=None, query_timeout=QUERY_TIMEOUT_S):
+    if bin_path is None:
+        from execution_sql import TRACE_PROCESSOR_BIN
+        bin_path = TRACE_PROCESSOR_BIN
+    state = TraceServerState(bin_path, memory_budget, max_traces, ingest_options, query_timeout)
+    TraceRequestHandler.state = state
+    server = HTTPServer((SERVER_HOST, port), TraceRequestHandler)
+    budget = f"{memory_budget / 2**30:.1f} GB" if memory_budget else "none"
+    print(f"[SERVER] listening on http://{SERVER_HOST}:{port} | memory budget {budget} "
+          f"| max traces {max_traces}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        state.close()
+        print("[SERVER] stopped")
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+def request_server(endpoint: str, payload: Optional[Dict[str, Any]] = None,
+                   port: int = SERVER_PORT) -> Dict[str, Any]:
+    """Gửi request tới server (GET nếu payload None). Lỗi phía server -> RuntimeError."""
+    url = f"http://{SERVER_HOST}:{port}{endpoint}"
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=CLIENT_TIMEOUT_S) as resp:
+            return json.loads(resp.read())
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(json.loads(e.read() or b'{}').get('error', str(e))) from e
+    except urllib.error.URLError as e:
+        raise RuntimeError(f"không kết nối được trace server tại {url} "
+                           f"(chạy 'python trace_server.py serve' trước): {e.reason}") from e
+
+
+def _print_table(columns, rows):
+    import pandas as pd
+    with pd.option_context('display.max_rows', None, 'display.max_columns', None, 'display.width', None):
+        print(pd.DataFrame(rows, columns=columns).to_string(index=False))
+
+
+def _print_metrics(metrics):
+    for key, value in metrics.items():
+        if isinstance(value, (int, float, str)) or value is None:
+            print(f"  {key:<40} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Persistent trace_processor server for interactive re-query')
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p_serve = sub.add_parser('serve', help='Start the server')
+    p_serve.add_argument('--memory-budget-gb', type=float, default=None,
+                         help='RSS budget for loaded traces (default: 70%% of RAM, 0 = only --max-traces)')
+    p_serve.add_argument('--max-traces', type=int, default=SERVER_MAX_TRACES)
+    p_serve.add_argument('--use-cache', action='store_true',
+                         help='Load Perfetto protobuf traces from the convert-cache when available')
+    p_serve.add_argument('--cache-dir', default=None)
+    p_serve.add_argument('--query-timeout', type=float, default=QUERY_TIMEOUT_S,
+                         help='Limit in seconds for a single query (0 disables)')
+    p_serve.add_argument('--bin', default=None, help='trace_processor binary (default: bundled)')
+
+    p_query = sub.add_parser('query', help='Run SQL on a trace (loads it on first use)')
+    p_query.add_argument('trace')
+    p_query.add_argument('sql')
+
+    p_analyze = sub.add_parser('analyze', help='Re-run analyze_trace on a trace')
+    p_analyze.add_argument('trace')
+    p_analyze.add_argument('--startup-backend', choices=['queries', 'stdlib'], default='queries',
+                           help='stdlib: launch markers from android.startup, for parity checks against '
+                                'the default query backend only (not faster)')
+    p_analyze.add_argument('--json', action='store_true', help='Print the full metrics dict as JSON')
+
+    sub.add_parser('list', help='List loaded traces')
+    p_evict = sub.add_parser('evict', help='Close a loaded trace (all traces if omitted)')
+    p_evict.add_argument('trace', nargs='?')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if args.memory_budget_gb is None:
+            memory_budget = default_memory_budget()
+        else:
+            memory_budget = int(args.memory_budget_gb * 2**30) or None
+        serve(args.port, args.bin, memory_budget, args.max_traces,
+              {'use_cache': args.use_cache, 'cache_dir': args.cache_dir},
+              args.query_timeout or None)
+        return
+
+    try:
+        if args.command == 'query':
+            result = request_server('/query', {'trace': os.path.abspath(args.trace), 'sql': args.sql}, args.port)
+            _print_table(result['columns'], result['rows'])
+            print(f"({len(result['rows'])} rows, {result['query_s']}s)")
+        elif args.command == 'analyze':
+            result = request_server('/analyze', {'trace': os.path.abspath(args.trace),
+                                                 'backend': args.startup_backend}, args.port)
+            if args.json:
+                print(json.dumps(result['metrics'], indent=2, ensure_ascii=False))
+            else:
+                _print_metrics(result['metrics'])
+            print(f"(analyse {result['analyse_s']}s)")
+        elif args.command == 'list':
+            result = request_server('/traces', port=args.port)
+            for entry in result['traces']:
+                print(f"  {entry['trace']} | rss {entry['rss_mb']} MB | load {entry['load_s']}s "
+                      f"| idle {entry['idle_s']}s | {entry['requests']} requests")
+            print(f"Total {result['total_rss_mb']} MB / budget {result['memory_budget_mb']} MB "
+                  f"| {len(result['traces'])}/{result['max_traces']} traces | {result['evictions']} evictions")
+        elif args.command == 'evict':
+            payload = {'trace': os.path.abspath(args.trace) if args.trace else None}
+            result = request_server('/evict', payload, args.port)
+            print(f"Evicted {len(result['evicted'])} trace(s)")
+    except RuntimeError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
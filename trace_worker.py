@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+trace_worker.py
+
+Entry point gọn nhẹ cho worker của pipeline execution_sql (convert -> analyse).
+Worker không import execution_sql (xlsxwriter, dumpstate_parser, batch engine,
+các biến môi trường NumPy...), chỉ import những gì từng stage cần:
+- converter: atracetosystrace / trace_cache / trace_loader (không pandas, không perfetto)
+- analyser: thêm sql_query + trace_processor_pool (pandas, perfetto), được preload
+  một lần trong Pool initializer (init_analyser_worker)
+
+Initializer ghi lại thời gian khởi động của từng worker; stage đầu tiên mà
+worker chạy gắn số liệu này vào ingest_stats để process chính báo cáo
+(format_startup_summary).
+"""
+
+import importlib
+import multiprocessing
+import os
+import time
+from pathlib import Path
+from typing import Dict, Optional, Any, Tuple
+
+from atracetosystrace import (
+    load_trace_data, find_missing_markers, prescan_trace, trace_stem,
+    PRESCAN_CORRUPT_PAYLOAD, PRESCAN_INVALID_FORMAT, CORRUPT_PAYLOAD_ERRORS,
+)
+from trace_cache import cached_trace_path, cached_missing_markers
+from trace_loader import write_scratch_trace, discard_scratch_trace
+
+# ---------------------------------------------------------------------------
+# Configuration & Constants
+# ---------------------------------------------------------------------------
+# Pre-validation: marker bắt buộc (marker -> lý do loại) kiểm tra ở mức byte
+# trước khi spawn trace_processor. analyze_trace raise nếu thiếu các marker này.
+# Recent case không cần 'launching:' (analyze_trace tự gán launcher pkg).
+REQUIRED_MARKERS = {
+    b'deliverInputEvent': 'missing_deliver_input',
+    b'launching:': 'missing_launching',
+}
+RECENT_REQUIRED_MARKERS = {
+    b'deliverInputEvent': 'missing_deliver_input',
+}
+ANALYSIS_ERROR = 'analysis_error'
+# [NEW] Trace vượt quá trace/query timeout sau số lần thử tối đa
+ANALYSIS_TIMEOUT = 'analysis_timeout'
+
+# Module được preload trong Pool initializer của từng loại worker
+CONVERTER_PRELOAD = ('atracetosystrace', 'trace_cache', 'trace_loader')
+ANALYSER_PRELOAD = ('sql_query', 'trace_processor_pool', 'memory_scheduler', 'startup_stdlib',
+                    'slice_tables')
+
+# Số liệu khởi động của worker hiện tại, gửi về process chính một lần
+_WORKER_STARTUP = None
+# [NEW] Queue (từ Pool initializer) báo (stage, file_path, pid) khi một task bắt
+# đầu chạy, để process chính phát hiện task mất do worker chết (xem report_task_start)
+_TASK_STARTS = None
+
+
+def _init_worker(role: str, preload, task_starts=None) -> None:
+    global _WORKER_STARTUP, _TASK_STARTS
+    _TASK_STARTS = task_starts
+    start = time.perf_counter()
+    for name in preload:
+        importlib.import_module(name)
+    _WORKER_STARTUP = {'role': role, 'pid': os.getpid(), 'ready_at': time.time(),
+                       'init_s': time.perf_counter() - start}
+
+
+def init_converter_worker(task_starts=None) -> None:
+    """Pool initializer cho converter worker."""
+    _init_worker('converter', CONVERTER_PRELOAD, task_starts)
+
+
+def init_analyser_worker(task_starts=None) -> None:
+    """Pool initializer cho analyser worker: import pandas/perfetto/sql_query trước trace đầu tiên."""
+    _init_worker('analyser', ANALYSER_PRELOAD, task_starts)
+
+
+def report_task_start(stage: str, file_path: str) -> None:
+    """Báo process chính task (stage, file_path) đang chạy trên worker này."""
+    if _TASK_STARTS is not None:
+        _TASK_STARTS.put((stage, file_path, os.getpid()))
+
+
+def pool_context(start_method: Optional[str] = None):
+    """
+    multiprocessing context cho pool của pipeline (None = mặc định của nền tảng).
+    forkserver: server import sẵn __main__, trace_worker và module của analyser
+    đúng một lần; mọi worker được fork từ server nên không phải import lại.
+    """
+    ctx = multiprocessing.get_context(start_method)
+    if ctx.get_start_method() == 'forkserver':
+        ctx.set_forkserver_preload(['__main__', 'trace_worker', *ANALYSER_PRELOAD])
+    return ctx
+
+
+def _attach_startup_stats(ingest_stats: Dict[str, Any]) -> None:
+    """Gắn số liệu khởi động vào ingest_stats của task đầu tiên mà worker chạy."""
+    global _WORKER_STARTUP
+    if _WORKER_STARTUP is not None:
+        ingest_stats[_WORKER_STARTUP['role'] + '_startup'] = _WORKER_STARTUP
+        _WORKER_STARTUP = None
+
+
+def format_startup_summary(start_method: str, pool_started_at: float, startups) -> Optional[str]:
+    """
+    Dòng báo cáo thời gian khởi động worker theo role.
+    startups: list dict {'role', 'pid', 'ready_at', 'init_s'} (mỗi worker một lần).
+    """
+    by_role = {}
+    for startup in startups:
+        by_role.setdefault(startup['role'], []).append(startup)
+    if not by_role:
+        return None
+    parts = []
+    for role in ('converter', 'analyser'):
+        items = by_role.get(role)
+        if not items:
+            continue
+        ready_s = max(item['ready_at'] for item in items) - pool_started_at
+        init_s = sum(item['init_s'] for item in items) / len(items)
+        parts.append(f"{len(items)} {role}s ready after {ready_s:.2f}s (imports {init_s:.2f}s avg)")
+    return f"[WORKERS] start method {start_method}: " + " | ".join(parts)
+
+
+def _required_markers(file_path: str) -> Dict[bytes, str]:
+    """Marker bắt buộc theo loại trace (xem REQUIRED_MARKERS)."""
+    if "recent" in trace_stem(file_path).lower():
+        return RECENT_REQUIRED_MARKERS
+    return REQUIRED_MARKERS
+
+
+def load_ingest_payload(file_path: str, ingest_options: Dict[str, Any],
+                         ingest_stats: Dict[str, Any]) -> Tuple[Any, Optional[str]]:
+    """
+    Chuẩn bị payload cho trace_processor và pre-validate ngay trên đó.
+    Trả về (trace_path, None) hoặc (None, reason) nếu trace bị loại.
+    [UPDATED] Payload text được ghi một lần ra scratch file (tmpfs) để shell
+    tự đọc theo path; source == 'text' nghĩa là người gọi phải xoá file này.
+    """
+    required = _required_markers(file_path)
+
+    # [NEW] Ưu tiên bản Perfetto protobuf trong convert-cache (xem trace_cache.py)
+    cached = cached_trace_path(file_path, ingest_options.get('cache_dir')) if ingest_options.get('use_cache') else None
+    if cached:
+        missing = cached_missing_markers(cached, required)
+        if missing:
+            return None, missing[0]
+        ingest_stats['source'] = 'cache'
+        ingest_stats['payload_bytes'] = os.path.getsize(cached)
+        return cached, None
+
+    # Pre-scan ở mức byte trước: trace thiếu marker / hỏng bị loại mà không decode cả payload
+    reason = prescan_trace(file_path, required)
+    if reason:
+        return None, reason
+
+    # [UPDATED] Chỉ đưa ftrace text vào trace_processor (không dựng HTML systrace)
+    try:
+        trace_data = load_trace_data(file_path,
+                                     crop_window=ingest_options.get('crop_window'),
+                                     event_allowlist=ingest_options.get('event_allowlist'),
+                                     stats=ingest_stats)
+    except CORRUPT_PAYLOAD_ERRORS:
+        return None, PRESCAN_CORRUPT_PAYLOAD
+    except Exception:
+        return None, PRESCAN_INVALID_FORMAT
+
+    missing = find_missing_markers(trace_data, required)
+    if missing:
+        return None, missing[0]
+    ingest_stats['source'] = 'text'
+    ingest_stats['payload_bytes'] = len(trace_data)
+    scratch_path = write_scratch_trace(trace_data, ingest_options.get('scratch_dir'))
+    # Giải phóng buffer trước khi shell load, worker không giữ payload trong lúc phân tích
+    del trace_data
+    return scratch_path, None
+
+
+def _skipped_result(task, reason: str):
+    file_path, occurrence, app_name = task[0], task[1], task[2]
+    category = 'entry' if occurrence % 2 == 1 else 'reentry'
+    return (app_name, occurrence, category, None, trace_stem(file_path), reason)
+
+
+def _convert_stage_worker(task):
+    """
+    Stage 1 (converter pool): convert + pre-validate, ghi payload ra scratch.
+    Trả về (task, trace_path, ingest_stats, reason); reason != None nghĩa là bị loại.
+    """
+    file_path, ingest_options = task[0], task[5] or {}
+    report_task_start('convert', file_path)
+    ingest_stats = {}
+    _attach_startup_stats(ingest_stats)
+    try:
+        trace_path, reason = load_ingest_payload(file_path, ingest_options, ingest_stats)
+    except Exception as e:
+        print(f"    [ERROR] {Path(file_path).name}: {e}")
+        return (task, None, ingest_stats, ANALYSIS_ERROR)
+    if reason:
+        # [NEW] Trace không dùng được -> bỏ qua, không spawn trace_processor
+        print(f"    [SKIP] {Path(file_path).name}: {reason}")
+    return (task, trace_path, ingest_stats, reason)
+
+
+def _analyse_stage_worker(args):
+    """
+    Stage 2 (analyser pool): load payload vào trace_processor và chạy analyze_trace.
+    Scratch payload luôn bị xoá khi kết thúc.
+    [NEW] ingest_options['reaction']: chạy thêm analyze_reaction_trace trên cùng
+    instance, kết quả có thêm phần tử thứ 7 (reaction_metrics, reason).
+    """
+    # Stack phân tích (pandas, perfetto) chỉ import trong analyser worker
+    from startup_stdlib import analyze_trace_with_backend
+    from trace_processor_pool import open_trace, TraceTimeout, SHELL_CONNECTION_ERRORS
+    from memory_scheduler import process_tree_rss
+    from slice_tables import prepare_slice_tables
+
+    task, trace_path, ingest_stats = args
+    report_task_start('analyse', task[0])
+    _attach_startup_stats(ingest_stats)
+    # [NEW] ingest_options: option cho bước conversion (vd. crop_window)
+    file_path, occurrence, app_name, pid_mapping, mapping_info, ingest_options = task
+    filename = trace_stem(file_path)
+    category = 'entry' if occurrence % 2 == 1 else 'reentry'
+    
+    # DEBUG: Kiểm tra xem worker có nhận được mapping không
+    # if pid_mapping:
+    #     print(f"    [DEBUG Worker] {filename} received mapping with {len(pid_mapping)} entries")
+    
+    ingest_options = ingest_options or {}
+    # [NEW] Chạy cả analyze_reaction_trace trên cùng trace đã load (execution + reaction)
+    with_reaction = ingest_options.get('reaction', False)
+    try:
+        # [UPDATED] Dùng lại shell sống lâu của worker (reuse_shell), hoặc spawn shell
+        # riêng đọc trace trực tiếp theo path
+        load_start = time.perf_counter()
+        with open_trace(trace_path, ingest_options['bin_path'],
+                        reuse_shell=ingest_options.get('reuse_shell', False),
+                        stats=ingest_stats,
+                        query_timeout=ingest_options.get('query_timeout'),
+                        trace_timeout=ingest_options.get('trace_timeout')) as tp:
+            ingest_stats['ingest_s'] = time.perf_counter() - load_start
+            # [NEW] slice_tables 'table': materialise slice_with_names; query được đo theo helper
+            tp = prepare_slice_tables(tp, ingest_options.get('slice_tables', 'view'), ingest_stats)
+            # Truyền pid_mapping vào analyze_trace
+            # [NEW] startup_backend 'stdlib': mốc launch lấy từ android.startup (startup_stdlib.py)
+            try:
+                metrics = analyze_trace_with_backend(tp, file_path, pid_mapping,
+                                                     backend=ingest_options.get('startup_backend', 'queries'),
+                                                     parity=ingest_options.get('stdlib_parity', False),
+                                                     stats=ingest_stats)
+            except SHELL_CONNECTION_ERRORS:
+                # Shell bị kill (timeout) / chết -> open_trace đổi thành TraceTimeout
+                raise
+            except Exception as e:
+                if not with_reaction:
+                    raise
+                # Execution lỗi vẫn chạy reaction trên trace đã load
+                print(f"    [ERROR] {Path(file_path).name}: {e}")
+                metrics = None
+            reaction = _reaction_stage(tp, file_path) if with_reaction else None
+            # [NEW] RSS thực của worker + trace_processor_shell (cho MemoryScheduler)
+            ingest_stats['worker_rss'] = process_tree_rss()
+            if metrics is not None:
+                metrics['ingest_stats'] = ingest_stats
+            result = (app_name, occurrence, category, metrics, filename,
+                      None if metrics is not None else ANALYSIS_ERROR)
+            return result + (reaction,) if with_reaction else result
+    except TraceTimeout as e:
+        # [NEW] Shell đã bị kill + reap; pipeline quyết định retry
+        print(f"    [TIMEOUT] {Path(file_path).name}: {e}")
+        return (app_name, occurrence, category, None, filename, ANALYSIS_TIMEOUT)
+    except Exception as e:
+        print(f"    [ERROR] {Path(file_path).name}: {e}")
+        # import traceback
+        # traceback.print_exc()
+        return (app_name, occurrence, category, None, filename, ANALYSIS_ERROR)
+    finally:
+        if trace_path and ingest_stats.get('source') == 'text':
+            discard_scratch_trace(trace_path)
+
+
+def _reaction_stage(tp, file_path: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    analyze_reaction_trace trên TraceProcessor đã load sẵn.
+    Trả về (metrics, None) hoặc (None, ANALYSIS_ERROR); lỗi kết nối shell được raise lại.
+    """
+    from reaction_analysis import analyze_reaction_trace
+    from trace_processor_pool import SHELL_CONNECTION_ERRORS
+
+    try:
+        return analyze_reaction_trace(tp, file_path), None
+    except SHELL_CONNECTION_ERRORS:
+        raise
+    except Exception as e:
+        print(f"    [ERROR REACTION] {Path(file_path).name}: {e}")
+        return None, ANALYSIS_ERROR
+
+
+def _process_single_trace_worker(args):
+    """
+    Worker function cho multiprocessing.
+    [UPDATED] Nhận trực tiếp pid_mapping từ tham số, không dùng biến Global.
+    [NEW] Trả thêm reason (None nếu thành công) để ghi vào run summary.
+    [UPDATED] Chạy tuần tự 2 stage (convert -> analyse) trong cùng một process;
+    process_all_traces dùng _run_trace_pipeline để chạy 2 stage song song.
+    """
+    task, trace_path, ingest_stats, reason = _convert_stage_worker(args)
+    if reason:
+        return _skipped_result(task, reason)
+    return _analyse_stage_worker((task, trace_path, ingest_stats))
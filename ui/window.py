@@ -56,6 +56,12 @@ class WorkerThread(QThread):
                 # FIX: Truyền target_apps vào hàm run_analysis
                 execution_sql.run_analysis(self.dut, self.ref, self.target_apps)
 
+            elif self.mode == "execution+reaction":
+                # [NEW] Chọn cả 2 mode: mỗi trace chỉ load một lần cho cả execution và reaction
+                import execution_sql
+                importlib.reload(execution_sql)
+                execution_sql.run_analysis(self.dut, self.ref, self.target_apps, with_reaction=True)
+
             elif self.mode == "reaction":
                 import reaction_sql
                 importlib.reload(reaction_sql)
@@ -321,6 +327,11 @@ class MainWindow(QWidget):
             QMessageBox.warning(self, "Cảnh báo", "Bạn chưa chọn App nào để phân tích!")
             return
 
+        # [NEW] Execution + Reaction chạy chung một lượt (load trace một lần)
+        if "execution" in selected_modes and "reaction" in selected_modes:
+            selected_modes[selected_modes.index("execution")] = "execution+reaction"
+            selected_modes.remove("reaction")
+
         # Store queue and start first mode
         self.mode_queue = selected_modes
         self.current_mode_index = 0